@@ -28,6 +28,14 @@ setup(
             'version.txt',
         ],
     },
+    extras_require={
+        'aio': [
+            'aiohttp',
+        ],
+        'fast': [
+            'orjson',
+        ],
+    },
     entry_points={
         'console_scripts': [
             'dashex = dashex.__main__:main',
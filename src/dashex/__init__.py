@@ -1,213 +1,1229 @@
 # -*- coding: utf-8 -*-
 
 
-import json
+import collections
+import contextlib
+import functools
 import glob
+import hashlib
+import itertools
+import logging
 import os.path
-import pkg_resources
-import requests
-import requests.exceptions
+import threading
 import time
 import timeit
 
-from ._compat import urljoin
-from ._utils import ensure_dir
+from ._bundle import BundleReader, BundleWriter
+from ._cache import (
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_CACHE_TTL,
+    HTTPCache,
+    default_cache_path,
+)
+from ._compat import string_types
+from ._deadline import Deadline, DeadlineExceeded, bounded_timeout
+from ._http import (
+    Client,
+    DEFAULT_COMPRESS_MIN_SIZE,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+)
+from ._influx import DEFAULT_DATABASE, InfluxSink, report_points
+from ._json import (
+    iter_pretty as _iter_pretty,
+    loads as _loads,
+    pretty as _pretty,
+)
+from ._log import DEFAULT_PROGRESS_INTERVAL, Progress
+from ._manifest import (
+    Manifest,
+    PushState,
+    default_state_path,
+    json_sha256,
+)
+from ._metrics import Metrics
+from ._readiness import (
+    DEFAULT_PROBE_TIMEOUT,
+    DEFAULT_WAIT_TIMEOUT,
+    HEALTH_PATHS,
+    NOT_READY_STATUSES,
+    Backoff,
+)
+from ._scheduler import Scheduler
+from ._throttle import RateLimiter, RetryPolicy
+from ._watch import (
+    DEFAULT_DEBOUNCE,
+    DEFAULT_POLL_INTERVAL,
+    wait_for_changes,
+    watch_folders,
+)
+from ._utils import (
+    atomic_write,
+    ensure_dir,
+    parallel_map,
+    rechunk,
+    remove_file,
+    update_file,
+    update_file_chunks,
+)
 
 
-version = pkg_resources.resource_string('dashex', 'version.txt')
-version = version.decode('utf-8').strip()
+def _read_version():
+    path = os.path.join(os.path.dirname(__file__), 'version.txt')
+    with open(path, 'rb') as stream:
+        return stream.read().decode('utf-8').strip()
+
+
+version = _read_version()
 """Package version (PEP 440 version identifier)."""
 
+log = logging.getLogger(__name__)
+
 
 def get_json(host, path, credentials=None):
     """Download a JSON object."""
-
-    rep = requests.get(
-        urljoin(host, path),
-        auth=credentials,
-    )
-    rep.raise_for_status()
-    return rep.json()
+    with Client(host, credentials=credentials) as client:
+        return client.get_json(path)
 
 
 def post_json(host, path, data={}, credentials=None):
     """Upload a JSON object."""
-
-    rep = requests.post(
-        urljoin(host, path),
-        auth=credentials,
-        headers={
-            'Content-Type': 'application/json',
-        },
-        data=json.dumps(data),
-    )
-    rep.raise_for_status()
-    return rep.json()
+    with Client(host, credentials=credentials) as client:
+        return client.post_json(path, data=data)
 
 
 def put_json(host, path, data={}, credentials=None):
     """Upload a JSON object."""
-
-    rep = requests.put(
-        urljoin(host, path),
-        auth=credentials,
-        headers={
-            'Content-Type': 'application/json',
-        },
-        data=json.dumps(data),
-    )
-    rep.raise_for_status()
-    return rep.json()
+    with Client(host, credentials=credentials) as client:
+        return client.put_json(path, data=data)
 
 
 def json_pp(doc):
     """Render JSON in normalized format."""
-    return json.dumps(doc, indent=2, sort_keys=True, separators=(',', ': '))
+    return _pretty(doc).decode('utf-8')
+
+
+def load_json(path):
+    """Load a JSON document from disk."""
+    with open(path, 'rb') as stream:
+        return _loads(stream.read())
+
+
+def dump_json(document):
+    """Render a JSON document as the bytes of a file in normalized format."""
+    return _pretty(document) + b'\n'
+
+
+def iter_dump_json(document):
+    """Render a JSON document like :py:func:`dump_json`, as a stream.
+
+    The document is rendered a piece at a time (see
+    :py:func:`dashex._json.iter_pretty`), in blocks of bytes.
+    """
+    return rechunk(itertools.chain(_iter_pretty(document), [b'\n']))
+
+
+def save_json(path, document):
+    """Save a JSON document to disk in normalized format.
+
+    The file is replaced atomically, and only if its contents change.
+    Returns the bytes of the document.
+    """
+    data = dump_json(document)
+    update_file(path, data)
+    return data
+
+
+SEARCH_PAGE_SIZE = 1000
+"""Number of search results requested per page."""
+
+
+def search_path(page, limit=SEARCH_PAGE_SIZE):
+    """Build the API path for a page of dashboard search results."""
+    return 'api/search?type=dash-db&limit=%d&page=%d' % (limit, page)
+
+
+def repeated_search_page(results, previous):
+    """Check if a page of search results repeats the previous page.
+
+    Instances that don't support paging return the same (first) page over
+    and over again, whatever page is requested.
+    """
+    return bool(previous) and bool(results) and results[0] == previous[0]
+
+
+def iter_search(client, limit=None):
+    """Lazily enumerate all dashboards, one page of results at a time."""
+    limit = limit or SEARCH_PAGE_SIZE
+    page, previous = 1, None
+    while True:
+        results = client.get_json(search_path(page, limit))
+        if repeated_search_page(results, previous):
+            return
+        for result in results:
+            yield result
+        if len(results) < limit:
+            return
+        page, previous = page + 1, results
+
+
+def dashboard_slugs(search):
+    """List slugs of dashboards in search results."""
+    return [
+        document['uri'].split('/', 1)[1]
+        for document in search if document['type'] == 'dash-db'
+    ]
+
+
+def strip_datasource(document):
+    """Remove instance-specific fields from a data source."""
+    for field in ('id', 'orgId', 'typeLogoUrl'):
+        del document[field]
+    return document
+
+
+def strip_dashboard(document):
+    """Remove instance-specific fields from a dashboard."""
+    del document['dashboard']['id']
+    return document
+
+
+def grafana_client(grafana_url, username, password,
+                   pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES,
+                   max_rate=None, max_concurrency=None,
+                   timeout=DEFAULT_TIMEOUT, deadline=None, metrics=None,
+                   cache=False, cache_path=None, cache_ttl=DEFAULT_CACHE_TTL,
+                   cache_size=DEFAULT_CACHE_SIZE, compress=False,
+                   compress_min_size=DEFAULT_COMPRESS_MIN_SIZE):
+    """Create a pooled HTTP client for a Grafana instance.
+
+    Transient failures are retried up to ``retries`` times.  Requests start
+    at most ``max_rate`` per second, with at most ``max_concurrency`` of them
+    in flight at any given time (both unlimited by default).
+
+    Each request gets ``(connect, read)`` ``timeout`` seconds.  With a
+    ``deadline`` (in seconds), requests made after that much time has
+    elapsed raise :py:class:`DeadlineExceeded`.
+
+    All requests are recorded in ``metrics`` (see :py:func:`save_metrics`).
+
+    With ``cache``, JSON responses are kept in ``cache_path`` (in the user's
+    cache folder by default) and reused for ``cache_ttl`` seconds, then
+    revalidated (see :py:class:`dashex._cache.HTTPCache`).  The least
+    recently used responses are evicted beyond ``cache_size`` bytes.
+
+    With ``compress``, uploads of at least ``compress_min_size`` bytes are
+    compressed, unless the instance turns out not to accept it (see
+    :py:class:`dashex._http.Client`).
+    """
+    if cache:
+        cache = HTTPCache(cache_path or default_cache_path(), ttl=cache_ttl,
+                          max_size=cache_size)
+    return Client(
+        grafana_url,
+        credentials=(username, password),
+        pool_size=pool_size,
+        retry=RetryPolicy(retries=retries),
+        limiter=RateLimiter(rate=max_rate, concurrency=max_concurrency),
+        timeout=timeout,
+        deadline=Deadline(deadline),
+        metrics=metrics,
+        cache=cache or None,
+        compress_min_size=compress_min_size if compress else None,
+    )
+
+
+def save_metrics(metrics, path, format='json'):
+    """Save a report of HTTP requests and local work done during a run.
+
+    The report is rendered as ``json`` or in Prometheus text exposition
+    format (``prometheus``), e.g. for the node exporter's textfile collector.
+    """
+    data = metrics.render(format).encode('utf-8')
+    atomic_write(path, data)
+
+
+@contextlib.contextmanager
+def recording(command, grafana_url, metrics_path=None, metrics_format='json',
+              influxdb_url=None, influxdb_database=DEFAULT_DATABASE):
+    """Record metrics for the duration of a command.
+
+    The whole command is timed as a phase named after it.  With
+    ``metrics_path``, a report is saved there at the end (see
+    :py:func:`save_metrics`).  With ``influxdb_url``, requests are written to
+    ``influxdb_database`` while the command runs, followed by a summary of
+    the run (see :py:func:`dashex._influx.report_points`).  Either happens
+    even when the command fails.
+    """
+    sink = None
+    if influxdb_url is not None:
+        sink = InfluxSink(influxdb_url, influxdb_database)
+    metrics = Metrics(sink=sink)
+    try:
+        with metrics.phase(command):
+            yield metrics
+    finally:
+        if metrics_path is not None:
+            save_metrics(metrics, metrics_path, metrics_format)
+        if sink is not None:
+            report_points(sink, metrics, {
+                'command': command,
+                'grafana': grafana_url,
+            })
+            sink.close()
+            if sink.dropped or sink.failed:
+                log.warning('%d metrics dropped, %d not accepted by '
+                            'InfluxDB.', sink.dropped, sink.failed)
 
 
 def grafana_wait(grafana_url, username, password,
-                 timeout=None, clock=timeit.default_timer):
-    """Poll Grafana until its API is repsonsive."""
+                 timeout=None, clock=timeit.default_timer, client=None,
+                 probe_timeout=DEFAULT_PROBE_TIMEOUT, backoff=None):
+    """Poll Grafana until its API is responsive.
+
+    Grafana's health endpoint is probed (see
+    :py:data:`dashex._readiness.HEALTH_PATHS`) with ``probe_timeout``
+    connect and read timeouts.  Connection errors, timeouts and gateway
+    errors mean Grafana isn't ready yet: the probe is repeated after short,
+    growing delays (see :py:class:`dashex._readiness.Backoff`) until
+    ``timeout`` seconds have elapsed.
+    """
 
-    ref = clock()
+    if client is None:
+        with grafana_client(grafana_url, username, password) as client:
+            return grafana_wait(grafana_url, username, password,
+                                timeout=timeout, clock=clock, client=client,
+                                probe_timeout=probe_timeout, backoff=backoff)
 
-    def elapsed():
-        return clock() - ref
+    import requests.exceptions
 
-    while (timeout is None) or (elapsed() < timeout):
-        print('Pinging Grafana...')
+    deadline = Deadline(timeout, clock)
+    delays = iter(backoff or Backoff())
+    paths = list(HEALTH_PATHS)
+    log.info('Waiting for Grafana...')
+    while not deadline.expired():
         try:
-            rep = requests.get(
-                urljoin(grafana_url, 'api/admin/stats'),
-                auth=(username, password),
-            )
-        except requests.exceptions.ConnectionError:
-            print('  not ready, retrying in 1 second...')
-            time.sleep(1.0)
+            rep = client.get(paths[0], retry=False,
+                             timeout=bounded_timeout(probe_timeout, deadline))
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout):
+            rep = None
+        if rep is not None and rep.status_code == 404 and len(paths) > 1:
+            paths.pop(0)
             continue
-        rep.raise_for_status()
-        print('  ready!')
-        return
+        if rep is not None and rep.status_code not in NOT_READY_STATUSES:
+            rep.raise_for_status()
+            log.info('Grafana is ready.')
+            return
+        time.sleep(deadline.bound(next(delays)))
 
     raise Exception('Grafana is unresponsive at this time.')
 
 
-def grafana_pull(grafana_url, username, password, output_path):
-    """Pull Grafana configuration to disk."""
+def dashboard_version(client, dashboard_id):
+    """Fetch the latest version number of a dashboard.
+
+    Returns ``None`` if the instance doesn't expose dashboard versions.
+    """
+    import requests.exceptions
+    try:
+        versions = client.get_json(
+            'api/dashboards/id/%s/versions?limit=1' % (dashboard_id,)
+        )
+    except requests.exceptions.HTTPError as error:
+        if error.response.status_code != 404:
+            raise
+        return None
+    if not versions:
+        return None
+    return versions[0]['version']
+
+
+def grafana_pull(grafana_url, username, password, output_path,
+                 pool_size=DEFAULT_POOL_SIZE, jobs=1, incremental=False,
+                 bundle=None, retries=DEFAULT_RETRIES, max_rate=None,
+                 max_concurrency=None, timeout=DEFAULT_TIMEOUT, deadline=None,
+                 metrics_path=None, metrics_format='json', influxdb_url=None,
+                 influxdb_database=DEFAULT_DATABASE,
+                 progress_interval=DEFAULT_PROGRESS_INTERVAL, cache=False,
+                 cache_path=None, cache_ttl=DEFAULT_CACHE_TTL,
+                 cache_size=DEFAULT_CACHE_SIZE, client=None):
+    """Pull Grafana configuration to disk.
+
+    Search results are enumerated page by page.  With ``jobs`` greater than
+    1, dashboards are downloaded concurrently, but files are still written
+    in listing order.
+
+    With ``incremental``, the remote version of each dashboard is recorded
+    in ``grafana/manifest.json``.  Dashboards whose remote version and local
+    file are unchanged since the last pull are not downloaded again and
+    files of dashboards deleted remotely are removed.
+
+    Files are replaced atomically and only when their contents change, so
+    unchanged files keep their modification time.  Returns counts of
+    ``written``, ``unchanged`` and ``deleted`` files.
+
+    With ``bundle``, all documents are streamed into a single compressed
+    archive at that path instead of one file per object in ``output_path``
+    (see :py:class:`dashex._bundle.BundleWriter`).  Bundles are always
+    written from scratch, so they can't be combined with ``incremental``.
+
+    See :py:func:`grafana_client` for ``retries``, ``max_rate``,
+    ``max_concurrency``, ``timeout``, ``deadline`` and the ``cache``
+    options.  When the deadline passes, in-flight work is abandoned and
+    :py:class:`DeadlineExceeded` is raised, with counts of what was done as
+    its ``summary``.
+
+    With ``metrics_path``, a report of the run is saved there at the end
+    and with ``influxdb_url``, metrics are written to InfluxDB (see
+    :py:func:`recording`).
 
-    # Prepare to store contents on disk.
+    Progress is logged every ``progress_interval`` seconds (see
+    :py:class:`dashex._log.Progress`).
+    """
+
+    if bundle is not None and incremental:
+        raise ValueError('Incremental pulls are not supported for bundles.')
+
+    if client is None:
+        with recording('pull', grafana_url, metrics_path, metrics_format,
+                       influxdb_url, influxdb_database) as metrics:
+            with grafana_client(grafana_url, username, password,
+                                pool_size=max(pool_size, jobs),
+                                retries=retries, max_rate=max_rate,
+                                max_concurrency=max_concurrency,
+                                timeout=timeout, deadline=deadline,
+                                metrics=metrics, cache=cache,
+                                cache_path=cache_path, cache_ttl=cache_ttl,
+                                cache_size=cache_size) as client:
+                return grafana_pull(grafana_url, username, password,
+                                    output_path, jobs=jobs,
+                                    incremental=incremental, bundle=bundle,
+                                    progress_interval=progress_interval,
+                                    client=client)
+
+    progress = Progress('Pulled', progress_interval)
+    if bundle is not None:
+        with BundleWriter(bundle) as writer:
+            summary = _pull(client, jobs, progress, writer=writer)
+    else:
+        summary = _pull(client, jobs, progress,
+                        output_path=pull_folder(output_path),
+                        incremental=incremental)
+    log.info('Wrote %d changed files, %d unchanged, deleted %d.',
+             summary['written'], summary['unchanged'], summary['deleted'],
+             extra={'data': summary})
+    return summary
+
+
+def pull_folder(output_path):
+    """Prepare the layout of a pull in ``output_path``, return its root."""
     ensure_dir(output_path)
     output_path = os.path.join(output_path, 'grafana')
     ensure_dir(output_path)
-
-    # Fetch all data sources.
     ensure_dir(os.path.join(output_path, 'datasources'))
-    for document in get_json(grafana_url, 'api/datasources',
-                             credentials=(username, password)):
-        slug = document['name']
-        path = os.path.join(output_path, 'datasources', '%s.json' % (slug,))
-        print(path)
-        for field in ('id', 'orgId', 'typeLogoUrl'):
-            del document[field]
-        with open(path, 'wb') as stream:
-            stream.write(json_pp(document).encode('utf-8'))
-            stream.write(b'\n')
-
-    # Fetch all dashboards (except Home, which we can't edit).
     ensure_dir(os.path.join(output_path, 'dashboards'))
-    for document in get_json(grafana_url, 'api/search',
-                             credentials=(username, password)):
-        if document['type'] != 'dash-db':
-            continue
-        slug = document['uri'].split('/', 1)[1]
-        document = get_json(grafana_url, 'api/dashboards/db/%s' % (slug,),
-                            credentials=(username, password))
-        del document['dashboard']['id']
-        path = os.path.join(output_path, 'dashboards', '%s.json' % (slug,))
-        print(path)
-        with open(path, 'wb') as stream:
-            stream.write(json_pp(document).encode('utf-8'))
-            stream.write(b'\n')
+    return output_path
+
+
+def _pull(client, jobs, progress, output_path=None, incremental=False,
+          writer=None, manifest=None):
+    """Download configuration to a folder or, with ``writer``, a bundle.
+
+    Incremental pulls load the manifest from ``output_path``, unless one is
+    given.  It's only saved when modified.
+    """
+
+    summary = collections.Counter(written=0, unchanged=0, deleted=0)
+    if incremental and manifest is None:
+        manifest = Manifest.load(os.path.join(output_path, 'manifest.json'))
+
+    metrics = client.metrics
+
+    def write(path, document):
+        # Render the document straight into the file (or the comparison
+        # with the file), never holding the whole rendering in memory.
+        digest = hashlib.sha256()
+        rendering = [0.0]
+
+        def chunks():
+            stream = iter_dump_json(document)
+            while True:
+                start = metrics.clock()
+                chunk = next(stream, None)
+                rendering[0] += metrics.clock() - start
+                if chunk is None:
+                    return
+                digest.update(chunk)
+                yield chunk
+
+        start = metrics.clock()
+        changed = update_file_chunks(path, chunks())
+        metrics.add_time('serialize', rendering[0])
+        metrics.add_time('write', metrics.clock() - start - rendering[0])
+        if changed:
+            log.debug('Wrote "%s".', path)
+            summary['written'] += 1
+        else:
+            log.debug('"%s" is unchanged.', path)
+            summary['unchanged'] += 1
+        progress.advance()
+        return digest.hexdigest()
+
+    def dashboard_path(slug):
+        return os.path.join(output_path, 'dashboards', '%s.json' % (slug,))
+
+    def unchanged(slug, hit):
+        entry = manifest.get(slug)
+        if entry is None or entry['id'] != hit.get('id'):
+            return False
+        if not manifest.matches_file(slug, dashboard_path(slug)):
+            return False
+        # Prefer the listing when it carries versions, to avoid a request.
+        fields = [field for field in ('version', 'updated') if field in hit]
+        if fields:
+            return all(hit[field] == entry[field] for field in fields)
+        return dashboard_version(client, hit.get('id')) == entry['version']
+
+    def fetch(hit):
+        slug = hit['uri'].split('/', 1)[1]
+        if manifest is not None and unchanged(slug, hit):
+            return slug, hit, None
+        return slug, hit, client.get_json('api/dashboards/db/%s' % (slug,))
+
+    def pull_all():
+        # Fetch all data sources.
+        for document in client.get_json('api/datasources'):
+            metrics.count('objects_pulled')
+            name = document['name']
+            document = strip_datasource(document)
+            if writer is not None:
+                with metrics.phase('serialize'):
+                    data = dump_json(document)
+                with metrics.phase('write'):
+                    member = writer.add_datasource(name, data, document)
+                log.debug('Wrote "%s".', member)
+                summary['written'] += 1
+                progress.advance()
+                continue
+            write(os.path.join(output_path, 'datasources',
+                               '%s.json' % (name,)), document)
+
+        # Fetch all dashboards (except Home, which we can't edit).  Search
+        # results are streamed, page by page, to the download workers.
+        hits = (hit for hit in iter_search(client) if hit['type'] == 'dash-db')
+        slugs = set()
+        for slug, hit, document in parallel_map(fetch, hits, jobs=jobs):
+            slugs.add(slug)
+            if document is None:
+                summary['unchanged'] += 1
+                progress.advance()
+                continue
+            metrics.count('objects_pulled')
+            document = strip_dashboard(document)
+            if writer is not None:
+                refs = datasource_refs(document)
+                with metrics.phase('serialize'):
+                    data = dump_json(document)
+                with metrics.phase('write'):
+                    member = writer.add_dashboard(slug, data, refs)
+                log.debug('Wrote "%s".', member)
+                summary['written'] += 1
+                progress.advance()
+                continue
+            path = dashboard_path(slug)
+            digest = write(path, document)
+            if manifest is not None:
+                manifest.update(
+                    slug, path, digest,
+                    id=hit.get('id'),
+                    version=document['dashboard'].get('version'),
+                    updated=document.get('meta', {}).get('updated'),
+                )
+        return slugs
+
+    try:
+        slugs = pull_all()
+    except DeadlineExceeded as error:
+        # Keep track of what was pulled, but the listing is incomplete, so
+        # nothing can be deleted.
+        if manifest is not None and manifest.modified:
+            manifest.save()
+        log.warning('Deadline exceeded after writing %d changed files (%d '
+                    'unchanged), the rest was not pulled.',
+                    summary['written'], summary['unchanged'],
+                    extra={'data': dict(summary)})
+        error.summary = dict(summary)
+        raise
+
+    # Drop dashboards that no longer exist remotely.
+    if manifest is not None:
+        for slug in sorted(set(manifest.dashboards) - slugs):
+            path = dashboard_path(slug)
+            log.info('Deleting "%s".', path)
+            remove_file(path)
+            manifest.remove(slug)
+            summary['deleted'] += 1
+        if manifest.modified:
+            manifest.save()
+
+    return dict(summary)
+
+
+def datasource_refs(document):
+    """Collect names of data sources referenced anywhere in a dashboard.
+
+    An explicit ``null`` reference (the default data source) is reported as
+    ``None``.
+    """
+    refs = set()
+    stack = [document]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if 'datasource' in node:
+                ref = node['datasource']
+                if ref is None or isinstance(ref, string_types):
+                    refs.add(ref)
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return refs
+
+
+def plan_uploads(datasources, dashboards):
+    """Plan uploads of data sources and dashboards.
+
+    ``datasources`` yields ``(source, name, is_default)`` tuples and
+    ``dashboards`` yields ``(source, slug, refs)`` tuples, where ``source``
+    tells where to load the document from and ``refs`` are the data sources
+    a dashboard references (see :py:func:`datasource_refs`).
+
+    Returns an ordered ``dict`` that maps keys such as ``('dashboard',
+    slug)`` to ``(source, after)`` tuples, where ``after`` lists keys of
+    objects that must be uploaded first.  When several sources define the
+    same object, the last one wins and a warning is printed.
+    """
+    plan = collections.OrderedDict()
+
+    def add(key, source, after):
+        if key in plan:
+            log.warning('"%s" overrides "%s" (both define %s "%s").',
+                        source, plan[key][0], key[0], key[1])
+        plan[key] = (source, after)
+
+    default = None
+    for source, name, is_default in datasources:
+        add(('datasource', name), source, [])
+        if is_default:
+            default = name
+    for source, slug, refs in dashboards:
+        refs = set(refs)
+        if None in refs:
+            refs.discard(None)
+            if default is not None:
+                refs.add(default)
+        add(('dashboard', slug), source, [
+            ('datasource', name) for name in sorted(refs)
+        ])
+    return plan
+
 
+def push_plan(input_path, paths=None):
+    """Plan uploads for on-disk configuration.
 
-def grafana_push(grafana_url, username, password, input_path):
-    """Push on-disk configuration to Grafana."""
+    See :py:func:`plan_uploads`, sources are file paths.  Files are only
+    parsed to find their key and dependencies: documents are loaded again
+    at upload time, so they don't all sit in memory at once.  Files are
+    visited in path order.  With ``paths``, other files are left out.
+    """
+
+    def select(folder):
+        for path in sorted(glob.iglob(os.path.join(
+            input_path, 'grafana', folder, '*.json',
+        ))):
+            if paths is None or path in paths:
+                yield path
+
+    def datasources():
+        for path in select('datasources'):
+            document = load_json(path)
+            yield path, document['name'], bool(document.get('isDefault'))
+
+    def dashboards():
+        for path in select('dashboards'):
+            document = load_json(path)
+            yield path, document['meta']['slug'], datasource_refs(document)
+
+    return plan_uploads(datasources(), dashboards())
+
+
+def prepare_datasource(document, datasources):
+    """Prepare the upload of a data source.
+
+    Data sources that already exist (``datasources`` maps names to IDs on the
+    instance) are updated, others are created.  Returns the HTTP method and
+    API path to use.
+    """
+    if document['name'] in datasources:
+        # TODO: check if we should allow forced upload.
+        document['id'] = datasources[document['name']]
+        document['overwrite'] = False
+        log.debug('Updating data source "%s" with ID #%s.',
+                  document['name'], document['id'])
+        return 'PUT', 'api/datasources/%s' % (document['id'],)
+    log.debug('Creating data source "%s".', document['name'])
+    return 'POST', 'api/datasources'
+
+
+def datasource_pushed(document, method, rep):
+    """Report the outcome of a data source upload."""
+    if method == 'POST':
+        log.debug('Created data source "%s" with ID #%d.',
+                  document['name'], rep['id'])
+
+
+def prepare_dashboard(document, dashboards):
+    """Prepare the upload of a dashboard.
+
+    Resolves the dashboard ID on the instance (``dashboards`` maps slugs to
+    IDs) and drops the metadata, which Grafana doesn't accept.
+    """
+    slug = document['meta']['slug']
+    del document['meta']
+    document['dashboard']['id'] = dashboards.get(slug, None)
+    if document['dashboard']['id'] is None:
+        log.debug('Creating dashboard "%s" with slug "%s".',
+                  document['dashboard']['title'], slug)
+    else:
+        log.debug('Updating dashboard "%s" with slug "%s" and ID #%d.',
+                  document['dashboard']['title'], slug,
+                  document['dashboard']['id'])
+    return document
+
+
+def is_version_conflict(status):
+    """Check if a dashboard upload was rejected as a version mismatch."""
+    # We'll get a version-mismatch error if Grafana already has the latest
+    # version (or a newer version).
+    return status == 412
+
+
+def dashboard_sha256(document):
+    """Hash the content of a dashboard, ignoring instance-specific fields."""
+    dashboard = dict(document['dashboard'])
+    for field in ('id', 'version'):
+        dashboard.pop(field, None)
+    return json_sha256(dashboard)
+
+
+def datasource_unchanged(document, remote):
+    """Check if a data source already has the on-disk settings remotely."""
+    return all(remote.get(key) == value for key, value in document.items())
+
+
+def grafana_push(grafana_url, username, password, input_path,
+                 pool_size=DEFAULT_POOL_SIZE, jobs=1, skip_unchanged=False,
+                 state_path=None, bundle=None, retries=DEFAULT_RETRIES,
+                 max_rate=None, max_concurrency=None, wait=True,
+                 wait_timeout=DEFAULT_WAIT_TIMEOUT, timeout=DEFAULT_TIMEOUT,
+                 deadline=None, metrics_path=None, metrics_format='json',
+                 influxdb_url=None, influxdb_database=DEFAULT_DATABASE,
+                 progress_interval=DEFAULT_PROGRESS_INTERVAL, cache=False,
+                 cache_path=None, cache_ttl=DEFAULT_CACHE_TTL,
+                 cache_size=DEFAULT_CACHE_SIZE, compress=False,
+                 compress_min_size=DEFAULT_COMPRESS_MIN_SIZE, client=None):
+    """Push on-disk configuration to Grafana.
+
+    Data sources are uploaded before the dashboards that reference them.
+    With ``jobs`` greater than 1, independent uploads run concurrently.
+
+    With ``skip_unchanged``, documents whose content already matches the
+    instance are not uploaded.  Data sources are compared with the listing.
+    Dashboards are compared by hash with the state recorded after the last
+    push to this instance (in ``state_path``) or, for dashboards missing from
+    that state, with the dashboard downloaded from the instance.
+
+    With ``bundle``, documents are read from the archive at that path (see
+    :py:func:`grafana_pull`) instead of ``input_path``.  Uploads are planned
+    from the bundle's index and documents are decompressed one at a time.
+
+    See :py:func:`grafana_client` for ``retries``, ``max_rate``,
+    ``max_concurrency``, ``timeout``, ``deadline``, the ``cache`` options
+    and ``compress``.  When the deadline passes, in-flight work is abandoned
+    and :py:class:`DeadlineExceeded` is raised, with counts of what was done
+    as its ``summary``.
+
+    With ``metrics_path``, a report of the run is saved there at the end
+    and with ``influxdb_url``, metrics are written to InfluxDB (see
+    :py:func:`recording`).
+
+    Progress is logged every ``progress_interval`` seconds (see
+    :py:class:`dashex._log.Progress`).
+
+    Unless ``wait`` is false, waits up to ``wait_timeout`` seconds for
+    Grafana to become ready first (see :py:func:`grafana_wait`).
+
+    Returns counts of ``uploaded``, ``skipped`` and ``conflicts`` objects.
+    """
+
+    if client is None:
+        with recording('push', grafana_url, metrics_path, metrics_format,
+                       influxdb_url, influxdb_database) as metrics:
+            with grafana_client(grafana_url, username, password,
+                                pool_size=max(pool_size, jobs),
+                                retries=retries, max_rate=max_rate,
+                                max_concurrency=max_concurrency,
+                                timeout=timeout, deadline=deadline,
+                                metrics=metrics, cache=cache,
+                                cache_path=cache_path, cache_ttl=cache_ttl,
+                                cache_size=cache_size, compress=compress,
+                                compress_min_size=compress_min_size) as client:
+                return grafana_push(grafana_url, username, password,
+                                    input_path, jobs=jobs,
+                                    skip_unchanged=skip_unchanged,
+                                    state_path=state_path, bundle=bundle,
+                                    wait=wait, wait_timeout=wait_timeout,
+                                    progress_interval=progress_interval,
+                                    client=client)
 
     # Ensure Grafana is responsive (a common need for this tool is to provision
     # the infrastructure right after creating the resources and some
     # provisionning tools don't wait for the infra to be responsive before
     # returning, so we compensate here).
-    grafana_wait(grafana_url, username, password)
-
-    # Create/update data sources.
-    datasources = {
-        document['name']: document['id']
-        for document in get_json(grafana_url, 'api/datasources',
-                                 credentials=(username, password))
-    }
-    for path in glob.iglob(os.path.join(input_path, 'grafana',
-                                        'datasources', '*.json')):
-        print(path)
-        with open(path, 'rb') as stream:
-            document = json.loads(stream.read().decode('utf-8'))
-
-        # Create or update depending on whether it already exists.
-        if document['name'] in datasources:
-            # TODO: check if we should allow forced upload.
-            document['id'] = datasources.get(document['name'], None)
-            document['overwrite'] = False
-            print('Updating data source "%s" with ID #%s.' % (
-                document['name'],
-                document['id'],
-            ))
-            put_json(grafana_url, 'api/datasources/%s' % (document['id'],),
-                     data=document, credentials=(username, password))
+    if wait:
+        grafana_wait(grafana_url, username, password,
+                     timeout=client.deadline.bound(wait_timeout),
+                     client=client)
+
+    state = None
+    if skip_unchanged:
+        state = PushState.load(state_path or default_state_path(),
+                               grafana_url)
+
+    def timed(load):
+        def read(source):
+            with client.metrics.phase('read'):
+                return load(source)
+        return read
+
+    progress = Progress('Pushed', progress_interval)
+    if bundle is not None:
+        with BundleReader(bundle) as reader:
+            with client.metrics.phase('plan'):
+                plan = plan_uploads(reader.datasources(), reader.dashboards())
+            return _push(client, plan, timed(reader.load), jobs, state,
+                         progress)
+    with client.metrics.phase('plan'):
+        plan = push_plan(input_path)
+    return _push(client, plan, timed(load_json), jobs, state, progress)
+
+
+class RemoteIndex(object):
+    """Data sources and dashboards on an instance, kept up to date by pushes.
+
+    ``datasources`` maps names to documents, as listed by the instance, and
+    ``dashboards`` maps slugs to IDs.  Successful uploads record the IDs of
+    created objects, so the index can be reused for later pushes without
+    listing the instance again.  ``versions`` maps slugs of uploaded
+    dashboards to ``(pushed, saved)`` version numbers: the version in the
+    uploaded document and the one the instance saved it as.
+    """
+
+    def __init__(self, datasources, dashboards):
+        self.datasources = datasources
+        self.dashboards = dashboards
+        self.versions = {}
+
+    @classmethod
+    def list(cls, client):
+        """List existing data sources and dashboards."""
+        datasources = {
+            document['name']: document
+            for document in client.get_json('api/datasources')
+        }
+        dashboards = {
+            document['uri'].split('/', 1)[1]: document['id']
+            for document in iter_search(client)
+        }
+        log.info('Found %d data sources and %d dashboards on the instance.',
+                 len(datasources), len(dashboards))
+        return cls(datasources, dashboards)
+
+    def datasource_ids(self):
+        return {
+            name: document['id'] for name, document in self.datasources.items()
+        }
+
+    def datasource_pushed(self, document, rep):
+        document = dict(document, id=rep.get('id', document.get('id')))
+        document.pop('overwrite', None)
+        self.datasources[document['name']] = document
+
+    def rebase(self, slug, document):
+        """Upload an edited dashboard over the version we last pushed.
+
+        Pushing the same file twice would otherwise be rejected as a version
+        conflict, since the instance bumps versions on each save.  Changes
+        made on the instance meanwhile still conflict.
+        """
+        dashboard = document['dashboard']
+        pushed, saved = self.versions.get(slug, (None, None))
+        if pushed is not None and dashboard.get('version') == pushed:
+            dashboard['version'] = saved
+
+    def dashboard_pushed(self, slug, version, rep):
+        self.dashboards[slug] = rep['id']
+        if version is not None and 'version' in rep:
+            self.versions[slug] = (version, rep['version'])
+
+
+def _push(client, plan, load, jobs, state, progress, remote=None):
+    """Upload documents according to ``plan``, reading them with ``load``.
+
+    Documents are compared with the instance first when ``state`` (a
+    :py:class:`dashex._manifest.PushState`) is given.  The instance is
+    listed unless ``remote`` (a :py:class:`RemoteIndex`) is given, which
+    is then updated with the outcome of uploads.
+    """
+    import requests.exceptions
+
+    if remote is None:
+        remote = RemoteIndex.list(client)
+    remote_datasources = remote.datasources
+    datasources = remote.datasource_ids()
+    dashboards = remote.dashboards
+
+    skip_unchanged = state is not None
+    summary = collections.Counter(uploaded=0, skipped=0, conflicts=0)
+    lock = threading.Lock()
+
+    def count(outcome):
+        with lock:
+            summary[outcome] += 1
+        progress.advance()
+        if outcome == 'uploaded':
+            client.metrics.count('objects_pushed')
+
+    def push_datasource(source):
+        log.debug('Uploading "%s".', source)
+        document = load(source)
+        listed = remote_datasources.get(document['name'])
+        if skip_unchanged and listed is not None and \
+           datasource_unchanged(document, listed):
+            log.debug('Data source "%s" is unchanged.', document['name'])
+            count('skipped')
+            return
+        method, path = prepare_datasource(document, datasources)
+        if method == 'PUT':
+            rep = client.put_json(path, data=document)
         else:
-            print(json.dumps(document, indent=2, sort_keys=True))
-            rep = post_json(grafana_url, 'api/datasources',
-                            data=document, credentials=(username, password))
-            print('Created data source "%s" with ID #%d.' % (
-                document['name'],
-                rep['id'],
-            ))
-        print()
-
-    print('---')
-
-    # Create/update dashboards.
-    dashboards = {
-        document['uri'].split('/', 1)[1]: document['id']
-        for document in get_json(grafana_url, 'api/search',
-                                 credentials=(username, password))
-    }
-    print('DASHBOARDS:', dashboards)
-    for path in glob.iglob(os.path.join(input_path, 'grafana',
-                                        'dashboards', '*.json')):
-        print(path)
-        with open(path, 'rb') as stream:
-            document = json.loads(stream.read().decode('utf-8'))
+            rep = client.post_json(path, data=document)
+        datasource_pushed(document, method, rep)
+        remote.datasource_pushed(document, rep)
+        count('uploaded')
+
+    def dashboard_unchanged(slug, digest):
+        dashboard_id = dashboards.get(slug)
+        if dashboard_id is None:
+            return False
+        entry = state.get(slug)
+        if entry is None or entry['id'] != dashboard_id:
+            remote = client.get_json('api/dashboards/db/%s' % (slug,))
+            state.update(slug, dashboard_id, dashboard_sha256(remote))
+            entry = state.get(slug)
+        return entry['sha256'] == digest
+
+    def push_dashboard(source):
+        log.debug('Uploading "%s".', source)
+        document = load(source)
         slug = document['meta']['slug']
-        del document['meta']
-        document['dashboard']['id'] = dashboards.get(slug, None)
-        print('ID:', document['dashboard']['id'])
-        if document['dashboard']['id'] is None:
-            print('Creating dashboard "%s" with slug "%s".' % (
-                document['dashboard']['title'],
-                slug,
-            ))
+        digest = dashboard_sha256(document)
+        if skip_unchanged and dashboard_unchanged(slug, digest):
+            log.debug('Dashboard "%s" is unchanged.', slug)
+            count('skipped')
+            return
+        version = document['dashboard'].get('version')
+        remote.rebase(slug, document)
+        document = prepare_dashboard(document, dashboards)
+        try:
+            rep = client.post_json('api/dashboards/db', data=document)
+        except requests.exceptions.HTTPError as error:
+            if not is_version_conflict(error.response.status_code):
+                raise
+            log.warning('Dashboard "%s" not uploaded: %s', slug,
+                        error.response.json()['message'])
+            count('conflicts')
+            return
+        rep.setdefault('id', document['dashboard']['id'])
+        remote.dashboard_pushed(slug, version, rep)
+        if state is not None:
+            state.update(slug, rep['id'], digest)
+        count('uploaded')
+
+    # Plan uploads: dashboards wait for the data sources they reference.
+    scheduler = Scheduler(jobs=jobs)
+    for key, (source, after) in plan.items():
+        if key[0] == 'datasource':
+            func = push_datasource
         else:
-            print('Updating dashboard "%s" with slug "%s" and ID #%d.' % (
-                document['dashboard']['title'],
-                slug,
-                document['dashboard']['id'],
-            ))
+            func = push_dashboard
+        scheduler.add(key, functools.partial(func, source), after=after)
+    try:
+        scheduler.run()
+    except DeadlineExceeded as error:
+        summary['pending'] = len(plan) - sum(summary.values())
+        log.warning('Deadline exceeded after uploading %d (skipped %d '
+                    'unchanged, %d version conflicts), %d not pushed.',
+                    summary['uploaded'], summary['skipped'],
+                    summary['conflicts'], summary['pending'],
+                    extra={'data': dict(summary)})
+        error.summary = dict(summary)
+        raise
+    finally:
+        if state is not None:
+            state.save()
+
+    log.info('Uploaded %d, skipped %d unchanged, %d version conflicts.',
+             summary['uploaded'], summary['skipped'], summary['conflicts'],
+             extra={'data': dict(summary)})
+    return dict(summary)
+
+
+def watched_documents(paths):
+    """Keep paths of documents that can be pushed, warn about others.
+
+    Deleted files are ignored (they're not deleted from the instance) and
+    files that aren't valid JSON, e.g. saved mid-edit, are left out until
+    they're saved again.
+    """
+    valid = set()
+    for path in sorted(paths):
+        if not os.path.exists(path):
+            log.debug('"%s" was deleted, ignoring it.', path)
+            continue
         try:
-            post_json(grafana_url, 'api/dashboards/db',
-                      data=document, credentials=(username, password))
+            load_json(path)
+        except ValueError as error:
+            log.warning('"%s" not pushed, invalid JSON: %s', path, error)
+            continue
+        valid.add(path)
+    return valid
+
+
+def grafana_watch(grafana_url, username, password, input_path,
+                  pool_size=DEFAULT_POOL_SIZE, jobs=1, skip_unchanged=False,
+                  state_path=None, debounce=DEFAULT_DEBOUNCE, polling=False,
+                  poll_interval=DEFAULT_POLL_INTERVAL, retries=DEFAULT_RETRIES,
+                  max_rate=None, max_concurrency=None, wait=True,
+                  wait_timeout=DEFAULT_WAIT_TIMEOUT, timeout=DEFAULT_TIMEOUT,
+                  compress=False, compress_min_size=DEFAULT_COMPRESS_MIN_SIZE,
+                  rounds=None, client=None):
+    """Push on-disk configuration to Grafana whenever it changes.
+
+    Watches the data source and dashboard folders under ``input_path``
+    (see :py:func:`dashex._watch.watch_folders`, ``polling`` and
+    ``poll_interval``).  Once edits stop for ``debounce`` seconds, only
+    the files that changed are pushed, like :py:func:`grafana_push` does.
+
+    Connections to Grafana stay open between pushes and the instance is
+    only listed once (see :py:class:`RemoteIndex`), then again after a
+    failed push.  Dashboards pushed earlier can be edited and pushed again
+    without version conflicts, unless they were changed on the instance.
+
+    Runs until interrupted, or for ``rounds`` pushes.  Returns total counts
+    of ``uploaded``, ``skipped`` and ``conflicts`` objects.
+    """
+
+    if client is None:
+        with grafana_client(grafana_url, username, password,
+                            pool_size=max(pool_size, jobs), retries=retries,
+                            max_rate=max_rate,
+                            max_concurrency=max_concurrency, timeout=timeout,
+                            compress=compress,
+                            compress_min_size=compress_min_size) as client:
+            return grafana_watch(grafana_url, username, password, input_path,
+                                 jobs=jobs, skip_unchanged=skip_unchanged,
+                                 state_path=state_path, debounce=debounce,
+                                 polling=polling, poll_interval=poll_interval,
+                                 wait=wait, wait_timeout=wait_timeout,
+                                 rounds=rounds, client=client)
+
+    import requests.exceptions
+
+    folders = [
+        os.path.join(input_path, 'grafana', folder)
+        for folder in ('datasources', 'dashboards')
+    ]
+    for folder in folders:
+        ensure_dir(folder)
+
+    if wait:
+        grafana_wait(grafana_url, username, password, timeout=wait_timeout,
+                     client=client)
+
+    state = None
+    if skip_unchanged:
+        state = PushState.load(state_path or default_state_path(),
+                               grafana_url)
+
+    summary = collections.Counter(uploaded=0, skipped=0, conflicts=0)
+    remote = None
+    with watch_folders(folders, polling, poll_interval) as watcher:
+        log.info('Watching "%s" for changes.', input_path)
+        try:
+            while rounds is None or rounds > 0:
+                paths = watched_documents(wait_for_changes(watcher, debounce))
+                if rounds is not None:
+                    rounds -= 1
+                if not paths:
+                    continue
+                try:
+                    if remote is None:
+                        remote = RemoteIndex.list(client)
+                    plan = push_plan(input_path, paths)
+                    summary.update(_push(client, plan, load_json, jobs, state,
+                                         Progress('Pushed'), remote))
+                except requests.exceptions.RequestException as error:
+                    log.error('Push failed: %s', error)
+                    remote = None
+        except KeyboardInterrupt:
+            pass
+    return dict(summary)
+
+
+def grafana_sync(source_url, target_url, source_username=None,
+                 source_password=None, target_username=None,
+                 target_password=None, pool_size=DEFAULT_POOL_SIZE, jobs=1,
+                 retries=DEFAULT_RETRIES, max_rate=None, max_concurrency=None,
+                 wait=True, wait_timeout=DEFAULT_WAIT_TIMEOUT,
+                 timeout=DEFAULT_TIMEOUT, deadline=None, compress=False,
+                 compress_min_size=DEFAULT_COMPRESS_MIN_SIZE,
+                 progress_interval=DEFAULT_PROGRESS_INTERVAL, source=None,
+                 target=None):
+    """Copy configuration from one Grafana instance to another.
+
+    Documents go straight from the source to the target, stripped like
+    :py:func:`grafana_pull` does, without touching the disk.  Data sources
+    are copied first, then dashboards are streamed from the search results
+    to ``jobs`` workers, which download them and upload them to the target.
+
+    Only objects whose content differs are uploaded: data sources are
+    compared with the target's listing and dashboards with their copy on
+    the target (by hash, ignoring IDs and versions, see
+    :py:func:`dashboard_sha256`).  Dashboards are uploaded over the target's
+    current version, so they only conflict when changed during the sync.
+
+    See :py:func:`grafana_client` for ``retries``, ``max_rate``,
+    ``max_concurrency``, ``timeout``, ``deadline`` and ``compress`` (which
+    applies to uploads).  Unless ``wait`` is false, waits up to
+    ``wait_timeout`` seconds for both instances to become ready first.
+
+    Returns counts of ``uploaded``, ``unchanged`` and ``conflicts`` objects.
+    """
+
+    if source is None or target is None:
+        pool_size = max(pool_size, jobs)
+        with grafana_client(source_url, source_username, source_password,
+                            pool_size=pool_size, retries=retries,
+                            max_rate=max_rate,
+                            max_concurrency=max_concurrency, timeout=timeout,
+                            deadline=deadline) as source:
+            with grafana_client(target_url, target_username,
+                                target_password, pool_size=pool_size,
+                                retries=retries, max_rate=max_rate,
+                                max_concurrency=max_concurrency,
+                                timeout=timeout, deadline=deadline,
+                                compress=compress,
+                                compress_min_size=compress_min_size) as target:
+                return grafana_sync(source_url, target_url, jobs=jobs,
+                                    wait=wait, wait_timeout=wait_timeout,
+                                    progress_interval=progress_interval,
+                                    source=source, target=target)
+
+    import requests.exceptions
+
+    if wait:
+        for url, client in ((source_url, source), (target_url, target)):
+            grafana_wait(url, None, None,
+                         timeout=client.deadline.bound(wait_timeout),
+                         client=client)
+
+    remote = RemoteIndex.list(target)
+    datasources = remote.datasource_ids()
+    summary = collections.Counter(uploaded=0, unchanged=0, conflicts=0)
+    lock = threading.Lock()
+    progress = Progress('Synced', progress_interval)
+
+    def count(outcome):
+        with lock:
+            summary[outcome] += 1
+        progress.advance()
+        if outcome == 'uploaded':
+            target.metrics.count('objects_pushed')
+
+    def sync_datasource(document):
+        source.metrics.count('objects_pulled')
+        document = strip_datasource(document)
+        listed = remote.datasources.get(document['name'])
+        if listed is not None and datasource_unchanged(document, listed):
+            log.debug('Data source "%s" is unchanged.', document['name'])
+            count('unchanged')
+            return
+        method, path = prepare_datasource(document, datasources)
+        if method == 'PUT':
+            rep = target.put_json(path, data=document)
+        else:
+            rep = target.post_json(path, data=document)
+        datasource_pushed(document, method, rep)
+        count('uploaded')
+
+    def sync_dashboard(hit):
+        slug = hit['uri'].split('/', 1)[1]
+        path = 'api/dashboards/db/%s' % (slug,)
+        document = strip_dashboard(source.get_json(path))
+        source.metrics.count('objects_pulled')
+        if slug in remote.dashboards:
+            existing = target.get_json(path)
+            if dashboard_sha256(existing) == dashboard_sha256(document):
+                log.debug('Dashboard "%s" is unchanged.', slug)
+                count('unchanged')
+                return
+            document['dashboard']['version'] = \
+                existing['dashboard'].get('version')
+        document = prepare_dashboard(document, remote.dashboards)
+        try:
+            target.post_json('api/dashboards/db', data=document)
         except requests.exceptions.HTTPError as error:
-            # We'll get a version-mismatch error if Grafana already has the
-            # latest version (or a newer version).
-            if error.response.status_code != 412:
+            if not is_version_conflict(error.response.status_code):
                 raise
-            print(error.response.json()['message'])
-        print()
+            log.warning('Dashboard "%s" not uploaded: %s', slug,
+                        error.response.json()['message'])
+            count('conflicts')
+            return
+        count('uploaded')
+
+    def sync_all():
+        # Data sources first, since dashboards reference them.
+        for _ in parallel_map(sync_datasource,
+                              source.get_json('api/datasources'), jobs=jobs):
+            pass
+        hits = (hit for hit in iter_search(source) if hit['type'] == 'dash-db')
+        for _ in parallel_map(sync_dashboard, hits, jobs=jobs):
+            pass
+
+    try:
+        sync_all()
+    except DeadlineExceeded as error:
+        log.warning('Deadline exceeded after uploading %d (%d unchanged, %d '
+                    'version conflicts), the rest was not synced.',
+                    summary['uploaded'], summary['unchanged'],
+                    summary['conflicts'], extra={'data': dict(summary)})
+        error.summary = dict(summary)
+        raise
+
+    log.info('Uploaded %d, %d unchanged, %d version conflicts.',
+             summary['uploaded'], summary['unchanged'], summary['conflicts'],
+             extra={'data': dict(summary)})
+    return dict(summary)
@@ -2,22 +2,71 @@
 
 
 import argparse
+import importlib
+import logging
 import sys
 
 from . import (
     version,
-    grafana_pull,
-    grafana_push,
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_CACHE_TTL,
+    DEFAULT_COMPRESS_MIN_SIZE,
+    DEFAULT_DATABASE,
+    DEFAULT_DEBOUNCE,
+    DEFAULT_POLL_INTERVAL,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+    DEFAULT_WAIT_TIMEOUT,
+    DeadlineExceeded,
 )
+from ._log import DEFAULT_PROGRESS_INTERVAL, LOG_FORMATS, configure_logging
+
+
+log = logging.getLogger('dashex')
+
+
+def timeout(value):
+    """Parse ``CONNECT[,READ]`` timeouts (in seconds)."""
+    values = tuple(float(part) for part in value.split(','))
+    if len(values) == 1:
+        return values * 2
+    if len(values) != 2:
+        raise ValueError(value)
+    return values
+
+
+def mebibytes(value):
+    """Parse a size in MiB, return it in bytes."""
+    return int(float(value) * 2 ** 20)
+
+
+def lazy(module, name):
+    """Refer to a sub-command, imported only if it runs."""
+
+    def run(**kwds):
+        func = getattr(importlib.import_module(module, __package__), name)
+        return func(**kwds)
+    return run
 
 
 cli = argparse.ArgumentParser('dashex')
 cli.add_argument('--version', action='version', version=version)
+cli.add_argument('-q', '--quiet', action='store_const',
+                 dest='log_level', const=logging.WARNING,
+                 default=logging.INFO,
+                 help='Only report warnings and errors.')
+cli.add_argument('-v', '--verbose', action='store_const',
+                 dest='log_level', const=logging.DEBUG,
+                 help='Report every object.')
+cli.add_argument('--log-format', choices=LOG_FORMATS,
+                 action='store', dest='log_format', default='text',
+                 help='Log plain text or JSON lines.')
 
 commands = cli.add_subparsers(title='commands')
 
 command = commands.add_parser('grafana-pull')
-command.set_defaults(func=grafana_pull)
+command.set_defaults(func=lazy('.', 'grafana_pull'))
 command.add_argument('-i, --instance', type=str,
                      action='store', dest='grafana_url')
 command.add_argument('-u, --username', type=str,
@@ -26,9 +75,156 @@ command.add_argument('-p, --password', type=str,
                      action='store', dest='password', default=None)
 command.add_argument('-o, --output', type=str,
                      action='store', dest='output_path', default='.')
+command.add_argument('-j', '--jobs', type=int,
+                     action='store', dest='jobs', default=1,
+                     help='Number of concurrent downloads.')
+command.add_argument('--incremental', action='store_true',
+                     dest='incremental', default=False,
+                     help='Only download dashboards changed since last pull.')
+command.add_argument('--bundle', type=str,
+                     action='store', dest='bundle', default=None,
+                     help='Write everything to a single archive instead.')
+command.add_argument('--pool-size', type=int,
+                     action='store', dest='pool_size',
+                     default=DEFAULT_POOL_SIZE,
+                     help='Number of keep-alive connections to Grafana.')
+command.add_argument('--retries', type=int,
+                     action='store', dest='retries', default=DEFAULT_RETRIES,
+                     help='Number of times transient failures are retried.')
+command.add_argument('--max-rate', type=float,
+                     action='store', dest='max_rate', default=None,
+                     help='Maximum number of requests per second.')
+command.add_argument('--max-concurrency', type=int,
+                     action='store', dest='max_concurrency', default=None,
+                     help='Maximum number of requests in flight.')
+command.add_argument('--timeout', type=timeout, metavar='CONNECT[,READ]',
+                     action='store', dest='timeout', default=DEFAULT_TIMEOUT,
+                     help='Timeouts (in seconds) for each request.')
+command.add_argument('--deadline', type=float,
+                     action='store', dest='deadline', default=None,
+                     help='Give up after this many seconds.')
+command.add_argument('--metrics', type=str, metavar='PATH',
+                     action='store', dest='metrics_path', default=None,
+                     help='Save a report of requests and timings here.')
+command.add_argument('--metrics-format', choices=['json', 'prometheus'],
+                     action='store', dest='metrics_format', default='json',
+                     help='Format of the metrics report.')
+command.add_argument('--influxdb', type=str, metavar='URL',
+                     action='store', dest='influxdb_url', default=None,
+                     help='Write metrics to the InfluxDB server at this URL.')
+command.add_argument('--influxdb-database', type=str, metavar='NAME',
+                     action='store', dest='influxdb_database',
+                     default=DEFAULT_DATABASE,
+                     help='InfluxDB database receiving metrics.')
+command.add_argument('--progress', type=float, metavar='SECONDS',
+                     action='store', dest='progress_interval',
+                     default=DEFAULT_PROGRESS_INTERVAL,
+                     help='Delay between progress lines.')
+command.add_argument('--no-cache', action='store_false',
+                     dest='cache', default=True,
+                     help='Don\'t reuse or store cached responses.')
+command.add_argument('--cache-dir', type=str,
+                     action='store', dest='cache_path', default=None,
+                     help='Where to cache responses.')
+command.add_argument('--cache-ttl', type=float, metavar='SECONDS',
+                     action='store', dest='cache_ttl',
+                     default=DEFAULT_CACHE_TTL,
+                     help='Reuse cached responses for this long.')
+command.add_argument('--cache-size', type=mebibytes, metavar='MiB',
+                     action='store', dest='cache_size',
+                     default=DEFAULT_CACHE_SIZE,
+                     help='Evict old cached responses beyond this size.')
 
 command = commands.add_parser('grafana-push')
-command.set_defaults(func=grafana_push)
+command.set_defaults(func=lazy('.', 'grafana_push'))
+command.add_argument('-i, --instance', type=str,
+                     action='store', dest='grafana_url')
+command.add_argument('-u, --username', type=str,
+                     action='store', dest='username', default=None)
+command.add_argument('-p, --password', type=str,
+                     action='store', dest='password', default=None)
+command.add_argument('-o, --output', type=str,
+                     action='store', dest='input_path', default='.')
+command.add_argument('-j', '--jobs', type=int,
+                     action='store', dest='jobs', default=1,
+                     help='Number of concurrent uploads.')
+command.add_argument('--skip-unchanged', action='store_true',
+                     dest='skip_unchanged', default=False,
+                     help='Only upload documents that differ remotely.')
+command.add_argument('--state-file', type=str,
+                     action='store', dest='state_path', default=None,
+                     help='Where to remember what was last pushed.')
+command.add_argument('--bundle', type=str,
+                     action='store', dest='bundle', default=None,
+                     help='Read everything from a single archive instead.')
+command.add_argument('--wait-timeout', type=float,
+                     action='store', dest='wait_timeout',
+                     default=DEFAULT_WAIT_TIMEOUT,
+                     help='Seconds to wait for Grafana to become ready.')
+command.add_argument('--no-wait', action='store_false',
+                     dest='wait', default=True,
+                     help='Assume Grafana is ready, don\'t probe it.')
+command.add_argument('--pool-size', type=int,
+                     action='store', dest='pool_size',
+                     default=DEFAULT_POOL_SIZE,
+                     help='Number of keep-alive connections to Grafana.')
+command.add_argument('--retries', type=int,
+                     action='store', dest='retries', default=DEFAULT_RETRIES,
+                     help='Number of times transient failures are retried.')
+command.add_argument('--max-rate', type=float,
+                     action='store', dest='max_rate', default=None,
+                     help='Maximum number of requests per second.')
+command.add_argument('--max-concurrency', type=int,
+                     action='store', dest='max_concurrency', default=None,
+                     help='Maximum number of requests in flight.')
+command.add_argument('--timeout', type=timeout, metavar='CONNECT[,READ]',
+                     action='store', dest='timeout', default=DEFAULT_TIMEOUT,
+                     help='Timeouts (in seconds) for each request.')
+command.add_argument('--deadline', type=float,
+                     action='store', dest='deadline', default=None,
+                     help='Give up after this many seconds.')
+command.add_argument('--metrics', type=str, metavar='PATH',
+                     action='store', dest='metrics_path', default=None,
+                     help='Save a report of requests and timings here.')
+command.add_argument('--metrics-format', choices=['json', 'prometheus'],
+                     action='store', dest='metrics_format', default='json',
+                     help='Format of the metrics report.')
+command.add_argument('--influxdb', type=str, metavar='URL',
+                     action='store', dest='influxdb_url', default=None,
+                     help='Write metrics to the InfluxDB server at this URL.')
+command.add_argument('--influxdb-database', type=str, metavar='NAME',
+                     action='store', dest='influxdb_database',
+                     default=DEFAULT_DATABASE,
+                     help='InfluxDB database receiving metrics.')
+command.add_argument('--progress', type=float, metavar='SECONDS',
+                     action='store', dest='progress_interval',
+                     default=DEFAULT_PROGRESS_INTERVAL,
+                     help='Delay between progress lines.')
+command.add_argument('--no-cache', action='store_false',
+                     dest='cache', default=True,
+                     help='Don\'t reuse or store cached responses.')
+command.add_argument('--cache-dir', type=str,
+                     action='store', dest='cache_path', default=None,
+                     help='Where to cache responses.')
+command.add_argument('--cache-ttl', type=float, metavar='SECONDS',
+                     action='store', dest='cache_ttl',
+                     default=DEFAULT_CACHE_TTL,
+                     help='Reuse cached responses for this long.')
+command.add_argument('--cache-size', type=mebibytes, metavar='MiB',
+                     action='store', dest='cache_size',
+                     default=DEFAULT_CACHE_SIZE,
+                     help='Evict old cached responses beyond this size.')
+command.add_argument('--compress', action='store_true',
+                     dest='compress', default=False,
+                     help='Compress large uploads, if Grafana accepts it.')
+command.add_argument('--compress-min-size', type=int, metavar='BYTES',
+                     action='store', dest='compress_min_size',
+                     default=DEFAULT_COMPRESS_MIN_SIZE,
+                     help='Only compress uploads at least this large.')
+
+command = commands.add_parser('grafana-watch',
+                              help='Push configuration as it changes.')
+command.set_defaults(func=lazy('.', 'grafana_watch'))
 command.add_argument('-i, --instance', type=str,
                      action='store', dest='grafana_url')
 command.add_argument('-u, --username', type=str,
@@ -37,6 +233,183 @@ command.add_argument('-p, --password', type=str,
                      action='store', dest='password', default=None)
 command.add_argument('-o, --output', type=str,
                      action='store', dest='input_path', default='.')
+command.add_argument('-j', '--jobs', type=int,
+                     action='store', dest='jobs', default=1,
+                     help='Number of concurrent uploads.')
+command.add_argument('--skip-unchanged', action='store_true',
+                     dest='skip_unchanged', default=False,
+                     help='Only upload documents that differ remotely.')
+command.add_argument('--state-file', type=str,
+                     action='store', dest='state_path', default=None,
+                     help='Where to remember what was last pushed.')
+command.add_argument('--debounce', type=float, metavar='SECONDS',
+                     action='store', dest='debounce',
+                     default=DEFAULT_DEBOUNCE,
+                     help='Push once files stop changing for this long.')
+command.add_argument('--poll', action='store_true',
+                     dest='polling', default=False,
+                     help='Scan for changes instead of using inotify.')
+command.add_argument('--poll-interval', type=float, metavar='SECONDS',
+                     action='store', dest='poll_interval',
+                     default=DEFAULT_POLL_INTERVAL,
+                     help='Delay between scans when polling.')
+command.add_argument('--wait-timeout', type=float,
+                     action='store', dest='wait_timeout',
+                     default=DEFAULT_WAIT_TIMEOUT,
+                     help='Seconds to wait for Grafana to become ready.')
+command.add_argument('--no-wait', action='store_false',
+                     dest='wait', default=True,
+                     help='Assume Grafana is ready, don\'t probe it.')
+command.add_argument('--pool-size', type=int,
+                     action='store', dest='pool_size',
+                     default=DEFAULT_POOL_SIZE,
+                     help='Number of keep-alive connections to Grafana.')
+command.add_argument('--retries', type=int,
+                     action='store', dest='retries', default=DEFAULT_RETRIES,
+                     help='Number of times transient failures are retried.')
+command.add_argument('--max-rate', type=float,
+                     action='store', dest='max_rate', default=None,
+                     help='Maximum number of requests per second.')
+command.add_argument('--max-concurrency', type=int,
+                     action='store', dest='max_concurrency', default=None,
+                     help='Maximum number of requests in flight.')
+command.add_argument('--timeout', type=timeout, metavar='CONNECT[,READ]',
+                     action='store', dest='timeout', default=DEFAULT_TIMEOUT,
+                     help='Timeouts (in seconds) for each request.')
+command.add_argument('--compress', action='store_true',
+                     dest='compress', default=False,
+                     help='Compress large uploads, if Grafana accepts it.')
+command.add_argument('--compress-min-size', type=int, metavar='BYTES',
+                     action='store', dest='compress_min_size',
+                     default=DEFAULT_COMPRESS_MIN_SIZE,
+                     help='Only compress uploads at least this large.')
+
+command = commands.add_parser('grafana-mirror',
+                              help='Pull configuration periodically.')
+command.set_defaults(func=lazy('._mirror', 'grafana_mirror'))
+command.add_argument('-i, --instance', type=str,
+                     action='store', dest='grafana_url')
+command.add_argument('-u, --username', type=str,
+                     action='store', dest='username', default=None)
+command.add_argument('-p, --password', type=str,
+                     action='store', dest='password', default=None)
+command.add_argument('-o, --output', type=str,
+                     action='store', dest='output_path', default='.')
+command.add_argument('--interval', type=float, metavar='SECONDS',
+                     action='store', dest='interval', default=30.0,
+                     help='Delay between checks for changes.')
+command.add_argument('--git', action='store_true',
+                     dest='git', default=False,
+                     help='Commit changes to Git.')
+command.add_argument('-j', '--jobs', type=int,
+                     action='store', dest='jobs', default=1,
+                     help='Number of concurrent downloads.')
+command.add_argument('--wait-timeout', type=float,
+                     action='store', dest='wait_timeout',
+                     default=DEFAULT_WAIT_TIMEOUT,
+                     help='Seconds to wait for Grafana to become ready.')
+command.add_argument('--no-wait', action='store_false',
+                     dest='wait', default=True,
+                     help='Assume Grafana is ready, don\'t probe it.')
+command.add_argument('--pool-size', type=int,
+                     action='store', dest='pool_size',
+                     default=DEFAULT_POOL_SIZE,
+                     help='Number of keep-alive connections to Grafana.')
+command.add_argument('--retries', type=int,
+                     action='store', dest='retries', default=DEFAULT_RETRIES,
+                     help='Number of times transient failures are retried.')
+command.add_argument('--max-rate', type=float,
+                     action='store', dest='max_rate', default=None,
+                     help='Maximum number of requests per second.')
+command.add_argument('--max-concurrency', type=int,
+                     action='store', dest='max_concurrency', default=None,
+                     help='Maximum number of requests in flight.')
+command.add_argument('--timeout', type=timeout, metavar='CONNECT[,READ]',
+                     action='store', dest='timeout', default=DEFAULT_TIMEOUT,
+                     help='Timeouts (in seconds) for each request.')
+
+command = commands.add_parser('grafana-sync',
+                              help='Copy configuration between instances.')
+command.set_defaults(func=lazy('.', 'grafana_sync'))
+command.add_argument('--from', type=str, metavar='URL',
+                     action='store', dest='source_url', required=True,
+                     help='Instance to copy configuration from.')
+command.add_argument('--from-username', type=str,
+                     action='store', dest='source_username', default=None)
+command.add_argument('--from-password', type=str,
+                     action='store', dest='source_password', default=None)
+command.add_argument('--to', type=str, metavar='URL',
+                     action='store', dest='target_url', required=True,
+                     help='Instance to copy configuration to.')
+command.add_argument('--to-username', type=str,
+                     action='store', dest='target_username', default=None)
+command.add_argument('--to-password', type=str,
+                     action='store', dest='target_password', default=None)
+command.add_argument('-j', '--jobs', type=int,
+                     action='store', dest='jobs', default=1,
+                     help='Number of concurrent transfers.')
+command.add_argument('--wait-timeout', type=float,
+                     action='store', dest='wait_timeout',
+                     default=DEFAULT_WAIT_TIMEOUT,
+                     help='Seconds to wait for Grafana to become ready.')
+command.add_argument('--no-wait', action='store_false',
+                     dest='wait', default=True,
+                     help='Assume Grafana is ready, don\'t probe it.')
+command.add_argument('--pool-size', type=int,
+                     action='store', dest='pool_size',
+                     default=DEFAULT_POOL_SIZE,
+                     help='Number of keep-alive connections to Grafana.')
+command.add_argument('--retries', type=int,
+                     action='store', dest='retries', default=DEFAULT_RETRIES,
+                     help='Number of times transient failures are retried.')
+command.add_argument('--max-rate', type=float,
+                     action='store', dest='max_rate', default=None,
+                     help='Maximum number of requests per second.')
+command.add_argument('--max-concurrency', type=int,
+                     action='store', dest='max_concurrency', default=None,
+                     help='Maximum number of requests in flight.')
+command.add_argument('--timeout', type=timeout, metavar='CONNECT[,READ]',
+                     action='store', dest='timeout', default=DEFAULT_TIMEOUT,
+                     help='Timeouts (in seconds) for each request.')
+command.add_argument('--deadline', type=float,
+                     action='store', dest='deadline', default=None,
+                     help='Give up after this many seconds.')
+command.add_argument('--progress', type=float, metavar='SECONDS',
+                     action='store', dest='progress_interval',
+                     default=DEFAULT_PROGRESS_INTERVAL,
+                     help='Delay between progress lines.')
+command.add_argument('--compress', action='store_true',
+                     dest='compress', default=False,
+                     help='Compress large uploads, if Grafana accepts it.')
+command.add_argument('--compress-min-size', type=int, metavar='BYTES',
+                     action='store', dest='compress_min_size',
+                     default=DEFAULT_COMPRESS_MIN_SIZE,
+                     help='Only compress uploads at least this large.')
+
+
+command = commands.add_parser('dev-corpus',
+                              help='Generate synthetic configuration.')
+command.set_defaults(func=lazy('._corpus', 'generate_corpus'))
+command.add_argument('-o', '--output', type=str,
+                     action='store', dest='output_path', default='.')
+command.add_argument('--dashboards', type=int,
+                     action='store', dest='dashboards', default=100,
+                     help='Number of dashboards.')
+command.add_argument('--datasources', type=int,
+                     action='store', dest='datasources', default=10,
+                     help='Number of data sources.')
+command.add_argument('--panels', type=int,
+                     action='store', dest='panels', default=20,
+                     help='Number of panels per dashboard.')
+command.add_argument('--variables', type=int,
+                     action='store', dest='variables', default=5,
+                     help='Number of templating variables per dashboard.')
+command.add_argument('--seed', type=int,
+                     action='store', dest='seed', default=0,
+                     help='Seed of the random generator.')
+command.add_argument('-j', '--jobs', type=int,
+                     action='store', dest='jobs', default=1,
+                     help='Number of processes generating dashboards.')
 
 
 def main(arguments=None):
@@ -52,9 +425,15 @@ def main(arguments=None):
     # Recover the function attached to the sub-command.
     func = args.pop('func', None)
 
-    func(**args)
+    configure_logging(args.pop('log_level'), args.pop('log_format'))
+
+    try:
+        func(**args)
+    except DeadlineExceeded as error:
+        log.error('%s', error)
+        return 1
 
-    print('DONE!')
+    log.info('Done.')
 
 
 if __name__ == '__main__':  # pragma: no cover
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import os
+import tempfile
+import threading
+
+from ._compat import replace
+from ._json import loads
+from ._utils import remove_file
+
+
+INDEX = 'grafana/index.json'
+"""Name of the archive member that lists all other members."""
+
+
+class BundleWriter(object):
+    """Stream Grafana objects into a single compressed archive.
+
+    The bundle is a ZIP archive that holds the same files as the directory
+    layout (``grafana/datasources/*.json`` and ``grafana/dashboards/*.json``,
+    each compressed individually) plus an index of all objects and their
+    dependencies, so that readers can plan uploads and then load documents
+    one at a time without scanning the whole archive.
+
+    The archive is written to a temporary file and moved into place by
+    :py:meth:`close`, so an interrupted pull never leaves a corrupt bundle.
+    """
+
+    def __init__(self, path):
+        import zipfile
+        self._path = path
+        folder = os.path.dirname(path) or '.'
+        fd, self._temp = tempfile.mkstemp(
+            dir=folder, prefix='.%s.' % (os.path.basename(path),),
+        )
+        os.close(fd)
+        self._archive = zipfile.ZipFile(self._temp, 'w', zipfile.ZIP_DEFLATED)
+        self._index = []
+
+    @property
+    def path(self):
+        return self._path
+
+    def add_datasource(self, name, data, document):
+        """Add a data source rendered as ``data``, return the member name."""
+        member = 'grafana/datasources/%s.json' % (name,)
+        self._archive.writestr(member, data)
+        self._index.append({
+            'kind': 'datasource',
+            'member': member,
+            'key': name,
+            'isDefault': bool(document.get('isDefault')),
+        })
+        return member
+
+    def add_dashboard(self, slug, data, refs):
+        """Add a dashboard rendered as ``data``, return the member name."""
+        member = 'grafana/dashboards/%s.json' % (slug,)
+        self._archive.writestr(member, data)
+        self._index.append({
+            'kind': 'dashboard',
+            'member': member,
+            'key': slug,
+            'refs': sorted(refs, key=lambda ref: (ref is not None, ref)),
+        })
+        return member
+
+    def close(self):
+        """Write the index and move the bundle into place."""
+        data = json.dumps(self._index, indent=2, sort_keys=True,
+                          separators=(',', ': '))
+        self._archive.writestr(INDEX, data.encode('utf-8') + b'\n')
+        self._archive.close()
+        replace(self._temp, self._path)
+
+    def abort(self):
+        """Discard the bundle."""
+        self._archive.close()
+        remove_file(self._temp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        if etype is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class BundleReader(object):
+    """Read Grafana objects from a bundle written by :py:class:`BundleWriter`.
+
+    Documents are decompressed on demand, one member at a time.
+    """
+
+    def __init__(self, path):
+        import zipfile
+        self._path = path
+        self._archive = zipfile.ZipFile(path, 'r')
+        self._lock = threading.Lock()
+        self._index = json.loads(self._archive.read(INDEX).decode('utf-8'))
+
+    @property
+    def path(self):
+        return self._path
+
+    def datasources(self):
+        """Yield ``(member, name, is_default)`` for each data source."""
+        for entry in self._index:
+            if entry['kind'] == 'datasource':
+                yield entry['member'], entry['key'], entry['isDefault']
+
+    def dashboards(self):
+        """Yield ``(member, slug, refs)`` for each dashboard."""
+        for entry in self._index:
+            if entry['kind'] == 'dashboard':
+                yield entry['member'], entry['key'], entry['refs']
+
+    def load(self, member):
+        """Load one JSON document from the bundle."""
+        with self._lock:
+            data = self._archive.read(member)
+        return loads(data)
+
+    def close(self):
+        self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+
+import collections
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from ._utils import atomic_write, remove_file
+
+
+DEFAULT_CACHE_TTL = 60.0
+"""Default delay (in seconds) during which cached responses are reused."""
+
+DEFAULT_CACHE_SIZE = 256 * 2 ** 20
+"""Default size (in bytes) above which the least recently used responses
+are evicted from the cache."""
+
+
+def default_cache_path():
+    """Locate the HTTP cache in the user's cache folder."""
+    cache = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'dashex', 'http')
+
+
+def _digest(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+class CacheEntry(collections.namedtuple(
+    'CacheEntry', ['content', 'etag', 'last_modified', 'stored'],
+)):
+    """Body of a response, its validators and when it was stored."""
+
+    def validators(self):
+        """Build headers that make a request conditional on this entry."""
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HTTPCache(object):
+    """Persistent cache of JSON responses, keyed by instance and endpoint.
+
+    Each response is stored in its own file, under a folder per instance, so
+    concurrent runs never see half-written entries.  Entries are fresh for
+    ``ttl`` seconds after they are stored: after that, they are revalidated
+    with a conditional request when the server sent an ``ETag`` or a
+    ``Last-Modified`` header, or downloaded again otherwise.
+
+    When the cache grows past ``max_size`` bytes, the least recently used
+    entries are evicted until it's back to 90% of that size, so eviction
+    doesn't run again on the next store.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL,
+                 max_size=DEFAULT_CACHE_SIZE, clock=time.time):
+        self._path = path
+        self._ttl = ttl
+        self._max_size = max_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._size = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def _folder(self, instance):
+        return os.path.join(self._path, _digest(instance)[:32])
+
+    def _file(self, instance, endpoint):
+        return os.path.join(self._folder(instance),
+                            '%s.json' % (_digest(endpoint)[:32],))
+
+    def _entries(self):
+        """List ``(mtime, size, path)`` of every entry on disk."""
+        entries = []
+        for folder, _, names in os.walk(self._path):
+            for name in names:
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        """Total size (in bytes) of the cached entries."""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            return self._size
+
+    def get(self, instance, endpoint):
+        """Return the entry for an endpoint, ``None`` if there's none."""
+        path = self._file(instance, endpoint)
+        try:
+            with open(path, 'rb') as stream:
+                header = json.loads(stream.readline().decode('utf-8'))
+                content = stream.read()
+            # Reading an entry makes it the most recently used.
+            os.utime(path, None)
+        except (IOError, OSError) as error:
+            if error.errno != errno.ENOENT:
+                raise
+            return None
+        except ValueError:
+            return None
+        if header.get('endpoint') != endpoint:
+            return None
+        return CacheEntry(content, header.get('etag'),
+                          header.get('last_modified'), header['stored'])
+
+    def fresh(self, entry):
+        """Check if an entry can be used without asking the server."""
+        return self._clock() - entry.stored < self._ttl
+
+    def store(self, instance, endpoint, content, etag=None,
+              last_modified=None):
+        """Save a response, return its entry."""
+        entry = CacheEntry(content, etag, last_modified, self._clock())
+        header = json.dumps({
+            'endpoint': endpoint,
+            'etag': etag,
+            'last_modified': last_modified,
+            'stored': entry.stored,
+        }, sort_keys=True)
+        data = header.encode('utf-8') + b'\n' + content
+        path = self._file(instance, endpoint)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        atomic_write(path, data)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(data) - replaced
+            if self._size > self._max_size:
+                self._evict(int(self._max_size * 0.9))
+        return entry
+
+    def refresh(self, instance, endpoint, entry):
+        """Mark an entry as fresh again, after the server confirmed it."""
+        return self.store(instance, endpoint, entry.content, entry.etag,
+                          entry.last_modified)
+
+    def _evict(self, target):
+        for _, size, path in sorted(self._entries()):
+            if self._size <= target:
+                break
+            remove_file(path)
+            self._size -= size
+
+    def invalidate(self, instance):
+        """Drop all entries of an instance, e.g. after changing it."""
+        folder = self._folder(instance)
+        if not os.path.isdir(folder):
+            return
+        with self._lock:
+            shutil.rmtree(folder, ignore_errors=True)
+            self._size = None
@@ -2,6 +2,9 @@
 
 
 __all__ = [
+    'queue',
+    'replace',
+    'string_types',
     'urljoin',
 ]
 
@@ -12,3 +15,27 @@ try:  # pragma: no cover
 except ImportError:  # pragma: no cover
     # py2
     from urlparse import urljoin
+
+
+try:  # pragma: no cover
+    # py3
+    import queue
+except ImportError:  # pragma: no cover
+    # py2
+    import Queue as queue
+
+
+try:  # pragma: no cover
+    # py2
+    string_types = (basestring,)  # noqa: F821
+except NameError:  # pragma: no cover
+    # py3
+    string_types = (str,)
+
+
+try:  # pragma: no cover
+    # py3
+    from os import replace
+except ImportError:  # pragma: no cover
+    # py2 (rename doesn't overwrite on Windows, but py2 is POSIX-only here)
+    from os import rename as replace
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+
+import logging
+import os.path
+import random
+import re
+
+from . import dump_json, strip_dashboard, strip_datasource
+from ._utils import ensure_dir, update_file
+
+
+log = logging.getLogger(__name__)
+
+DATASOURCE_TYPES = ('influxdb', 'prometheus', 'graphite', 'elasticsearch')
+PANEL_TYPES = ('graph', 'singlestat', 'table', 'text', 'heatmap')
+TAGS = ('production', 'staging', 'backend', 'frontend', 'database', 'queue',
+        'network', 'storage', 'billing', 'security')
+METRICS = ('cpu', 'memory', 'disk', 'requests', 'errors', 'latency',
+           'connections', 'queue_depth', 'cache_hits', 'gc_pauses')
+
+
+def slugify(title):
+    """Derive a dashboard slug from its title, like Grafana does."""
+    return re.sub(r'[^a-z0-9]+', '-', title.lower()).strip('-')
+
+
+def dashboard_document(dashboard):
+    """Wrap a dashboard model like Grafana's ``api/dashboards/db`` does."""
+    return {
+        'dashboard': dashboard,
+        'meta': {
+            'slug': slugify(dashboard['title']),
+            'type': 'db',
+            'version': dashboard['version'],
+            'canSave': True,
+            'canEdit': True,
+            'canStar': True,
+        },
+    }
+
+
+class Corpus(object):
+    """Deterministic set of synthetic data sources and dashboards.
+
+    Dashboards have ``panels`` panels and ``variables`` templating variables
+    each, referencing the ``datasources`` data sources.  Every object is
+    generated from its own random generator, derived from ``seed`` and its
+    index, so objects can be generated in any order (or in parallel) and
+    always come out the same.
+    """
+
+    def __init__(self, dashboards=100, datasources=10, panels=20,
+                 variables=5, seed=0):
+        self._dashboards = dashboards
+        self._datasources = datasources
+        self._panels = panels
+        self._variables = variables
+        self._seed = seed
+
+    @property
+    def dashboards(self):
+        return self._dashboards
+
+    @property
+    def datasources(self):
+        return self._datasources
+
+    def _random(self, kind, i):
+        return random.Random((self._seed * 4 + kind) * 1000003 + i)
+
+    def datasource_name(self, i):
+        return 'datasource-%d' % (i,)
+
+    def datasource(self, i):
+        """Generate a data source, as listed by ``api/datasources``."""
+        rng = self._random(0, i)
+        kind = rng.choice(DATASOURCE_TYPES)
+        return {
+            'id': i + 1,
+            'orgId': 1,
+            'name': self.datasource_name(i),
+            'type': kind,
+            'typeLogoUrl': 'public/app/plugins/datasource/%s/img/logo.svg'
+                           % (kind,),
+            'access': rng.choice(('proxy', 'direct')),
+            'url': 'http://%s-%d.example.org:%d' % (
+                kind, i, rng.choice((8086, 9090, 8080, 9200)),
+            ),
+            'database': 'db%d' % (i,),
+            'basicAuth': False,
+            'isDefault': i == 0,
+            'jsonData': {},
+        }
+
+    def _datasource_ref(self, rng):
+        if not self._datasources or rng.random() < 0.1:
+            return None
+        return self.datasource_name(rng.randrange(self._datasources))
+
+    def _variable(self, rng, j):
+        name = 'var%d' % (j,)
+        return {
+            'name': name,
+            'label': name.title(),
+            'type': 'query',
+            'datasource': self._datasource_ref(rng),
+            'query': 'SHOW TAG VALUES WITH KEY = "%s"' % (
+                rng.choice(('host', 'region', 'service', 'env')),
+            ),
+            'refresh': 1,
+            'multi': rng.random() < 0.5,
+            'includeAll': rng.random() < 0.5,
+            'current': {},
+            'options': [],
+        }
+
+    def _panel(self, rng, j):
+        kind = rng.choice(PANEL_TYPES)
+        metric = rng.choice(METRICS)
+        return {
+            'id': j + 1,
+            'type': kind,
+            'title': '%s %s' % (metric.replace('_', ' ').title(), j),
+            'datasource': self._datasource_ref(rng),
+            'gridPos': {'x': 12 * (j % 2), 'y': 8 * (j // 2),
+                        'w': 12, 'h': 8},
+            'targets': [
+                {
+                    'refId': chr(ord('A') + k),
+                    'query': 'SELECT mean("value") FROM "%s" WHERE '
+                             '"host" =~ /^$var0$/ AND $timeFilter GROUP BY '
+                             'time($__interval), "%s" fill(null)' % (
+                                 metric, rng.choice(('host', 'region')),
+                             ),
+                }
+                for k in range(rng.randint(1, 3))
+            ],
+            'legend': {'show': rng.random() < 0.8, 'values': False},
+            'lines': True,
+            'linewidth': rng.randint(1, 3),
+            'fill': rng.randint(0, 10),
+            'thresholds': [
+                {'value': rng.randint(50, 100), 'colorMode': 'critical',
+                 'op': 'gt'},
+            ],
+        }
+
+    def dashboard(self, i):
+        """Generate a dashboard model (with its ``id`` on the instance)."""
+        rng = self._random(1, i)
+        return {
+            'id': i + 1,
+            'title': 'Dashboard %d' % (i,),
+            'version': 1,
+            'schemaVersion': 16,
+            'editable': True,
+            'timezone': 'browser',
+            'refresh': rng.choice(('', '30s', '1m', '5m')),
+            'time': {'from': 'now-6h', 'to': 'now'},
+            'tags': sorted(rng.sample(TAGS, rng.randint(0, 3))),
+            'annotations': {'list': []},
+            'templating': {'list': [
+                self._variable(rng, j) for j in range(self._variables)
+            ]},
+            'panels': [self._panel(rng, j) for j in range(self._panels)],
+        }
+
+    def document(self, i):
+        """Generate a dashboard, as downloaded from ``api/dashboards/db``."""
+        return dashboard_document(self.dashboard(i))
+
+    def write_datasource(self, output_path, i):
+        """Save a data source like :py:func:`dashex.grafana_pull` does."""
+        document = self.datasource(i)
+        path = os.path.join(output_path, 'grafana', 'datasources',
+                            '%s.json' % (document['name'],))
+        data = dump_json(strip_datasource(document))
+        update_file(path, data)
+        return len(data)
+
+    def write_dashboard(self, output_path, i):
+        """Save a dashboard like :py:func:`dashex.grafana_pull` does."""
+        document = self.document(i)
+        path = os.path.join(output_path, 'grafana', 'dashboards',
+                            '%s.json' % (document['meta']['slug'],))
+        data = dump_json(strip_dashboard(document))
+        update_file(path, data)
+        return len(data)
+
+    def write(self, output_path, jobs=1):
+        """Save the whole corpus in the layout of a pull, return its size.
+
+        With ``jobs`` greater than 1, dashboards are generated and saved by
+        that many processes.
+        """
+        for path in ('', 'grafana', 'grafana/datasources',
+                     'grafana/dashboards'):
+            ensure_dir(os.path.join(output_path, path))
+        size = sum(
+            self.write_datasource(output_path, i)
+            for i in range(self._datasources)
+        )
+        tasks = ((self, output_path, i) for i in range(self._dashboards))
+        if jobs > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(jobs)
+            try:
+                size += sum(pool.imap_unordered(_write_dashboard, tasks,
+                                                chunksize=64))
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            size += sum(_write_dashboard(task) for task in tasks)
+        return size
+
+
+def _write_dashboard(task):
+    corpus, output_path, i = task
+    return corpus.write_dashboard(output_path, i)
+
+
+def generate_corpus(output_path='.', dashboards=100, datasources=10,
+                    panels=20, variables=5, seed=0, jobs=1):
+    """Write a synthetic configuration to disk, as if pulled from Grafana.
+
+    See :py:class:`Corpus`.  The same arguments always produce the same
+    files, byte for byte.
+    """
+    corpus = Corpus(dashboards=dashboards, datasources=datasources,
+                    panels=panels, variables=variables, seed=seed)
+    size = corpus.write(output_path, jobs=jobs)
+    log.info('Generated %d dashboards and %d data sources (%.1f MiB).',
+             dashboards, datasources, size / 2.0 ** 20,
+             extra={'data': {
+                 'dashboards': dashboards,
+                 'datasources': datasources,
+                 'bytes': size,
+             }})
+    return size
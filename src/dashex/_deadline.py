@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+
+import timeit
+
+
+class DeadlineExceeded(Exception):
+    """The time budget of an operation ran out.
+
+    Commands that give up attach counts of what they completed as
+    ``summary``.
+    """
+
+    def __init__(self, message='Deadline exceeded.', summary=None):
+        super(DeadlineExceeded, self).__init__(message)
+        self.summary = summary
+
+
+class Deadline(object):
+    """Time left until a deadline (``None`` for no deadline).
+
+    A single deadline is shared by all operations of a command, so that
+    every request, retry and wait counts against the same budget.
+    """
+
+    def __init__(self, seconds, clock=timeit.default_timer):
+        self._clock = clock
+        self._end = None
+        if seconds is not None:
+            self._end = clock() + seconds
+
+    def remaining(self):
+        """Return the time left, ``None`` without a deadline."""
+        if self._end is None:
+            return None
+        return max(self._end - self._clock(), 0.0)
+
+    def expired(self):
+        return self._end is not None and self._clock() >= self._end
+
+    def check(self):
+        """Raise :py:class:`DeadlineExceeded` if the deadline has passed."""
+        if self.expired():
+            raise DeadlineExceeded()
+
+    def bound(self, delay):
+        """Shorten a delay so that it doesn't run past the deadline."""
+        remaining = self.remaining()
+        if remaining is None:
+            return delay
+        if delay is None:
+            return remaining
+        return min(delay, remaining)
+
+
+def bounded_timeout(timeout, deadline):
+    """Bound ``(connect, read)`` timeouts so they end before the deadline."""
+    if timeout is None:
+        return deadline.bound(None)
+    if not isinstance(timeout, tuple):
+        timeout = (timeout, timeout)
+    connect, read = timeout
+    return (deadline.bound(connect), deadline.bound(read))
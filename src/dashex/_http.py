@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+
+
+import logging
+import time
+import zlib
+
+from ._compat import urljoin
+from ._deadline import Deadline, DeadlineExceeded, bounded_timeout
+from ._json import iter_dumps, loads
+from ._metrics import Metrics
+from ._throttle import RateLimiter, RetryPolicy, parse_retry_after
+from ._utils import CHUNK_SIZE, rechunk
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+"""Default number of pooled connections kept alive per host."""
+
+DEFAULT_RETRIES = 3
+"""Default number of times transient failures are retried."""
+
+DEFAULT_TIMEOUT = (5.0, 30.0)
+"""Default connect and read timeouts (in seconds) for each request."""
+
+DEFAULT_COMPRESS_MIN_SIZE = 16384
+"""Default size (in bytes) from which request bodies are compressed."""
+
+REJECTED_ENCODING_STATUSES = frozenset([400, 415, 422])
+"""Statuses of servers that may not understand compressed request bodies."""
+
+COMPRESSED_ENCODINGS = frozenset(['gzip', 'deflate'])
+"""Response encodings decoded transparently by ``requests``."""
+
+_NO_RETRY = RetryPolicy(retries=0)
+
+
+def _gzip_compressor(level=6):
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def gzip_compress(data, level=6):
+    """Compress bytes in gzip format (``gzip.compress`` is py3-only)."""
+    compressor = _gzip_compressor(level)
+    return compressor.compress(data) + compressor.flush()
+
+
+class Client(object):
+    """Pooled, keep-alive HTTP client for a JSON API.
+
+    All requests go through a single ``requests.Session``, so TCP (and TLS)
+    connections are reused from one call to the next instead of paying for a
+    new handshake on every object.
+
+    Every request goes through the ``limiter`` (see
+    :py:class:`dashex._throttle.RateLimiter`) and transient failures are
+    retried according to the ``retry`` policy (see
+    :py:class:`dashex._throttle.RetryPolicy`).
+
+    Each attempt gets ``(connect, read)`` ``timeout`` seconds, cut short so
+    that no request (nor delay between attempts) runs past the ``deadline``
+    (see :py:class:`dashex._deadline.Deadline`).  Once the deadline has
+    passed, requests raise :py:class:`dashex._deadline.DeadlineExceeded`.
+
+    Every attempt and retry is recorded in ``metrics`` (see
+    :py:class:`dashex._metrics.Metrics`).
+
+    With a ``cache`` (see :py:class:`dashex._cache.HTTPCache`), JSON
+    downloads are served from the cache while fresh and revalidated with
+    conditional requests afterwards.  Any other request invalidates the
+    cached responses of the instance, since it may change them.
+
+    Responses are downloaded compressed when the server supports it.  With
+    ``compress_min_size``, JSON uploads of at least that many bytes are
+    compressed too.  Servers don't always accept compressed request bodies:
+    when one is rejected, it is sent again uncompressed and, if that gets a
+    different response, compression is turned off for the rest of the
+    session.  Compressed sizes are recorded in ``metrics``.
+
+    JSON uploads larger than :py:data:`dashex._utils.CHUNK_SIZE` are
+    streamed: they're rendered a chunk at a time, as they're sent with
+    chunked transfer encoding, and never held in memory whole.  Their size
+    isn't known up front, so they're always compressed when compression is
+    on.
+    """
+
+    def __init__(self, base_url, credentials=None, headers=None,
+                 pool_size=DEFAULT_POOL_SIZE, keep_alive=True,
+                 retry=None, limiter=None, sleep=time.sleep,
+                 timeout=DEFAULT_TIMEOUT, deadline=None, metrics=None,
+                 cache=None, compress_min_size=None):
+        import requests.adapters
+        self._base_url = base_url
+        self._compress_min_size = compress_min_size
+        self._cache = cache
+        # Different users may see different objects on the same instance.
+        self._cache_key = '%s %s' % (
+            base_url, credentials[0] if credentials else '',
+        )
+        self._metrics = metrics or Metrics()
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._deadline = deadline or Deadline(None)
+        self._retry = retry or _NO_RETRY
+        self._limiter = limiter or RateLimiter()
+        self._sleep = sleep
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+        )
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._session.auth = credentials
+        if headers:
+            self._session.headers.update(headers)
+        if not keep_alive:
+            self._session.headers['Connection'] = 'close'
+
+    @property
+    def base_url(self):
+        return self._base_url
+
+    @property
+    def pool_size(self):
+        return self._pool_size
+
+    @property
+    def session(self):
+        return self._session
+
+    @property
+    def retry(self):
+        return self._retry
+
+    @property
+    def limiter(self):
+        return self._limiter
+
+    @property
+    def deadline(self):
+        return self._deadline
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def compress_min_size(self):
+        return self._compress_min_size
+
+    def url(self, path):
+        """Resolve ``path`` relative to the base URL."""
+        return urljoin(self._base_url, path)
+
+    def request(self, method, path, retry=True, **kwds):
+        """Send a request, retrying transient failures.
+
+        Pass ``retry=False`` to send a single attempt, e.g. when the caller
+        has its own polling loop.  Returns the raw response of the last
+        attempt.
+
+        The body (``data``) may be a function returning chunks of bytes: it
+        is called again for each attempt and the body is streamed.
+        """
+        import requests.exceptions
+        url = self.url(path)
+        send = getattr(self._session, method.lower())
+        policy = self._retry if retry else _NO_RETRY
+        timeout = kwds.pop('timeout', self._timeout)
+        clock = self._metrics.clock
+        body = kwds.get('data')
+        if self._cache is not None and method.upper() != 'GET':
+            self._cache.invalidate(self._cache_key)
+        attempt = 0
+        while True:
+            attempt += 1
+            self._deadline.check()
+            if attempt > 1:
+                self._metrics.retry(method, path)
+            if callable(body):
+                # Streamed bodies are rendered again for each attempt.
+                kwds['data'] = self._sent(body())
+            elif body:
+                self._metrics.count('bytes_sent', len(body))
+            try:
+                with self._limiter:
+                    start = clock()
+                    rep = send(url, timeout=bounded_timeout(
+                        timeout, self._deadline,
+                    ), **kwds)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                self._metrics.request(method, path, None, clock() - start)
+                self._deadline.check()
+                if not policy.should_retry(attempt, method):
+                    raise
+                self._pause(policy.delay(attempt))
+                continue
+            self._metrics.request(method, path, rep.status_code,
+                                  clock() - start, len(rep.content))
+            if rep.headers.get('Content-Encoding') in COMPRESSED_ENCODINGS:
+                # The content is decoded, but the raw stream counts what
+                # actually came over the wire.
+                self._metrics.compressed('response', len(rep.content),
+                                         rep.raw.tell())
+            if attempt > policy.retries or \
+               not policy.should_retry(attempt, method, rep.status_code):
+                return rep
+            rep.close()
+            self._pause(policy.delay(
+                attempt, parse_retry_after(rep.headers.get('Retry-After')),
+            ))
+
+    def _pause(self, delay):
+        """Wait before retrying, unless that would overrun the deadline."""
+        remaining = self._deadline.remaining()
+        if remaining is not None and delay >= remaining:
+            raise DeadlineExceeded()
+        self._sleep(delay)
+
+    def get(self, path, **kwds):
+        """Send a GET request, return the raw response."""
+        return self.request('GET', path, **kwds)
+
+    def _decode(self, rep):
+        rep.raise_for_status()
+        return self._parse(rep.content)
+
+    def _parse(self, content):
+        with self._metrics.phase('parse'):
+            return loads(content)
+
+    def _sent(self, chunks):
+        for chunk in chunks:
+            self._metrics.count('bytes_sent', len(chunk))
+            yield chunk
+
+    def _encode(self, data):
+        """Render a JSON body.
+
+        Returns bytes when the body fits in a single chunk, otherwise a
+        function that renders it as a stream of chunks.
+        """
+        with self._metrics.phase('serialize'):
+            chunks = rechunk(iter_dumps(data), CHUNK_SIZE)
+            body = next(chunks, b'')
+            if next(chunks, None) is None:
+                return body
+        return lambda: rechunk(iter_dumps(data), CHUNK_SIZE)
+
+    def _compress(self, body):
+        if callable(body):
+            return lambda: self._gzip_stream(body())
+        with self._metrics.phase('compress'):
+            compressed = gzip_compress(body)
+        self._metrics.compressed('request', len(body), len(compressed))
+        return compressed
+
+    def _gzip_stream(self, chunks):
+        compressor = _gzip_compressor()
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            self._metrics.compressed('request', len(chunk), len(data))
+            if data:
+                yield data
+        data = compressor.flush()
+        self._metrics.compressed('request', 0, len(data))
+        yield data
+
+    def get_json(self, path):
+        """Download a JSON object, through the cache if there's one."""
+        if self._cache is None:
+            return self._decode(self.get(path))
+        entry = self._cache.get(self._cache_key, path)
+        if entry is not None and self._cache.fresh(entry):
+            self._metrics.count('cache_hits')
+            return self._parse(entry.content)
+        if entry is None:
+            rep = self.get(path)
+        else:
+            rep = self.get(path, headers=entry.validators())
+        if rep.status_code == 304 and entry is not None:
+            self._metrics.count('cache_revalidated')
+            self._cache.refresh(self._cache_key, path, entry)
+            return self._parse(entry.content)
+        self._metrics.count('cache_misses')
+        document = self._decode(rep)
+        self._cache.store(self._cache_key, path, rep.content,
+                          rep.headers.get('ETag'),
+                          rep.headers.get('Last-Modified'))
+        return document
+
+    def _upload(self, method, path, data):
+        body = self._encode(data)
+        headers = {
+            'Content-Type': 'application/json',
+        }
+        min_size = self._compress_min_size
+        if min_size is None or \
+           (not callable(body) and len(body) < min_size):
+            return self._decode(self.request(method, path, headers=headers,
+                                             data=body))
+        rep = self.request(method, path, headers=dict(headers, **{
+            'Content-Encoding': 'gzip',
+        }), data=self._compress(body))
+        if rep.status_code in REJECTED_ENCODING_STATUSES:
+            rep.close()
+            retry = self.request(method, path, headers=headers, data=body)
+            if retry.status_code != rep.status_code:
+                log.info('%s doesn\'t accept compressed requests, sending '
+                         'them uncompressed.', self._base_url)
+                self._compress_min_size = None
+            rep = retry
+        return self._decode(rep)
+
+    def post_json(self, path, data={}):
+        """Upload a JSON object."""
+        return self._upload('POST', path, data)
+
+    def put_json(self, path, data={}):
+        """Upload a JSON object."""
+        return self._upload('PUT', path, data)
+
+    def close(self):
+        """Release all pooled connections."""
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
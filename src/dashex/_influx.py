@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+
+import re
+import threading
+import time
+
+from ._compat import queue, string_types, urljoin
+
+
+DEFAULT_DATABASE = 'dashex'
+"""Default InfluxDB database receiving run metrics."""
+
+PERCENTILES = (50, 90, 99)
+"""HTTP latency percentiles reported at the end of a run."""
+
+_MEASUREMENT_SPECIALS = re.compile(r'([, \\])')
+_TAG_SPECIALS = re.compile(r'([,= \\])')
+_STRING_SPECIALS = re.compile(r'(["\\])')
+
+
+def _escape_measurement(name):
+    return _MEASUREMENT_SPECIALS.sub(r'\\\1', name)
+
+
+def _escape_tag(value):
+    return _TAG_SPECIALS.sub(r'\\\1', value)
+
+
+def _format_field(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return '%di' % (value,)
+    if isinstance(value, float):
+        return repr(value)
+    if not isinstance(value, string_types):
+        value = str(value)
+    return '"%s"' % (_STRING_SPECIALS.sub(r'\\\1', value),)
+
+
+def format_line(measurement, fields, tags=None, timestamp=None):
+    """Render a point in InfluxDB line protocol.
+
+    Tags with empty values and fields set to ``None`` are left out, since
+    InfluxDB rejects them.  ``timestamp`` is in seconds since the epoch and
+    rendered in nanoseconds.  Returns ``None`` when no fields are left.
+    """
+    fields = sorted(
+        (key, value) for key, value in fields.items() if value is not None
+    )
+    if not fields:
+        return None
+    key = _escape_measurement(measurement)
+    for name, value in sorted((tags or {}).items()):
+        value = str(value)
+        if value:
+            key += ',%s=%s' % (_escape_tag(name), _escape_tag(value))
+    line = '%s %s' % (key, ','.join(
+        '%s=%s' % (_escape_tag(name), _format_field(value))
+        for name, value in fields
+    ))
+    if timestamp is not None:
+        line += ' %d' % (int(timestamp * 1e9),)
+    return line
+
+
+class InfluxSink(object):
+    """Batched, non-blocking writer of points to an InfluxDB database.
+
+    :py:meth:`write` only queues the point: a background thread sends queued
+    points in batches of up to ``batch_size`` lines, at least every
+    ``flush_interval`` seconds.  When more than ``max_pending`` points are
+    queued, new points are dropped rather than slowing down the caller, and
+    failed writes are counted but otherwise ignored.
+    """
+
+    def __init__(self, url, database=DEFAULT_DATABASE, batch_size=500,
+                 flush_interval=1.0, max_pending=10000, timeout=(1.0, 5.0),
+                 session=None, clock=time.time):
+        self._url = urljoin(url, 'write')
+        self._database = database
+        self._batch_size = max(batch_size, 1)
+        self._flush_interval = flush_interval
+        self._timeout = timeout
+        if session is None:
+            import requests
+            session = requests.Session()
+        self._session = session
+        self._clock = clock
+        self._queue = queue.Queue(max_pending)
+        self._closed = object()
+        self._lock = threading.Lock()
+        self._dropped = 0
+        self._failed = 0
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def dropped(self):
+        """Number of points dropped because too many were pending."""
+        return self._dropped
+
+    @property
+    def failed(self):
+        """Number of points InfluxDB didn't accept."""
+        return self._failed
+
+    def write(self, measurement, fields, tags=None, timestamp=None):
+        """Queue a point, timestamped now unless ``timestamp`` is given."""
+        if timestamp is None:
+            timestamp = self._clock()
+        line = format_line(measurement, fields, tags, timestamp)
+        if line is None:
+            return
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+
+    def _run(self):
+        done = False
+        while not done:
+            batch = []
+            deadline = time.time() + self._flush_interval
+            while len(batch) < self._batch_size:
+                try:
+                    line = self._queue.get(
+                        timeout=max(deadline - time.time(), 0.0),
+                    )
+                except queue.Empty:
+                    break
+                if line is self._closed:
+                    done = True
+                    break
+                batch.append(line)
+            if batch:
+                self._send(batch)
+
+    def _send(self, batch):
+        import requests.exceptions
+        try:
+            rep = self._session.post(
+                self._url,
+                params={'db': self._database, 'precision': 'ns'},
+                headers={'Content-Type': 'text/plain; charset=utf-8'},
+                data=('\n'.join(batch) + '\n').encode('utf-8'),
+                timeout=self._timeout,
+            )
+            rep.raise_for_status()
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._failed += len(batch)
+
+    def close(self, timeout=5.0):
+        """Send pending points, waiting up to ``timeout`` seconds."""
+        try:
+            self._queue.put(self._closed, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def report_points(sink, metrics, tags=None, timestamp=None):
+    """Queue a summary of a run (see :py:class:`dashex._metrics.Metrics`).
+
+    Writes the duration of each phase (``dashex_phase``), per-endpoint
+    request counts, bytes and latency percentiles (``dashex_http``) and the
+    run's counters, such as objects pulled or pushed and bytes transferred
+    (``dashex_run``).
+    """
+    tags = dict(tags or {})
+    report = metrics.report()
+    for name, phase in sorted(report['phases'].items()):
+        sink.write('dashex_phase', {
+            'seconds': float(phase['seconds']),
+            'count': phase['count'],
+        }, dict(tags, phase=name), timestamp)
+    for (method, path), stats in sorted(metrics.endpoints().items()):
+        fields = {
+            'requests': stats.requests,
+            'errors': stats.statuses.get('error', 0),
+            'retries': stats.retries,
+            'bytes': int(stats.size.sum),
+        }
+        for percentile in PERCENTILES:
+            fields['p%d' % (percentile,)] = stats.latency.quantile(
+                percentile / 100.0,
+            )
+        sink.write('dashex_http', fields,
+                   dict(tags, method=method, endpoint=path), timestamp)
+    sink.write('dashex_run', dict(report['counters']), tags, timestamp)
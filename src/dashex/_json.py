@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import re
+
+try:  # pragma: no cover
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+# Characters the standard library escapes as ``\uXXXX``.
+_NON_ASCII = re.compile(br'[\x7f-\xff]')
+
+# Lines of ``orjson`` output holding a number in exponent notation, which
+# the standard library renders differently (``1e+16`` vs. ``1e16``).
+_EXPONENT = re.compile(
+    br'^ *(?:"(?:[^"\\]|\\.)*": )?-?[0-9.]+[eE]', re.MULTILINE,
+)
+
+# Cheap pre-check for :py:data:`_EXPONENT`, which is slow on large documents
+# since it's anchored on every line.
+_MAYBE_EXPONENT = re.compile(br'[0-9][eE]')
+
+STREAM_DEPTH = 3
+"""Depth down to which containers are rendered one item at a time when
+streaming, e.g. each panel of a dashboard document."""
+
+
+class StandardBackend(object):
+    """JSON serializer based on the standard library."""
+
+    name = 'json'
+
+    def pretty(self, document):
+        """Render JSON in normalized format, return bytes."""
+        return json.dumps(
+            document, indent=2, sort_keys=True, separators=(',', ': '),
+        ).encode('utf-8')
+
+    def dumps(self, document):
+        """Render JSON in compact format, return bytes."""
+        return json.dumps(document, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        """Parse JSON from bytes."""
+        return json.loads(data.decode('utf-8'))
+
+
+class FastBackend(StandardBackend):
+    """JSON serializer based on ``orjson``, several times faster.
+
+    ``orjson`` doesn't escape non-ASCII characters and formats exponents
+    differently from the standard library.  Normalized output is checked for
+    both and, when needed, rendered by the standard library instead so that
+    files are byte-identical whichever backend is used.  Documents that
+    ``orjson`` rejects (e.g. integers over 64 bits) also fall back.
+    """
+
+    name = 'orjson'
+
+    def pretty(self, document):
+        try:
+            data = orjson.dumps(
+                document, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS,
+            )
+        except TypeError:
+            return StandardBackend.pretty(self, document)
+        if _NON_ASCII.search(data) or (
+            _MAYBE_EXPONENT.search(data) and _EXPONENT.search(data)
+        ):
+            return StandardBackend.pretty(self, document)
+        return data
+
+    def dumps(self, document):
+        try:
+            return orjson.dumps(document)
+        except TypeError:
+            return StandardBackend.dumps(self, document)
+
+    def loads(self, data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return StandardBackend.loads(self, data)
+
+
+BACKENDS = {
+    StandardBackend.name: StandardBackend,
+}
+if orjson is not None:  # pragma: no cover
+    BACKENDS[FastBackend.name] = FastBackend
+
+backend = FastBackend() if orjson is not None else StandardBackend()
+"""JSON serializer in use, the fastest one available by default."""
+
+
+def use_backend(name):
+    """Select the JSON serializer by name (see ``BACKENDS``)."""
+    global backend
+    backend = BACKENDS[name]()
+
+
+def pretty(document):
+    """Render JSON in normalized format, return bytes."""
+    return backend.pretty(document)
+
+
+def dumps(document):
+    """Render JSON in compact format, return bytes."""
+    return backend.dumps(document)
+
+
+def loads(data):
+    """Parse JSON from bytes."""
+    return backend.loads(data)
+
+
+def _iter_render(render, value, depth, indent):
+    """Render containers item by item down to ``depth`` levels deep.
+
+    With an ``indent``, renders like ``pretty`` at that indentation level,
+    otherwise like ``dumps``.
+    """
+    if depth <= 0 or not value or not isinstance(value, (dict, list)):
+        data = render(value)
+        if indent:
+            data = data.replace(b'\n', b'\n' + b' ' * indent)
+        yield data
+        return
+    if indent is None:
+        margin, end, colon, child = b'', b'', b':', None
+    else:
+        margin = b'\n' + b' ' * (indent + 2)
+        end = b'\n' + b' ' * indent
+        colon, child = b': ', indent + 2
+    if isinstance(value, dict):
+        keys = sorted(value) if indent is not None else list(value)
+        yield b'{'
+        for i, key in enumerate(keys):
+            yield (b',' if i else b'') + margin + \
+                json.dumps(key).encode('utf-8') + colon
+            for chunk in _iter_render(render, value[key], depth - 1, child):
+                yield chunk
+        yield end + b'}'
+    else:
+        yield b'['
+        for i, item in enumerate(value):
+            yield (b',' if i else b'') + margin
+            for chunk in _iter_render(render, item, depth - 1, child):
+                yield chunk
+        yield end + b']'
+
+
+def iter_pretty(document, depth=STREAM_DEPTH):
+    """Render JSON in normalized format, as a stream of byte strings.
+
+    Joined, the chunks are identical to :py:func:`pretty`, but the whole
+    rendering never sits in memory: containers down to ``depth`` levels
+    deep are rendered one item at a time.
+    """
+    return _iter_render(backend.pretty, document, depth, 0)
+
+
+def iter_dumps(document, depth=STREAM_DEPTH):
+    """Render JSON in compact format, as a stream of byte strings.
+
+    See :py:func:`iter_pretty`.  Keys keep their order, like
+    :py:func:`dumps`.
+    """
+    return _iter_render(backend.dumps, document, depth, None)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import logging
+import sys
+import threading
+import timeit
+
+
+DEFAULT_PROGRESS_INTERVAL = 10.0
+"""Default delay (in seconds) between progress lines."""
+
+LOG_FORMATS = ('text', 'json')
+"""Formats supported by :py:func:`configure_logging`."""
+
+log = logging.getLogger('dashex')
+
+_handler = None
+
+
+class JSONFormatter(logging.Formatter):
+    """Render each record as a single line of JSON.
+
+    Structured values passed as ``extra={'data': {...}}`` are merged into the
+    object, so CI can pick counts out of summaries without parsing messages.
+    """
+
+    def format(self, record):
+        document = {
+            'time': record.created,
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        document.update(getattr(record, 'data', None) or {})
+        if record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+        return json.dumps(document, sort_keys=True)
+
+
+def configure_logging(level=logging.INFO, format='text', stream=None):
+    """Send dashex's log records to ``stream`` (standard error by default).
+
+    Records are rendered as plain text or, with ``format='json'``, as JSON
+    lines (see :py:class:`JSONFormatter`).  Calling this again replaces the
+    previous configuration.
+    """
+    global _handler
+    if format not in LOG_FORMATS:
+        raise ValueError('Unknown log format "%s".' % (format,))
+    if _handler is not None:
+        log.removeHandler(_handler)
+    _handler = logging.StreamHandler(stream or sys.stderr)
+    if format == 'json':
+        _handler.setFormatter(JSONFormatter())
+    else:
+        _handler.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(_handler)
+    log.setLevel(level)
+    return _handler
+
+
+class Progress(object):
+    """Periodically log how many objects were processed, and how fast.
+
+    Call :py:meth:`advance` as objects are processed: a line is logged when
+    at least ``interval`` seconds have elapsed since the previous one (never
+    with an ``interval`` of ``None``).
+    """
+
+    def __init__(self, action, interval=DEFAULT_PROGRESS_INTERVAL,
+                 clock=timeit.default_timer):
+        self._action = action
+        self._interval = interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._count = 0
+        self._start = self._last = clock()
+
+    @property
+    def count(self):
+        return self._count
+
+    def advance(self, count=1):
+        """Count processed objects, log progress if it's time to."""
+        with self._lock:
+            self._count += count
+            if self._interval is None:
+                return
+            now = self._clock()
+            if now - self._last < self._interval:
+                return
+            self._last = now
+            count = self._count
+        elapsed = now - self._start
+        rate = count / elapsed if elapsed > 0 else 0.0
+        log.info('%s %d objects (%.1f/s).', self._action, count, rate,
+                 extra={'data': {
+                     'progress': count,
+                     'rate': rate,
+                     'elapsed': elapsed,
+                 }})
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+
+import errno
+import hashlib
+import json
+import os
+import threading
+
+from ._utils import atomic_write
+
+
+def sha256(data):
+    """Hash a byte string, return the hex digest."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def json_sha256(document):
+    """Hash a JSON document in canonical form, return the hex digest."""
+    data = json.dumps(document, sort_keys=True, separators=(',', ':'))
+    return sha256(data.encode('utf-8'))
+
+
+def file_sha256(path):
+    """Hash a file's contents, return ``None`` if the file doesn't exist."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as stream:
+            for chunk in iter(lambda: stream.read(64 * 1024), b''):
+                digest.update(chunk)
+    except IOError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return None
+    return digest.hexdigest()
+
+
+class Manifest(object):
+    """Record of the remote state of each dashboard stored on disk.
+
+    For each slug, the manifest keeps the remote dashboard ID, ``version``
+    and ``updated`` timestamp along with the size, modification time and
+    hash of the file written to disk, so that later pulls can tell which
+    dashboards need a refresh.
+    """
+
+    def __init__(self, path, dashboards=None):
+        self._path = path
+        self._dashboards = dashboards or {}
+        self._modified = dashboards is None
+
+    @classmethod
+    def load(cls, path):
+        """Load a manifest from disk (empty if it doesn't exist yet)."""
+        try:
+            with open(path, 'rb') as stream:
+                document = json.loads(stream.read().decode('utf-8'))
+        except IOError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            return cls(path)
+        return cls(path, document.get('dashboards', {}))
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def modified(self):
+        """Check if the manifest changed since it was loaded or saved."""
+        return self._modified
+
+    @property
+    def dashboards(self):
+        return self._dashboards
+
+    def get(self, slug):
+        """Return the entry for a dashboard, ``None`` if unknown."""
+        return self._dashboards.get(slug)
+
+    def matches_file(self, slug, path):
+        """Check that a file still holds what was recorded for a dashboard.
+
+        The file is only hashed when its size matches but its modification
+        time changed since it was recorded.
+        """
+        entry = self._dashboards.get(slug)
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            return False
+        if stat.st_size != entry.get('size'):
+            return False
+        if stat.st_mtime == entry.get('mtime'):
+            return True
+        return file_sha256(path) == entry['sha256']
+
+    def update(self, slug, path, digest, id, version, updated):
+        """Record the state of a dashboard just written to ``path``.
+
+        ``digest`` is the SHA-256 hex digest of the file's contents.
+        """
+        stat = os.stat(path)
+        self._dashboards[slug] = {
+            'id': id,
+            'version': version,
+            'updated': updated,
+            'sha256': digest,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+        }
+        self._modified = True
+
+    def remove(self, slug):
+        """Forget about a dashboard."""
+        if self._dashboards.pop(slug, None) is not None:
+            self._modified = True
+
+    def save(self):
+        """Save the manifest to disk in normalized format."""
+        data = json.dumps({'dashboards': self._dashboards},
+                          indent=2, sort_keys=True, separators=(',', ': '))
+        atomic_write(self._path, data.encode('utf-8') + b'\n')
+        self._modified = False
+
+
+def default_state_path():
+    """Locate the push state file in the user's cache folder."""
+    cache = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'dashex', 'push-state.json')
+
+
+class PushState(object):
+    """Hashes of the dashboards last pushed to each Grafana instance.
+
+    A single file holds the state of every instance, keyed by URL.  For each
+    slug, the state keeps the remote dashboard ID and the hash of the
+    content last uploaded (or found identical) on that instance.
+    """
+
+    def __init__(self, path, instance, dashboards=None):
+        self._path = path
+        self._instance = instance
+        self._dashboards = dashboards or {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'rb') as stream:
+                return json.loads(stream.read().decode('utf-8'))
+        except IOError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            return {}
+
+    @classmethod
+    def load(cls, path, instance):
+        """Load the state of an instance (empty if unknown)."""
+        return cls(path, instance, cls._read(path).get(instance, {}))
+
+    def get(self, slug):
+        """Return the entry for a dashboard, ``None`` if unknown."""
+        return self._dashboards.get(slug)
+
+    def update(self, slug, id, sha256):
+        """Record the content of a dashboard present on the instance."""
+        with self._lock:
+            self._dashboards[slug] = {
+                'id': id,
+                'sha256': sha256,
+            }
+
+    def save(self):
+        """Save the state, preserving the state of other instances."""
+        folder = os.path.dirname(self._path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        with self._lock:
+            document = self._read(self._path)
+            document[self._instance] = self._dashboards
+            data = json.dumps(document, indent=2, sort_keys=True,
+                              separators=(',', ': '))
+        atomic_write(self._path, data.encode('utf-8') + b'\n')
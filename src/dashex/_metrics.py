@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+
+
+import bisect
+import collections
+import contextlib
+import json
+import re
+import threading
+import timeit
+
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+"""Upper bounds (in seconds) of the request latency histogram buckets."""
+
+SIZE_BUCKETS = (
+    256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216,
+)
+"""Upper bounds (in bytes) of the response size histogram buckets."""
+
+
+# Path segments that identify a single object, collapsed so that metrics are
+# aggregated per endpoint rather than per object.
+_OBJECT_PATHS = [
+    (re.compile(r'^(api/dashboards/db)/[^/]+$'), r'\1/:slug'),
+    (re.compile(r'/\d+(?=/|$)'), '/:id'),
+]
+
+
+def endpoint(path):
+    """Collapse an API path into an endpoint name."""
+    path = path.split('?', 1)[0].strip('/')
+    for pattern, replacement in _OBJECT_PATHS:
+        path = pattern.sub(replacement, path)
+    return path
+
+
+class Histogram(object):
+    """Distribution of observed values over fixed buckets."""
+
+    def __init__(self, buckets):
+        self._buckets = tuple(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._count += 1
+        self._sum += value
+
+    def cumulative(self):
+        """Return ``(upper_bound, count)`` pairs, ending with ``+Inf``."""
+        total, pairs = 0, []
+        for bound, count in zip(self._buckets + ('+Inf',), self._counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, q):
+        """Estimate a quantile (``0 <= q <= 1``) as a bucket upper bound."""
+        if not self._count:
+            return None
+        rank = q * self._count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound if bound != '+Inf' else self._buckets[-1]
+
+    def as_dict(self):
+        return {
+            'count': self._count,
+            'sum': self._sum,
+            'buckets': [[bound, count] for bound, count in self.cumulative()],
+        }
+
+
+class EndpointStats(object):
+    """Requests sent to a single endpoint with a single method."""
+
+    def __init__(self):
+        self.statuses = collections.Counter()
+        self.retries = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+
+    @property
+    def requests(self):
+        return sum(self.statuses.values())
+
+
+class Metrics(object):
+    """Thread-safe record of what a run spent its time on.
+
+    HTTP clients record every attempt (see :py:meth:`request` and
+    :py:meth:`retry`), while commands time local work such as serializing,
+    reading and writing documents in named phases (see :py:meth:`phase`)
+    and count what they moved around (see :py:meth:`count`).
+
+    With a ``sink`` (see :py:class:`dashex._influx.InfluxSink`), every
+    attempt is also written there as a ``dashex_request`` point.
+    """
+
+    def __init__(self, clock=timeit.default_timer, sink=None):
+        self._clock = clock
+        self._sink = sink
+        self._lock = threading.Lock()
+        self._endpoints = collections.defaultdict(EndpointStats)
+        self._phases = collections.defaultdict(lambda: [0, 0.0])
+        self._counters = collections.Counter()
+
+    @property
+    def clock(self):
+        return self._clock
+
+    def endpoints(self):
+        """Return a ``dict`` mapping ``(method, endpoint)`` to stats."""
+        with self._lock:
+            return dict(self._endpoints)
+
+    @property
+    def sink(self):
+        return self._sink
+
+    def request(self, method, path, status, seconds, size=0):
+        """Record one attempt (``status`` is ``None`` if it failed)."""
+        key = (method.upper(), endpoint(path))
+        status = str(status) if status else 'error'
+        with self._lock:
+            stats = self._endpoints[key]
+            stats.statuses[status] += 1
+            stats.latency.observe(seconds)
+            stats.size.observe(size)
+            self._counters['bytes_received'] += size
+        if self._sink is not None:
+            self._sink.write('dashex_request', {
+                'seconds': float(seconds),
+                'size': size,
+            }, {'method': key[0], 'endpoint': key[1], 'status': status})
+
+    def retry(self, method, path):
+        """Record that a request is about to be sent again."""
+        key = (method.upper(), endpoint(path))
+        with self._lock:
+            self._endpoints[key].retries += 1
+
+    def count(self, name, value=1):
+        """Add to a counter, e.g. of objects pulled or bytes sent."""
+        with self._lock:
+            self._counters[name] += value
+
+    def compressed(self, direction, size, compressed_size):
+        """Record a ``request`` or ``response`` body sent compressed."""
+        with self._lock:
+            self._counters['%s_bytes_uncompressed' % (direction,)] += size
+            self._counters['%s_bytes_compressed' % (direction,)] += \
+                compressed_size
+
+    def compression_ratios(self):
+        """Return ratios of uncompressed to compressed bytes, by direction.
+
+        Only bodies that were actually compressed are accounted for.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        ratios = {}
+        for direction in ('request', 'response'):
+            size = counters.get('%s_bytes_uncompressed' % (direction,))
+            compressed_size = counters.get(
+                '%s_bytes_compressed' % (direction,),
+            )
+            if size and compressed_size:
+                ratios[direction] = float(size) / compressed_size
+        return ratios
+
+    def add_time(self, name, seconds):
+        """Record time spent in a local phase."""
+        with self._lock:
+            phase = self._phases[name]
+            phase[0] += 1
+            phase[1] += seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a block of code as part of a local phase."""
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.add_time(name, self._clock() - start)
+
+    def report(self):
+        """Summarize everything as a JSON-compatible ``dict``."""
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            phases = sorted(self._phases.items())
+            counters = dict(self._counters)
+        return {
+            'compression': self.compression_ratios(),
+            'endpoints': [
+                {
+                    'method': method,
+                    'endpoint': path,
+                    'requests': stats.requests,
+                    'statuses': dict(stats.statuses),
+                    'retries': stats.retries,
+                    'latency': stats.latency.as_dict(),
+                    'size': stats.size.as_dict(),
+                }
+                for (method, path), stats in endpoints
+            ],
+            'phases': {
+                name: {'count': count, 'seconds': seconds}
+                for name, (count, seconds) in phases
+            },
+            'counters': counters,
+        }
+
+    def to_json(self):
+        """Render the report as JSON."""
+        return json.dumps(self.report(), indent=2, sort_keys=True,
+                          separators=(',', ': ')) + '\n'
+
+    def to_prometheus(self):
+        """Render the report in Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, text):
+            lines.append('# HELP %s %s' % (name, text))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+        def labels(**values):
+            return ','.join(
+                '%s="%s"' % (key, str(value).replace('"', '\\"'))
+                for key, value in sorted(values.items())
+            )
+
+        def histogram(name, attribute):
+            for (method, path), stats in endpoints:
+                data = getattr(stats, attribute)
+                for bound, count in data.cumulative():
+                    lines.append('%s_bucket{%s} %d' % (name, labels(
+                        method=method, endpoint=path, le=bound,
+                    ), count))
+                common = labels(method=method, endpoint=path)
+                lines.append('%s_sum{%s} %r' % (name, common, data.sum))
+                lines.append('%s_count{%s} %d' % (name, common, data.count))
+
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            phases = sorted(self._phases.items())
+            counters = sorted(self._counters.items())
+
+        metric('dashex_http_requests_total', 'counter',
+               'HTTP requests sent to Grafana.')
+        for (method, path), stats in endpoints:
+            for status, count in sorted(stats.statuses.items()):
+                lines.append('dashex_http_requests_total{%s} %d' % (labels(
+                    method=method, endpoint=path, status=status,
+                ), count))
+        metric('dashex_http_retries_total', 'counter',
+               'HTTP requests sent again after a transient failure.')
+        for (method, path), stats in endpoints:
+            lines.append('dashex_http_retries_total{%s} %d' % (labels(
+                method=method, endpoint=path,
+            ), stats.retries))
+        metric('dashex_http_request_duration_seconds', 'histogram',
+               'Latency of HTTP requests.')
+        histogram('dashex_http_request_duration_seconds', 'latency')
+        metric('dashex_http_response_size_bytes', 'histogram',
+               'Size of HTTP response bodies.')
+        histogram('dashex_http_response_size_bytes', 'size')
+        metric('dashex_phase_seconds_total', 'counter',
+               'Time spent on local work, by phase.')
+        for name, (count, seconds) in phases:
+            lines.append('dashex_phase_seconds_total{%s} %r' % (
+                labels(phase=name), seconds,
+            ))
+        metric('dashex_phase_calls_total', 'counter',
+               'Number of timed blocks of local work, by phase.')
+        for name, (count, seconds) in phases:
+            lines.append('dashex_phase_calls_total{%s} %d' % (
+                labels(phase=name), count,
+            ))
+        for name, value in counters:
+            metric('dashex_%s_total' % (name,), 'counter',
+                   'Total %s.' % (name.replace('_', ' '),))
+            lines.append('dashex_%s_total %d' % (name, value))
+        ratios = sorted(self.compression_ratios().items())
+        if ratios:
+            metric('dashex_http_compression_ratio', 'gauge',
+                   'Uncompressed to compressed size of HTTP bodies.')
+        for direction, ratio in ratios:
+            lines.append('dashex_http_compression_ratio{%s} %r' % (
+                labels(direction=direction), ratio,
+            ))
+        return '\n'.join(lines) + '\n'
+
+    def render(self, format='json'):
+        """Render the report as ``json`` or ``prometheus``."""
+        if format == 'prometheus':
+            return self.to_prometheus()
+        return self.to_json()
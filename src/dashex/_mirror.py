@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+
+import logging
+import os.path
+import subprocess
+import time
+import timeit
+
+from . import (
+    DEFAULT_POOL_SIZE,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+    DEFAULT_WAIT_TIMEOUT,
+    _pull,
+    grafana_client,
+    grafana_wait,
+    pull_folder,
+)
+from ._log import Progress
+from ._manifest import Manifest
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MIRROR_INTERVAL = 30.0
+"""Default delay (in seconds) between the starts of two mirror cycles."""
+
+MIRRORED_FOLDERS = ('grafana/datasources', 'grafana/dashboards')
+"""Folders committed to Git, relative to the output folder."""
+
+
+def run_git(path, *args):
+    """Run a Git command in ``path``, return its exit status."""
+    with open(os.devnull, 'wb') as devnull:
+        return subprocess.call(('git',) + args, cwd=path, stdout=devnull)
+
+
+def commit_changes(path, message):
+    """Commit changes to mirrored files in ``path``, if any.
+
+    Other changes, staged or not, are left alone.  Returns ``True`` if a
+    commit was made.
+    """
+    if run_git(path, 'add', '--all', '--', *MIRRORED_FOLDERS):
+        raise Exception('Could not stage changes in "%s".' % (path,))
+    if not run_git(path, 'diff', '--cached', '--quiet', '--',
+                   *MIRRORED_FOLDERS):
+        return False
+    if run_git(path, 'commit', '--quiet', '--message', message, '--',
+               *MIRRORED_FOLDERS):
+        raise Exception('Could not commit changes in "%s".' % (path,))
+    return True
+
+
+class Mirror(object):
+    """Keep a folder up to date with a Grafana instance.
+
+    Each :py:meth:`cycle` is an incremental pull (see
+    :py:func:`dashex.grafana_pull`) that reuses the manifest kept in memory
+    since the previous cycle, so only changed dashboards are downloaded and
+    nothing is written when nothing changed.  With ``git``, changes are
+    committed to the Git repository holding ``output_path`` (created if
+    there's none).
+    """
+
+    def __init__(self, client, output_path, jobs=1, git=False):
+        self._client = client
+        self._output_path = output_path
+        self._jobs = jobs
+        self._git = git
+        self._path = pull_folder(output_path)
+        self._manifest = Manifest.load(
+            os.path.join(self._path, 'manifest.json'),
+        )
+        if git and run_git(output_path, 'rev-parse', '--git-dir'):
+            log.info('Creating a Git repository in "%s".', output_path)
+            if run_git(output_path, 'init', '--quiet'):
+                raise Exception('Could not create a Git repository in '
+                                '"%s".' % (output_path,))
+
+    def cycle(self):
+        """Pull what changed since the previous cycle.
+
+        Returns counts of ``written``, ``unchanged`` and ``deleted`` files.
+        """
+        summary = _pull(self._client, self._jobs, Progress('Pulled', None),
+                        output_path=self._path, incremental=True,
+                        manifest=self._manifest)
+        if not (summary['written'] or summary['deleted']):
+            log.debug('Nothing changed.')
+            return summary
+        log.info('Wrote %d changed files, deleted %d.',
+                 summary['written'], summary['deleted'],
+                 extra={'data': summary})
+        message = 'Mirror %s\n\n%d files changed, %d deleted.\n' % (
+            self._client.url(''), summary['written'], summary['deleted'],
+        )
+        if self._git and commit_changes(self._output_path, message):
+            log.info('Committed changes to Git.')
+        return summary
+
+
+def grafana_mirror(grafana_url, username, password, output_path='.',
+                   interval=DEFAULT_MIRROR_INTERVAL, jobs=1, git=False,
+                   pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES,
+                   max_rate=None, max_concurrency=None,
+                   timeout=DEFAULT_TIMEOUT, wait=True,
+                   wait_timeout=DEFAULT_WAIT_TIMEOUT, rounds=None,
+                   client=None, clock=timeit.default_timer,
+                   sleep=time.sleep):
+    """Mirror Grafana configuration to disk, every ``interval`` seconds.
+
+    Files have the layout of :py:func:`dashex.grafana_pull`, see
+    :py:class:`Mirror` for ``git``.  When nothing changed, a cycle costs a
+    listing of data sources and one of dashboards (one request per page of
+    1000 dashboards), plus one request per dashboard on instances whose
+    search results don't carry versions.  Failed cycles are logged and
+    retried on the next one.
+
+    Runs until interrupted, or for ``rounds`` cycles.  Returns total counts
+    of ``written``, ``unchanged`` and ``deleted`` files.
+    """
+
+    if client is None:
+        with grafana_client(grafana_url, username, password,
+                            pool_size=max(pool_size, jobs), retries=retries,
+                            max_rate=max_rate,
+                            max_concurrency=max_concurrency,
+                            timeout=timeout) as client:
+            return grafana_mirror(grafana_url, username, password,
+                                  output_path, interval=interval, jobs=jobs,
+                                  git=git, wait=wait,
+                                  wait_timeout=wait_timeout, rounds=rounds,
+                                  client=client, clock=clock, sleep=sleep)
+
+    import requests.exceptions
+
+    if wait:
+        grafana_wait(grafana_url, username, password, timeout=wait_timeout,
+                     client=client)
+
+    mirror = Mirror(client, output_path, jobs=jobs, git=git)
+    totals = dict(written=0, unchanged=0, deleted=0)
+    log.info('Mirroring to "%s" every %g seconds.', output_path, interval)
+    try:
+        while rounds is None or rounds > 0:
+            start = clock()
+            try:
+                summary = mirror.cycle()
+            except requests.exceptions.RequestException as error:
+                log.error('Mirroring failed: %s', error)
+            else:
+                for key in totals:
+                    totals[key] += summary[key]
+            if rounds is not None:
+                rounds -= 1
+                if not rounds:
+                    break
+            sleep(max(interval - (clock() - start), 0.0))
+    except KeyboardInterrupt:
+        pass
+    return totals
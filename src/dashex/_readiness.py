@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+
+HEALTH_PATHS = ('api/health', 'api/admin/stats')
+"""Endpoints probed for readiness, in order of preference.
+
+``api/health`` is cheap and doesn't require authentication, but older
+Grafana versions don't have it (it replies ``404``), in which case the next
+endpoint is used instead."""
+
+NOT_READY_STATUSES = frozenset([502, 503, 504])
+"""Statuses sent by Grafana (or a proxy in front of it) while it starts."""
+
+DEFAULT_WAIT_TIMEOUT = 60.0
+"""Default time (in seconds) to wait for Grafana before giving up."""
+
+DEFAULT_PROBE_TIMEOUT = (1.0, 5.0)
+"""Default connect and read timeouts (in seconds) for each probe."""
+
+
+class Backoff(object):
+    """Delays between readiness probes.
+
+    Delays start small, since fresh instances often become ready within a
+    fraction of a second, and double after each failed probe up to
+    ``maximum`` seconds.
+    """
+
+    def __init__(self, initial=0.025, factor=2.0, maximum=1.0):
+        self._initial = initial
+        self._factor = factor
+        self._maximum = maximum
+
+    def __iter__(self):
+        delay = self._initial
+        while True:
+            yield delay
+            delay = min(delay * self._factor, self._maximum)
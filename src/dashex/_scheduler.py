@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+
+import collections
+
+from ._compat import queue
+
+
+def _call(key, func):
+    """Run a task, capturing its outcome instead of raising.
+
+    ``BaseException`` is captured too: otherwise the pool would never report
+    the task as done and the scheduler would wait forever.
+    """
+    try:
+        return key, True, func()
+    except BaseException as error:
+        return key, False, error
+
+
+class Scheduler(object):
+    """Run tasks concurrently while honoring dependencies between them.
+
+    Tasks are identified by a hashable key.  A task starts once all the tasks
+    it depends on have completed successfully; dependencies on keys that were
+    never added are considered already satisfied.  At most ``jobs`` tasks are
+    in flight at any given time.
+
+    On the first failure, no new tasks are started, in-flight tasks are
+    allowed to finish and the error is re-raised by :py:meth:`run`.
+    """
+
+    def __init__(self, jobs=1):
+        self._jobs = max(jobs, 1)
+        self._tasks = collections.OrderedDict()
+
+    def add(self, key, func, after=()):
+        """Register ``func`` to run after all tasks listed in ``after``."""
+        if key in self._tasks:
+            raise ValueError('Duplicate task %r.' % (key,))
+        self._tasks[key] = (func, list(after))
+
+    def run(self):
+        """Run all tasks, return a ``dict`` mapping keys to results."""
+
+        # Build the dependency graph.
+        waiting = {}
+        dependents = {key: [] for key in self._tasks}
+        for key, (_, after) in self._tasks.items():
+            after = set(dep for dep in after if dep in self._tasks)
+            waiting[key] = len(after)
+            for dep in after:
+                dependents[dep].append(key)
+        ready = collections.deque(
+            key for key in self._tasks if waiting[key] == 0
+        )
+
+        results = {}
+        done = queue.Queue()
+        running = 0
+        error = None
+        pool = None
+        if self._jobs > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(self._jobs)
+        try:
+            while ready or running:
+                while ready and (error is None) and running < self._jobs:
+                    key = ready.popleft()
+                    func, _ = self._tasks[key]
+                    if pool is None:
+                        done.put(_call(key, func))
+                    else:
+                        pool.apply_async(_call, (key, func),
+                                         callback=done.put)
+                    running += 1
+                if running == 0:
+                    break
+                key, ok, value = done.get()
+                running -= 1
+                if not ok:
+                    error = error or value
+                    continue
+                results[key] = value
+                for dependent in dependents[key]:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        ready.append(dependent)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if error is not None:
+            raise error
+        if len(results) < len(self._tasks):
+            raise ValueError('Dependency cycle between tasks %r.' % (
+                sorted(set(self._tasks) - set(results)),
+            ))
+        return results
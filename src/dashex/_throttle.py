@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+
+import random
+import threading
+import time
+import timeit
+
+
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+"""Statuses of responses that are worth retrying: the request failed because
+the instance (or a proxy in front of it) is busy or restarting."""
+
+REJECTED_STATUSES = frozenset([429, 503])
+"""Statuses of responses to requests that were rejected before processing,
+which are safe to retry even when the request isn't idempotent."""
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+"""HTTP methods that may be sent more than once without side effects."""
+
+
+def parse_retry_after(value, now=None):
+    """Parse a ``Retry-After`` header, return a delay in seconds.
+
+    The header holds either a number of seconds or an HTTP date.  Returns
+    ``None`` if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    import email.utils
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(email.utils.mktime_tz(date) - now, 0.0)
+
+
+class RetryPolicy(object):
+    """Decide whether and when to retry failed requests.
+
+    Delays grow exponentially from ``backoff`` seconds, capped at
+    ``max_delay`` seconds, with "full jitter" (a random delay between zero
+    and the exponential delay) so that concurrent workers don't retry in
+    lockstep.  When the server sends a ``Retry-After`` header, that delay is
+    used instead (still capped at ``max_delay``).
+
+    Requests that are not idempotent (e.g. ``POST``) are only retried when
+    the server rejected them before processing (``429`` or ``503``).
+    """
+
+    def __init__(self, retries=3, backoff=0.1, max_delay=30.0,
+                 random=random.random):
+        self._retries = max(retries, 0)
+        self._backoff = backoff
+        self._max_delay = max_delay
+        self._random = random
+
+    @property
+    def retries(self):
+        return self._retries
+
+    def should_retry(self, attempt, method, status=None):
+        """Check if a request should be sent again.
+
+        ``attempt`` counts failed attempts so far, starting at 1.  A
+        ``status`` of ``None`` stands for a connection error.
+        """
+        if attempt > self._retries:
+            return False
+        if status is None:
+            return method.upper() in IDEMPOTENT_METHODS
+        if status in REJECTED_STATUSES:
+            return True
+        return status in RETRY_STATUSES and \
+            method.upper() in IDEMPOTENT_METHODS
+
+    def delay(self, attempt, retry_after=None):
+        """Compute the delay (in seconds) before the next attempt."""
+        if retry_after is not None:
+            return min(retry_after, self._max_delay)
+        ceiling = min(self._backoff * (2 ** (attempt - 1)), self._max_delay)
+        return self._random() * ceiling
+
+
+class RateLimiter(object):
+    """Token bucket limiting the rate and concurrency of requests.
+
+    Up to ``burst`` requests may start at once, after which requests start at
+    ``rate`` per second on average.  At most ``concurrency`` requests are in
+    flight at any given time.  Either limit may be ``None`` (unlimited).
+
+    Use :py:meth:`reserve` and :py:attr:`concurrency` to apply the limits
+    from asynchronous code, or the limiter as a context manager around each
+    request from threads.
+    """
+
+    def __init__(self, rate=None, burst=1, concurrency=None,
+                 clock=timeit.default_timer, sleep=time.sleep):
+        self._rate = rate
+        self._burst = max(burst, 1)
+        self._concurrency = concurrency
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(self._burst)
+        self._last = None
+        self._lock = threading.Lock()
+        self._slots = None
+        if concurrency:
+            self._slots = threading.BoundedSemaphore(concurrency)
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def concurrency(self):
+        return self._concurrency
+
+    def reserve(self):
+        """Take a token, return how long (in seconds) to wait before use.
+
+        Tokens are handed out in order: when the bucket is empty, callers are
+        scheduled one after the other, ``1 / rate`` seconds apart.
+        """
+        if not self._rate:
+            return 0.0
+        with self._lock:
+            now = self._clock()
+            if self._last is not None:
+                self._tokens = min(
+                    self._tokens + (now - self._last) * self._rate,
+                    float(self._burst),
+                )
+            self._last = now
+            self._tokens -= 1.0
+            if self._tokens >= 0.0:
+                return 0.0
+            return -self._tokens / self._rate
+
+    def __enter__(self):
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            delay = self.reserve()
+            if delay > 0.0:
+                self._sleep(delay)
+        except BaseException:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        if self._slots is not None:
+            self._slots.release()
@@ -1,16 +1,181 @@
 # -*- coding: utf-8 -*-
 
 
+import collections
 import errno
+import itertools
+import logging
 import os
+import tempfile
+
+from ._compat import replace
+
+
+log = logging.getLogger(__name__)
+
+# Read the process umask once (it can only be read by changing it), so that
+# files written atomically get the same permissions as a plain ``open()``.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+CHUNK_SIZE = 64 * 1024
+"""Size (in bytes) of the blocks in which streamed files and bodies are
+written, read and compared."""
 
 
 def ensure_dir(path):
     """Create a folder if it doesn't already exist."""
-    print('Creating "%s".' % (path,))
+    log.debug('Creating "%s".', path)
     try:
         os.mkdir(path)
     except OSError as error:
         if error.errno != errno.EEXIST:
             raise
     return path
+
+
+def remove_file(path):
+    """Delete a file if it exists."""
+    try:
+        os.unlink(path)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+
+
+def rechunk(chunks, size=CHUNK_SIZE):
+    """Group a stream of byte strings into blocks of at least ``size`` bytes.
+
+    Only the last block may be smaller.  Chunks are copied into the block
+    as they come rather than kept around: small byte strings can take up
+    much more memory than their length.
+    """
+    block = bytearray()
+    for chunk in chunks:
+        block += chunk
+        if len(block) >= size:
+            yield bytes(block)
+            block = bytearray()
+    if block:
+        yield bytes(block)
+
+
+def atomic_write(path, data):
+    """Write a file via a temporary file and a rename.
+
+    Readers (and later runs, after a crash) see either the old contents or
+    the new contents, never a truncated file.
+    """
+    atomic_write_chunks(path, [data])
+
+
+def atomic_write_chunks(path, chunks):
+    """Write a stream of byte strings, like :py:func:`atomic_write`."""
+    folder, name = os.path.split(path)
+    fd, temp = tempfile.mkstemp(dir=folder or '.', prefix='.%s.' % (name,))
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            for chunk in chunks:
+                stream.write(chunk)
+        os.chmod(temp, 0o666 & ~_UMASK)
+        replace(temp, path)
+    except Exception:
+        remove_file(temp)
+        raise
+
+
+def same_contents(path, data):
+    """Check if a file holds exactly ``data``.
+
+    Sizes are compared first, so the file is only read when they match.
+    """
+    try:
+        if os.stat(path).st_size != len(data):
+            return False
+        with open(path, 'rb') as stream:
+            return stream.read() == data
+    except (IOError, OSError) as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return False
+
+
+def update_file(path, data):
+    """Atomically replace a file unless it already holds ``data``.
+
+    Skipping identical files preserves their modification time.  Returns
+    ``True`` if the file was written.
+    """
+    if same_contents(path, data):
+        return False
+    atomic_write(path, data)
+    return True
+
+
+def update_file_chunks(path, chunks):
+    """Atomically replace a file unless it already holds a stream of bytes.
+
+    Like :py:func:`update_file`, but the chunks are compared with the file
+    as they come and only written out from the first difference on (along
+    with the identical part read back from the file), so neither the old
+    nor the new contents are ever held in memory whole.
+    """
+    chunks = iter(chunks)
+    try:
+        old = open(path, 'rb')
+    except IOError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        atomic_write_chunks(path, chunks)
+        return True
+    with old:
+        offset, different = 0, []
+        for chunk in chunks:
+            if old.read(len(chunk)) != chunk:
+                different.append(chunk)
+                break
+            offset += len(chunk)
+        else:
+            if not old.read(1):
+                return False
+
+        def same():
+            old.seek(0)
+            remaining = offset
+            while remaining:
+                block = old.read(min(remaining, CHUNK_SIZE))
+                if not block:
+                    raise IOError('"%s" changed while being updated.'
+                                  % (path,))
+                yield block
+                remaining -= len(block)
+
+        atomic_write_chunks(path, itertools.chain(same(), different, chunks))
+    return True
+
+
+def parallel_map(func, items, jobs=1):
+    """Apply ``func`` to ``items`` using up to ``jobs`` worker threads.
+
+    Results are yielded in the same order as ``items``, regardless of the
+    order in which the calls complete.  ``items`` is consumed lazily, with
+    only a few calls queued ahead of the results, so it can be a stream.
+    With a single job, everything runs in the calling thread.
+    """
+    if jobs <= 1:
+        for item in items:
+            yield func(item)
+        return
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(jobs)
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DEBOUNCE = 0.2
+"""Default delay (in seconds) without changes that ends a burst of edits."""
+
+DEFAULT_POLL_INTERVAL = 0.5
+"""Default delay (in seconds) between scans when polling for changes."""
+
+# Events of interest, from <sys/inotify.h>: files written and closed, moved
+# in or out (editors and atomic writes save via a rename) and deleted.
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_DELETE = 0x00000200
+_IN_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_DELETE
+
+_EVENT = struct.Struct('iIII')
+
+
+def is_document(name):
+    """Check if a file name is that of a document (not a temporary file)."""
+    return name.endswith('.json') and not name.startswith('.')
+
+
+class PollingWatcher(object):
+    """Detect changes to documents by scanning folders periodically.
+
+    Files are compared by modification time and size, every ``interval``
+    seconds.  Works everywhere, at the cost of some latency and I/O.
+    """
+
+    def __init__(self, folders, interval=DEFAULT_POLL_INTERVAL,
+                 clock=time.time, sleep=time.sleep):
+        self._folders = list(folders)
+        self._interval = interval
+        self._clock = clock
+        self._sleep = sleep
+        self._files = self._scan()
+
+    def _scan(self):
+        files = {}
+        for folder in self._folders:
+            try:
+                names = os.listdir(folder)
+            except OSError as error:
+                if error.errno != errno.ENOENT:
+                    raise
+                continue
+            for name in names:
+                if not is_document(name):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_mtime, stat.st_size)
+        return files
+
+    def changes(self, timeout=None):
+        """Wait up to ``timeout`` seconds (forever with ``None``) for changes.
+
+        Returns the set of paths that were created, modified or deleted,
+        empty if nothing changed in time.
+        """
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            delay = self._interval
+            if deadline is not None:
+                delay = min(delay, max(deadline - self._clock(), 0.0))
+            self._sleep(delay)
+            files = self._scan()
+            changed = set(
+                path for path in set(files) | set(self._files)
+                if files.get(path) != self._files.get(path)
+            )
+            self._files = files
+            if changed or (deadline is not None and
+                           self._clock() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class InotifyWatcher(object):
+    """Detect changes to documents as they happen, with Linux's inotify.
+
+    The ``inotify`` system calls are used through ``ctypes``, so there's
+    nothing to install.  Raises ``OSError`` (or ``AttributeError``) where
+    they're not available.
+    """
+
+    def __init__(self, folders):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+        if fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self._fd = fd
+        self._folders = {}
+        try:
+            for folder in folders:
+                wd = libc.inotify_add_watch(
+                    fd, os.path.abspath(folder).encode('utf-8'), _IN_MASK,
+                )
+                if wd < 0:
+                    code = ctypes.get_errno()
+                    raise OSError(code, os.strerror(code), folder)
+                self._folders[wd] = folder
+        except Exception:
+            self.close()
+            raise
+
+    def _read(self):
+        changed = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as error:
+            if error.errno != errno.EAGAIN:
+                raise
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, size = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + size].rstrip(b'\0').decode('utf-8')
+            offset += size
+            if wd in self._folders and is_document(name):
+                changed.add(os.path.join(self._folders[wd], name))
+        return changed
+
+    def changes(self, timeout=None):
+        """See :py:meth:`PollingWatcher.changes`."""
+        while True:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+            if not readable:
+                return set()
+            changed = self._read()
+            if changed:
+                return changed
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def watch_folders(folders, polling=False, interval=DEFAULT_POLL_INTERVAL):
+    """Watch folders for changes to documents.
+
+    Uses inotify where available (see :py:class:`InotifyWatcher`) unless
+    ``polling`` is set, and otherwise falls back to scanning the folders
+    every ``interval`` seconds (see :py:class:`PollingWatcher`).
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(folders)
+        except (AttributeError, OSError) as error:
+            log.debug('inotify is unavailable (%s), polling instead.', error)
+    return PollingWatcher(folders, interval)
+
+
+def wait_for_changes(watcher, debounce=DEFAULT_DEBOUNCE):
+    """Wait for a burst of changes to end, return the changed paths.
+
+    Blocks until something changes, then until nothing changed for
+    ``debounce`` seconds, so that saving several files (or an editor saving
+    one file in several steps) results in a single batch.
+    """
+    changed = set()
+    while not changed:
+        changed = watcher.changes()
+    while True:
+        more = watcher.changes(debounce)
+        if not more:
+            return changed
+        changed |= more
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""asyncio counterparts of :py:func:`dashex.grafana_wait`,
+:py:func:`dashex.grafana_pull` and :py:func:`dashex.grafana_push`.
+
+This module requires Python 3.5+ and ``aiohttp`` (install the ``aio`` extra).
+All coroutines share a single pooled :py:class:`AsyncClient` per instance, so
+many Grafana instances can be synchronized from one event loop without
+spawning a thread for each of them.  Disk I/O runs in the loop's default
+executor.  Incremental pulls are not supported here yet.
+"""
+
+
+import aiohttp
+import asyncio
+import functools
+import logging
+import os.path
+import timeit
+
+from . import (
+    SEARCH_PAGE_SIZE,
+    dashboard_slugs,
+    datasource_pushed,
+    ensure_dir,
+    is_version_conflict,
+    load_json,
+    prepare_dashboard,
+    prepare_datasource,
+    push_plan,
+    repeated_search_page,
+    save_json,
+    search_path,
+    strip_dashboard,
+    strip_datasource,
+)
+from ._compat import urljoin
+from ._deadline import Deadline, DeadlineExceeded, bounded_timeout
+from ._http import DEFAULT_POOL_SIZE, DEFAULT_RETRIES, DEFAULT_TIMEOUT
+from ._json import dumps, loads
+from ._metrics import Metrics
+from ._readiness import (
+    DEFAULT_PROBE_TIMEOUT,
+    DEFAULT_WAIT_TIMEOUT,
+    HEALTH_PATHS,
+    NOT_READY_STATUSES,
+    Backoff,
+)
+from ._throttle import RateLimiter, RetryPolicy, parse_retry_after
+
+
+log = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    """Grafana replied with an error status."""
+
+    def __init__(self, status, body):
+        super(HTTPError, self).__init__(status, body)
+        self.status = status
+        self.body = body
+
+
+class AsyncClient(object):
+    """Pooled, keep-alive asynchronous HTTP client for a JSON API.
+
+    Use as an asynchronous context manager: the underlying
+    ``aiohttp.ClientSession`` is opened on entry and closed on exit.
+
+    Requests are throttled and retried like those of
+    :py:class:`dashex._http.Client`.
+    """
+
+    def __init__(self, base_url, credentials=None, headers=None,
+                 pool_size=DEFAULT_POOL_SIZE, retry=None, limiter=None,
+                 timeout=DEFAULT_TIMEOUT, metrics=None):
+        self._base_url = base_url
+        self._metrics = metrics or Metrics()
+        self._timeout = timeout
+        self._credentials = credentials
+        self._headers = headers or {}
+        self._pool_size = pool_size
+        self._retry = retry or RetryPolicy(retries=0)
+        self._limiter = limiter or RateLimiter()
+        self._slots = None
+        self._session = None
+
+    @property
+    def base_url(self):
+        return self._base_url
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def url(self, path):
+        """Resolve ``path`` relative to the base URL."""
+        return urljoin(self._base_url, path)
+
+    async def open(self):
+        """Open the connection pool."""
+        auth = None
+        if self._credentials and self._credentials[0] is not None:
+            username, password = self._credentials
+            auth = aiohttp.BasicAuth(username, password or '')
+        if self._limiter.concurrency:
+            self._slots = asyncio.Semaphore(self._limiter.concurrency)
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=self._pool_size),
+            auth=auth,
+            headers=self._headers,
+        )
+
+    async def close(self):
+        """Release all pooled connections."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _send(self, method, path, headers, data, **kwds):
+        """Send a single request, return the status, headers and body."""
+        if self._slots is not None:
+            await self._slots.acquire()
+        try:
+            delay = self._limiter.reserve()
+            if delay > 0.0:
+                await asyncio.sleep(delay)
+            async with self._session.request(method, self.url(path),
+                                             headers=headers, data=data,
+                                             **kwds) as rep:
+                return rep.status, rep.headers, await rep.read()
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    async def request_json(self, method, path, data=None, retry=True,
+                           timeout=None):
+        timeout = timeout or self._timeout
+        """Send a request, return the decoded JSON response.
+
+        Transient failures are retried unless ``retry`` is false.  Each
+        attempt gets ``(connect, read)`` ``timeout`` seconds (the client's
+        default timeout unless specified).
+        """
+        headers = {}
+        if data is not None:
+            headers['Content-Type'] = 'application/json'
+            data = dumps(data)
+        policy = self._retry if retry else RetryPolicy(retries=0)
+        kwds = {}
+        if timeout is not None:
+            if not isinstance(timeout, tuple):
+                timeout = (timeout, timeout)
+            connect, read = timeout
+            kwds['timeout'] = aiohttp.ClientTimeout(sock_connect=connect,
+                                                    sock_read=read)
+        clock = self._metrics.clock
+        attempt = 0
+        while True:
+            attempt += 1
+            if attempt > 1:
+                self._metrics.retry(method, path)
+            start = clock()
+            try:
+                status, rep_headers, body = await self._send(
+                    method, path, headers, data, **kwds
+                )
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self._metrics.request(method, path, None, clock() - start)
+                if not policy.should_retry(attempt, method):
+                    raise
+                await asyncio.sleep(policy.delay(attempt))
+                continue
+            self._metrics.request(method, path, status, clock() - start,
+                                  len(body))
+            if not policy.should_retry(attempt, method, status):
+                break
+            await asyncio.sleep(policy.delay(
+                attempt, parse_retry_after(rep_headers.get('Retry-After')),
+            ))
+        try:
+            body = loads(body)
+        except ValueError:
+            if status < 400:
+                raise
+        if status >= 400:
+            raise HTTPError(status, body)
+        return body
+
+    async def get_json(self, path):
+        """Download a JSON object."""
+        return await self.request_json('GET', path)
+
+    async def post_json(self, path, data={}):
+        """Upload a JSON object."""
+        return await self.request_json('POST', path, data=data)
+
+    async def put_json(self, path, data={}):
+        """Upload a JSON object."""
+        return await self.request_json('PUT', path, data=data)
+
+
+async def within_deadline(coro, deadline):
+    """Run a coroutine, cancel it after ``deadline`` seconds.
+
+    Raises :py:class:`dashex.DeadlineExceeded` when the coroutine is
+    cancelled.
+    """
+    if deadline is None:
+        return await coro
+    try:
+        return await asyncio.wait_for(coro, deadline)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
+
+
+async def run_blocking(func, *args):
+    """Run blocking (disk) I/O in the default executor."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
+
+
+async def search_all(client, limit=None):
+    """Enumerate all dashboards, one page of results at a time."""
+    limit = limit or SEARCH_PAGE_SIZE
+    hits = []
+    page, previous = 1, None
+    while True:
+        results = await client.get_json(search_path(page, limit))
+        if repeated_search_page(results, previous):
+            return hits
+        hits.extend(results)
+        if len(results) < limit:
+            return hits
+        page, previous = page + 1, results
+
+
+def grafana_client(grafana_url, username, password,
+                   pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES,
+                   max_rate=None, max_concurrency=None,
+                   timeout=DEFAULT_TIMEOUT, metrics=None):
+    """Create a pooled asynchronous HTTP client for a Grafana instance.
+
+    See :py:func:`dashex.grafana_client` for the other arguments.
+    """
+    return AsyncClient(
+        grafana_url,
+        credentials=(username, password),
+        pool_size=pool_size,
+        retry=RetryPolicy(retries=retries),
+        limiter=RateLimiter(rate=max_rate, concurrency=max_concurrency),
+        timeout=timeout,
+        metrics=metrics,
+    )
+
+
+async def grafana_wait(grafana_url, username, password,
+                       timeout=None, clock=timeit.default_timer, client=None,
+                       probe_timeout=DEFAULT_PROBE_TIMEOUT, backoff=None):
+    """Poll Grafana until its API is responsive.
+
+    See :py:func:`dashex.grafana_wait`.
+    """
+
+    if client is None:
+        async with grafana_client(grafana_url, username, password) as client:
+            return await grafana_wait(grafana_url, username, password,
+                                      timeout=timeout, clock=clock,
+                                      client=client,
+                                      probe_timeout=probe_timeout,
+                                      backoff=backoff)
+
+    deadline = Deadline(timeout, clock)
+    delays = iter(backoff or Backoff())
+    paths = list(HEALTH_PATHS)
+    log.info('Waiting for Grafana...')
+    while not deadline.expired():
+        try:
+            await client.request_json(
+                'GET', paths[0], retry=False,
+                timeout=bounded_timeout(probe_timeout, deadline),
+            )
+        except HTTPError as error:
+            if error.status == 404 and len(paths) > 1:
+                paths.pop(0)
+                continue
+            if error.status not in NOT_READY_STATUSES:
+                raise
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            pass
+        else:
+            log.info('Grafana is ready.')
+            return
+        await asyncio.sleep(deadline.bound(next(delays)))
+
+    raise Exception('Grafana is unresponsive at this time.')
+
+
+async def grafana_pull(grafana_url, username, password, output_path,
+                       pool_size=DEFAULT_POOL_SIZE, jobs=1,
+                       retries=DEFAULT_RETRIES, max_rate=None,
+                       max_concurrency=None, timeout=DEFAULT_TIMEOUT,
+                       deadline=None, client=None):
+    """Pull Grafana configuration to disk.
+
+    Up to ``jobs`` dashboards are downloaded concurrently, but files are
+    written in listing order.  The whole pull is cancelled after
+    ``deadline`` seconds.
+    """
+
+    if client is None:
+        async with grafana_client(grafana_url, username, password,
+                                  pool_size=max(pool_size, jobs),
+                                  retries=retries, max_rate=max_rate,
+                                  max_concurrency=max_concurrency,
+                                  timeout=timeout) as client:
+            return await within_deadline(grafana_pull(
+                grafana_url, username, password, output_path,
+                jobs=jobs, client=client,
+            ), deadline)
+
+    # Prepare to store contents on disk.
+    await run_blocking(ensure_dir, output_path)
+    output_path = os.path.join(output_path, 'grafana')
+    await run_blocking(ensure_dir, output_path)
+
+    # List data sources and dashboards.
+    datasources, search = await asyncio.gather(
+        client.get_json('api/datasources'),
+        search_all(client),
+    )
+
+    # Fetch all data sources.
+    await run_blocking(ensure_dir, os.path.join(output_path, 'datasources'))
+    for document in datasources:
+        slug = document['name']
+        path = os.path.join(output_path, 'datasources', '%s.json' % (slug,))
+        log.debug('Wrote "%s".', path)
+        await run_blocking(save_json, path, strip_datasource(document))
+
+    # Fetch all dashboards (except Home, which we can't edit).
+    await run_blocking(ensure_dir, os.path.join(output_path, 'dashboards'))
+    semaphore = asyncio.Semaphore(max(jobs, 1))
+
+    async def fetch(slug):
+        async with semaphore:
+            return await client.get_json('api/dashboards/db/%s' % (slug,))
+
+    slugs = dashboard_slugs(search)
+    futures = [asyncio.ensure_future(fetch(slug)) for slug in slugs]
+    try:
+        for slug, future in zip(slugs, futures):
+            document = await future
+            path = os.path.join(output_path, 'dashboards',
+                                '%s.json' % (slug,))
+            log.debug('Wrote "%s".', path)
+            await run_blocking(save_json, path, strip_dashboard(document))
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+async def grafana_push(grafana_url, username, password, input_path,
+                       pool_size=DEFAULT_POOL_SIZE, jobs=1,
+                       retries=DEFAULT_RETRIES, max_rate=None,
+                       max_concurrency=None, wait=True,
+                       wait_timeout=DEFAULT_WAIT_TIMEOUT,
+                       timeout=DEFAULT_TIMEOUT, deadline=None, client=None):
+    """Push on-disk configuration to Grafana.
+
+    Data sources are uploaded before the dashboards that reference them and
+    up to ``jobs`` independent uploads run concurrently.  The whole push is
+    cancelled after ``deadline`` seconds.
+    """
+
+    if client is None:
+        async with grafana_client(grafana_url, username, password,
+                                  pool_size=max(pool_size, jobs),
+                                  retries=retries, max_rate=max_rate,
+                                  max_concurrency=max_concurrency,
+                                  timeout=timeout) as client:
+            return await within_deadline(grafana_push(
+                grafana_url, username, password, input_path,
+                jobs=jobs, wait=wait, wait_timeout=wait_timeout,
+                client=client,
+            ), deadline)
+
+    # Ensure Grafana is responsive.
+    if wait:
+        await grafana_wait(grafana_url, username, password,
+                           timeout=wait_timeout, client=client)
+
+    # List existing data sources and dashboards.
+    datasources, search = await asyncio.gather(
+        client.get_json('api/datasources'),
+        search_all(client),
+    )
+    datasources = {
+        document['name']: document['id'] for document in datasources
+    }
+    dashboards = {
+        document['uri'].split('/', 1)[1]: document['id']
+        for document in search
+    }
+
+    async def push_datasource(path):
+        log.debug('Uploading "%s".', path)
+        document = await run_blocking(load_json, path)
+        method, path = prepare_datasource(document, datasources)
+        rep = await client.request_json(method, path, data=document)
+        datasource_pushed(document, method, rep)
+
+    async def push_dashboard(path):
+        log.debug('Uploading "%s".', path)
+        document = prepare_dashboard(await run_blocking(load_json, path),
+                                     dashboards)
+        try:
+            await client.post_json('api/dashboards/db', data=document)
+        except HTTPError as error:
+            if not is_version_conflict(error.status):
+                raise
+            log.warning('Dashboard "%s" not uploaded: %s', path,
+                        error.body['message'])
+
+    # Each upload waits for its dependencies, then for a free slot.
+    semaphore = asyncio.Semaphore(max(jobs, 1))
+    futures = {}
+
+    async def run(func, path, after):
+        await asyncio.gather(*after)
+        async with semaphore:
+            await func(path)
+
+    plan = await run_blocking(push_plan, input_path)
+    for key, (path, after) in plan.items():
+        if key[0] == 'datasource':
+            func = push_datasource
+        else:
+            func = push_dashboard
+        futures[key] = asyncio.ensure_future(run(func, path, [
+            futures[dep] for dep in after if dep in futures
+        ]))
+    try:
+        await asyncio.gather(*futures.values())
+    finally:
+        for future in futures.values():
+            future.cancel()
@@ -8,6 +8,7 @@ import os
 import pytest
 import requests
 import requests.exceptions
+import sys
 import threading
 
 try:
@@ -16,12 +17,14 @@ try:
         BaseHTTPRequestHandler,
         HTTPServer,
     )
+    from socketserver import ThreadingMixIn
 except ImportError:
     # py2
     from BaseHTTPServer import (
         BaseHTTPRequestHandler,
         HTTPServer,
     )
+    from SocketServer import ThreadingMixIn
 
 from contextlib import contextmanager
 
@@ -33,6 +36,65 @@ except ImportError:
     from urlparse import urljoin
 
 
+# The asyncio API uses syntax that doesn't compile on older Pythons.
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('test_aio.py')
+
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark', action='store_true', default=False,
+                     help='Run benchmarks at every size, not just smoke '
+                          'tests.')
+
+
+def pytest_configure(config):
+    config.benchmark_results = []
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Print benchmark results after the tests."""
+    results = terminalreporter.config.benchmark_results
+    if not results:
+        return
+    terminalreporter.section('benchmarks')
+    terminalreporter.write_line('%-8s %8s %10s %12s %12s' % (
+        'command', 'count', 'seconds', 'per second', 'peak MiB',
+    ))
+    for result in results:
+        terminalreporter.write_line('%-8s %8d %10.3f %12.1f %12s' % (
+            result['command'],
+            result['objects'],
+            result['seconds'],
+            result['objects'] / result['seconds'],
+            '%.1f' % (result['peak'] / 2.0 ** 20,)
+            if result['peak'] is not None else '-',
+        ))
+
+
+@pytest.fixture(scope='function')
+def benchmark(request):
+    """Return a function that records a benchmark result."""
+
+    def record(command, objects, seconds, peak):
+        request.config.benchmark_results.append({
+            'command': command,
+            'objects': objects,
+            'seconds': seconds,
+            'peak': peak,
+        })
+    return record
+
+
+@pytest.fixture(scope='function', autouse=True)
+def cache_home(tmpdir_factory, monkeypatch):
+    """Keep each test's HTTP cache (and push state) out of the user's."""
+
+    path = str(tmpdir_factory.mktemp('cache'))
+    monkeypatch.setenv('XDG_CACHE_HOME', path)
+    return path
+
+
 @pytest.fixture(scope='function')
 def fs_sandbox(tmpdir):
     """Move into a temporary folder while the test runs."""
@@ -301,6 +363,22 @@ def grafana(grafana_service):
     grafana_service.cleanup()
 
 
+class HTTPResponseError(Exception):
+    """Raise from a mock route to send a non-200 JSON response."""
+
+    def __init__(self, status, body, headers=None):
+        super(HTTPResponseError, self).__init__(status, body)
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server that handles each connection in its own thread."""
+
+    daemon_threads = True
+
+
 @contextmanager
 def run_http_service_in_background(routes):
     """Spawn an HTTP service for the duration of a code block.
@@ -318,49 +396,74 @@ def run_http_service_in_background(routes):
             },
         }
 
+    Routes registered without a query string match requests with any query
+    string.  ``POST`` and ``PUT`` routes receive the decoded JSON request
+    body (or the text of ``text/*`` bodies) as their only argument.  Routes
+    may raise :py:class:`HTTPResponseError` to send an error status with a
+    JSON body.
+
     """
 
     class HTTPRequestHandler(BaseHTTPRequestHandler):
         """Web server that mocks Grafana."""
 
+        # Keep connections alive between requests, like Grafana does.
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, status, content_type, body, headers={}):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', len(body))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
         def _do(self):
+            size = int(self.headers.get('Content-Length', 0))
+            data = self.rfile.read(size)
             if self.command not in routes:
-                self.send_error(501, "Unsupported method (%r)" % self.command)
+                self._send(501, 'text/plain', b'Unsupported method')
                 return
             route = routes[self.command].get(self.path, None)
             if route is None:
-                self.send_error(404)
-                self.send_header('Content-Type', 'text/plain')
-                self.send_header('Content-Length', 0)
-                self.end_headers()
+                # Routes without a query string match any query string.
+                route = routes[self.command].get(
+                    self.path.split('?', 1)[0], None,
+                )
+            if route is None:
+                self._send(404, 'text/plain', b'')
                 return
             try:
-                body = route()
+                if self.command in ('POST', 'PUT'):
+                    data = data.decode('utf-8')
+                    content_type = self.headers.get('Content-Type', '')
+                    if not content_type.startswith('text/'):
+                        data = json.loads(data)
+                    body = route(data)
+                else:
+                    body = route()
+            except HTTPResponseError as error:
+                body = json.dumps(error.body).encode('utf-8')
+                self._send(error.status, 'application/json', body,
+                           error.headers)
             except Exception as error:
                 body = str(error)
                 body = body.encode('utf-8')
-                self.send_error(500)
-                self.send_header('Content-Type', 'text/plain')
-                self.send_header('Content-Length', len(body))
-                self.end_headers()
-                self.wfile.write(body)
-                return
+                self._send(500, 'text/plain', body)
             else:
                 body = json.dumps(body, indent=2,
                                   sort_keys=True,
                                   separators=(',', ': '))
                 body = body.encode('utf-8')
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.send_header('Content-Length', len(body))
-                self.end_headers()
-                self.wfile.write(body)
-                return
+                self._send(200, 'application/json', body)
 
         do_GET = _do
+        do_POST = _do
+        do_PUT = _do
 
     # Start the server in a background thread.
-    server = HTTPServer(('0.0.0.0', 0), HTTPRequestHandler)
+    server = ThreadingHTTPServer(('0.0.0.0', 0), HTTPRequestHandler)
     thread = threading.Thread(target=server.serve_forever)
     thread.start()
 
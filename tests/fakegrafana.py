@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""In-process fake Grafana instance, for offline and reproducible tests.
+
+Implements just enough of Grafana's HTTP API for dashex: searching, getting
+and saving dashboards, listing, creating and updating data sources, plus the
+health and admin stats endpoints.  Latency, error rate and the size of the
+initial dataset are configurable, so it doubles as a benchmark target.
+"""
+
+
+import collections
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import zlib
+
+from contextlib import contextmanager
+
+from conftest import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dashex._corpus import Corpus, dashboard_document, slugify
+
+try:
+    # py3
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:
+    # py2
+    from urlparse import parse_qs, urlsplit
+
+
+class GrafanaError(Exception):
+    """Reply with an error status and a JSON body."""
+
+    def __init__(self, status, message, headers=None):
+        super(GrafanaError, self).__init__(status, message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class FakeGrafana(object):
+    """State and behaviour of a fake Grafana instance.
+
+    The instance starts with the dashboards and data sources of ``corpus``
+    (see :py:class:`dashex._corpus.Corpus`), by default ``dashboards``
+    dashboards of ``panels`` panels each and ``datasources`` data sources.
+    Generated dashboards are only kept in memory once they're modified.
+
+    Each request takes at least ``latency`` seconds and fails with ``503``
+    (and ``Retry-After: 0``) with probability ``error_rate``, drawn from a
+    random generator seeded with ``seed``.
+
+    With ``etags``, successful ``GET`` responses carry an ``ETag`` header
+    and conditional requests get ``304 Not Modified`` when it still matches
+    (Grafana itself doesn't send one, but proxies in front of it may).
+
+    With ``gzip``, responses are compressed for clients that accept it, like
+    Grafana does with ``enable_gzip``.  Compressed request bodies are only
+    understood with ``gzip_requests`` (Grafana itself never does): otherwise
+    they get ``400 Bad Request``.
+
+    With ``listing_versions``, search results carry each dashboard's
+    ``version``, which Grafana's own search doesn't.
+    """
+
+    def __init__(self, dashboards=0, datasources=1, panels=4, latency=0.0,
+                 error_rate=0.0, seed=0, corpus=None, etags=False,
+                 gzip=False, gzip_requests=False, listing_versions=False):
+        if corpus is None:
+            corpus = Corpus(dashboards=dashboards, datasources=datasources,
+                            panels=panels, variables=0, seed=seed)
+        self._corpus = corpus
+        self._count = corpus.dashboards
+        self._latency = latency
+        self.etags = etags
+        self.gzip = gzip
+        self.gzip_requests = gzip_requests
+        self.listing_versions = listing_versions
+        self.encodings = collections.Counter()
+        self._error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._datasources = collections.OrderedDict(
+            (source['name'], source) for source in (
+                corpus.datasource(i) for i in range(corpus.datasources)
+            )
+        )
+        self._saved = {}
+        self._next_id = corpus.dashboards + 1
+        self.requests = collections.Counter()
+        self._routes = [
+            ('GET', re.compile(r'^/api/health$'), self.health),
+            ('GET', re.compile(r'^/api/admin/stats$'), self.admin_stats),
+            ('GET', re.compile(r'^/api/search$'), self.search),
+            ('GET', re.compile(r'^/api/dashboards/db/([^/]+)$'),
+             self.get_dashboard),
+            ('GET', re.compile(r'^/api/dashboards/id/(\d+)/versions$'),
+             self.dashboard_versions),
+            ('POST', re.compile(r'^/api/dashboards/db$'), self.save_dashboard),
+            ('GET', re.compile(r'^/api/datasources$'), self.list_datasources),
+            ('POST', re.compile(r'^/api/datasources$'),
+             self.create_datasource),
+            ('PUT', re.compile(r'^/api/datasources/(\d+)$'),
+             self.update_datasource),
+        ]
+
+    def _generated(self, slug):
+        match = re.match(r'^dashboard-(\d+)$', slug)
+        if match is None or int(match.group(1)) >= self._count:
+            return None
+        return self._corpus.dashboard(int(match.group(1)))
+
+    def dashboard(self, slug):
+        """Return a dashboard by slug, or ``None``."""
+        with self._lock:
+            if slug in self._saved:
+                return self._saved[slug]
+        return self._generated(slug)
+
+    def slugs(self):
+        """List slugs of all dashboards, in ID order."""
+        with self._lock:
+            saved = dict(
+                (slug, dashboard['id'])
+                for slug, dashboard in self._saved.items()
+            )
+        generated = (
+            ('dashboard-%d' % (i,), i + 1) for i in range(self._count)
+        )
+        merged = dict(generated)
+        merged.update(saved)
+        return [slug for slug, _ in sorted(merged.items(),
+                                           key=lambda item: item[1])]
+
+    def handle(self, method, path, body):
+        """Dispatch a request, return ``(status, document, headers)``."""
+        url = urlsplit(path)
+        query = dict(
+            (key, values[-1]) for key, values in parse_qs(url.query).items()
+        )
+        if self._latency:
+            time.sleep(self._latency)
+        for route_method, pattern, func in self._routes:
+            match = pattern.match(url.path)
+            if route_method != method or match is None:
+                continue
+            self.requests[method, pattern.pattern] += 1
+            with self._lock:
+                failed = self._random.random() < self._error_rate
+            try:
+                if failed:
+                    raise GrafanaError(503, 'Service unavailable',
+                                       {'Retry-After': '0'})
+                if method in ('POST', 'PUT'):
+                    return 200, func(body, *match.groups()), {}
+                return 200, func(query, *match.groups()), {}
+            except GrafanaError as error:
+                return error.status, {'message': error.message}, \
+                    error.headers
+        return 404, {'message': 'Not found'}, {}
+
+    def health(self, query):
+        return {'database': 'ok', 'version': '5.0.0'}
+
+    def admin_stats(self, query):
+        return {
+            'dashboards': len(self.slugs()),
+            'datasources': len(self._datasources),
+            'users': 1,
+            'orgs': 1,
+        }
+
+    def search(self, query):
+        slugs = self.slugs()
+        limit = int(query.get('limit', 1000))
+        page = int(query.get('page', 1))
+        hits = []
+        for slug in slugs[(page - 1) * limit:page * limit]:
+            dashboard = self.dashboard(slug)
+            hit = {
+                'id': dashboard['id'],
+                'title': dashboard['title'],
+                'uri': 'db/%s' % (slug,),
+                'type': 'dash-db',
+                'tags': dashboard.get('tags', []),
+                'isStarred': False,
+            }
+            if self.listing_versions:
+                hit['version'] = dashboard['version']
+            hits.append(hit)
+        return hits
+
+    def get_dashboard(self, query, slug):
+        dashboard = self.dashboard(slug)
+        if dashboard is None:
+            raise GrafanaError(404, 'Dashboard not found')
+        return dashboard_document(dashboard)
+
+    def dashboard_versions(self, query, dashboard_id):
+        for slug in self.slugs():
+            dashboard = self.dashboard(slug)
+            if dashboard['id'] == int(dashboard_id):
+                return [{'version': dashboard['version']}]
+        raise GrafanaError(404, 'Dashboard not found')
+
+    def save_dashboard(self, document):
+        dashboard = dict(document['dashboard'])
+        slug = slugify(dashboard['title'])
+        existing = self.dashboard(slug)
+        with self._lock:
+            if existing is None:
+                dashboard['id'] = self._next_id
+                dashboard['version'] = 1
+                self._next_id += 1
+            else:
+                if dashboard.get('id') != existing['id'] and \
+                   not document.get('overwrite'):
+                    raise GrafanaError(
+                        412, 'A dashboard with the same name already exists',
+                    )
+                if dashboard.get('version') != existing['version'] and \
+                   not document.get('overwrite'):
+                    raise GrafanaError(
+                        412, 'The dashboard has been changed by someone else',
+                    )
+                dashboard['id'] = existing['id']
+                dashboard['version'] = existing['version'] + 1
+            self._saved[slug] = dashboard
+        return {
+            'id': dashboard['id'],
+            'slug': slug,
+            'status': 'success',
+            'version': dashboard['version'],
+        }
+
+    def _datasource(self, document, source_id):
+        # Like Grafana, don't store the request's flags.
+        document = dict(document)
+        document.pop('overwrite', None)
+        return dict(document, id=source_id, orgId=1,
+                    typeLogoUrl='public/app/plugins/datasource/%s/img/logo.svg'
+                                % (document.get('type'),))
+
+    def list_datasources(self, query):
+        with self._lock:
+            return list(self._datasources.values())
+
+    def create_datasource(self, document):
+        with self._lock:
+            if document['name'] in self._datasources:
+                raise GrafanaError(409, 'Data source with same name already '
+                                        'exists')
+            source = self._datasource(document, len(self._datasources) + 1)
+            self._datasources[source['name']] = source
+        return {'id': source['id'], 'name': source['name'],
+                'message': 'Datasource added'}
+
+    def update_datasource(self, document, source_id):
+        with self._lock:
+            for name, source in list(self._datasources.items()):
+                if source['id'] == int(source_id):
+                    del self._datasources[name]
+                    source = self._datasource(document, source['id'])
+                    self._datasources[source['name']] = source
+                    return {'message': 'Datasource updated'}
+        raise GrafanaError(404, 'Data source not found')
+
+
+@contextmanager
+def run_fake_grafana(grafana):
+    """Serve a :py:class:`FakeGrafana` for the duration of a code block."""
+
+    class HTTPRequestHandler(BaseHTTPRequestHandler):
+        """Web server that fakes Grafana."""
+
+        protocol_version = 'HTTP/1.1'
+
+        # Headers and body are written separately: don't let Nagle's
+        # algorithm hold the body back waiting for delayed ACKs.
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _read_chunked(self):
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+
+        def _body(self):
+            if self.headers.get('Transfer-Encoding') == 'chunked':
+                grafana.encodings['chunked'] += 1
+                data = self._read_chunked()
+            else:
+                size = int(self.headers.get('Content-Length', 0))
+                if not size:
+                    return None
+                data = self.rfile.read(size)
+            encoding = self.headers.get('Content-Encoding', 'identity')
+            grafana.encodings[encoding] += 1
+            if encoding == 'gzip' and grafana.gzip_requests:
+                data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+            return json.loads(data.decode('utf-8'))
+
+        def _do(self):
+            try:
+                body = self._body()
+            except ValueError:
+                status, document, headers = \
+                    400, {'message': 'bad request data'}, {}
+            else:
+                status, document, headers = grafana.handle(
+                    self.command, self.path, body,
+                )
+            data = json.dumps(document).encode('utf-8')
+            if grafana.gzip and \
+               'gzip' in self.headers.get('Accept-Encoding', ''):
+                compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                              16 + zlib.MAX_WBITS)
+                data = compressor.compress(data) + compressor.flush()
+                headers = dict(headers, **{'Content-Encoding': 'gzip'})
+            if grafana.etags and self.command == 'GET' and status == 200:
+                etag = '"%s"' % (hashlib.sha1(data).hexdigest(),)
+                headers = dict(headers, ETag=etag)
+                if self.headers.get('If-None-Match') == etag:
+                    status, data = 304, b''
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', len(data))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = _do
+        do_POST = _do
+        do_PUT = _do
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), HTTPRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:%d' % (server.server_port,)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import os
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+import asyncio  # noqa: E402
+import itertools  # noqa: E402
+import mock  # noqa: E402
+
+from conftest import HTTPResponseError  # noqa: E402
+from dashex import aio  # noqa: E402
+
+
+def run(coro):
+    """Run a coroutine to completion in a fresh event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_aio_pull(make_http_service, fs_sandbox):
+    """Pull writes the same files as the synchronous version."""
+
+    routes = {
+        'GET': {
+            '/api/datasources': lambda: [{
+                'id': 1,
+                'orgId': 1,
+                'typeLogoUrl': '...',
+                'name': 'redis',
+            }],
+            '/api/search': lambda: [
+                {'type': 'dash-db', 'uri': 'db/foo'},
+                {'type': 'dash-folder', 'uri': 'db/bar'},
+            ],
+            '/api/dashboards/db/foo': lambda: {
+                'dashboard': {'id': 1, 'title': 'Foo'},
+                'meta': {'slug': 'foo'},
+            },
+        },
+    }
+
+    with make_http_service(routes) as url:
+        run(aio.grafana_pull(url, 'admin', 'admin', '.', jobs=4))
+
+    with open('grafana/datasources/redis.json', 'rb') as stream:
+        assert json.loads(stream.read().decode('utf-8')) == {'name': 'redis'}
+    with open('grafana/dashboards/foo.json', 'rb') as stream:
+        assert json.loads(stream.read().decode('utf-8')) == {
+            'dashboard': {'title': 'Foo'},
+            'meta': {'slug': 'foo'},
+        }
+    assert not os.path.exists('grafana/dashboards/bar.json')
+
+
+def test_aio_push(make_http_service, fs_sandbox):
+    """Push creates or updates objects and skips version conflicts."""
+
+    uploads = []
+
+    def upload(document):
+        uploads.append(document)
+        if document.get('dashboard', {}).get('title') == 'Stale':
+            raise HTTPResponseError(412, {'message': 'version-mismatch'})
+        return {'id': 5}
+
+    routes = {
+        'GET': {
+            '/api/admin/stats': lambda: {},
+            '/api/datasources': lambda: [{'id': 3, 'name': 'mysql'}],
+            '/api/search': lambda: [{'id': 9, 'uri': 'db/stale'}],
+        },
+        'POST': {
+            '/api/datasources': upload,
+            '/api/dashboards/db': upload,
+        },
+        'PUT': {
+            '/api/datasources/3': upload,
+        },
+    }
+
+    os.makedirs('grafana/datasources')
+    os.makedirs('grafana/dashboards')
+    for name in ('mysql', 'redis'):
+        with open('grafana/datasources/%s.json' % (name,), 'w') as stream:
+            json.dump({'name': name}, stream)
+    for title in ('Fresh', 'Stale'):
+        path = 'grafana/dashboards/%s.json' % (title.lower(),)
+        with open(path, 'w') as stream:
+            json.dump({
+                'dashboard': {'title': title, 'datasource': 'redis'},
+                'meta': {'slug': title.lower()},
+            }, stream)
+
+    with make_http_service(routes) as url:
+        run(aio.grafana_push(url, 'admin', 'admin', '.', jobs=4))
+
+    assert len(uploads) == 4
+    assert {'name': 'mysql', 'id': 3, 'overwrite': False} in uploads
+    assert uploads.index({'name': 'redis'}) < 2
+    assert {
+        'dashboard': {'title': 'Stale', 'datasource': 'redis', 'id': 9},
+    } in uploads
+
+
+def test_aio_push_failure(make_http_service, fs_sandbox):
+    """Unexpected errors are forwarded."""
+
+    def upload(document):
+        raise HTTPResponseError(503, {'message': 'unavailable'})
+
+    routes = {
+        'GET': {
+            '/api/admin/stats': lambda: {},
+            '/api/datasources': lambda: [],
+            '/api/search': lambda: [],
+        },
+        'POST': {
+            '/api/dashboards/db': upload,
+        },
+    }
+
+    os.makedirs('grafana/dashboards')
+    with open('grafana/dashboards/foo.json', 'w') as stream:
+        json.dump({'dashboard': {'title': 'Foo'}, 'meta': {'slug': 'foo'}},
+                  stream)
+
+    with make_http_service(routes) as url:
+        with pytest.raises(aio.HTTPError) as exc:
+            run(aio.grafana_push(url, 'admin', 'admin', '.'))
+    assert exc.value.status == 503
+
+
+def test_aio_wait_timeout():
+    """Do not wait indefinitely (in unsupervised execution context)."""
+
+    mock_clock = mock.MagicMock()
+    mock_clock.side_effect = itertools.count(0.0, 0.25)
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    with mock.patch('asyncio.sleep', sleep):
+        with pytest.raises(Exception) as exc:
+            run(aio.grafana_wait('http://127.0.0.1:1', 'admin', 'admin',
+                                 timeout=2.5, clock=mock_clock))
+    assert str(exc.value) == 'Grafana is unresponsive at this time.'
+    assert delays[:2] == [0.025, 0.05]
+
+
+def test_aio_wait_gateway_errors(make_http_service):
+    """Gateway errors mean Grafana is still starting."""
+
+    failures = [HTTPResponseError(502, {})]
+
+    def health():
+        if failures:
+            raise failures.pop(0)
+        return {'database': 'ok'}
+
+    routes = {
+        'GET': {
+            '/api/health': health,
+        },
+    }
+
+    with make_http_service(routes) as url:
+        run(aio.grafana_wait(url, 'admin', 'admin', timeout=5.0))
+    assert failures == []
+
+
+def test_aio_client_without_password(make_http_service):
+    """A username without a password is accepted, like the sync client."""
+
+    routes = {
+        'GET': {
+            '/api/search': lambda: [],
+        },
+    }
+
+    async def search(url):
+        async with aio.AsyncClient(url, credentials=('admin', None)) as c:
+            return await c.get_json('api/search')
+
+    with make_http_service(routes) as url:
+        assert run(search(url)) == []
+
+
+def test_aio_search_all():
+    """Search results are fetched page by page."""
+
+    pages = {
+        1: [{'id': 1}, {'id': 2}],
+        2: [{'id': 3}],
+    }
+
+    class Client(object):
+        async def get_json(self, path):
+            return pages[int(path[-1])]
+
+    assert run(aio.search_all(Client(), limit=2)) == [
+        {'id': 1}, {'id': 2}, {'id': 3},
+    ]
+
+
+def test_aio_client_retries(make_http_service):
+    """Transient failures are retried and requests are throttled."""
+
+    failures = [HTTPResponseError(429, {}, headers={'Retry-After': '1'})]
+    delays = []
+
+    def search():
+        if failures:
+            raise failures.pop(0)
+        return []
+
+    routes = {
+        'GET': {
+            '/api/search': search,
+        },
+    }
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    async def fetch(url):
+        client = aio.AsyncClient(
+            url,
+            retry=aio.RetryPolicy(retries=1),
+            limiter=aio.RateLimiter(rate=2.0, concurrency=1,
+                                    clock=lambda: 0.0),
+        )
+        async with client:
+            return await client.get_json('api/search')
+
+    with make_http_service(routes) as url:
+        with mock.patch('asyncio.sleep', sleep):
+            assert run(fetch(url)) == []
+    assert delays == [1.0, 0.5]
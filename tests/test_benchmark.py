@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Pull and push throughput and memory against a fake Grafana instance.
+
+Only the smallest size runs by default; pass ``--benchmark`` to pytest to
+run every size.  Results are printed after the tests.
+"""
+
+
+import pytest
+import timeit
+
+from dashex import grafana_pull, grafana_push
+
+from fakegrafana import FakeGrafana, run_fake_grafana
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    # py2
+    tracemalloc = None
+
+
+SIZES = [10, 1000, 10000]
+"""Number of dashboards on the instance."""
+
+JOBS = 8
+"""Number of concurrent requests."""
+
+
+@pytest.fixture(params=SIZES)
+def size(request):
+    if request.param > SIZES[0] and \
+       not request.config.getoption('--benchmark'):
+        pytest.skip('pass --benchmark to run every size')
+    return request.param
+
+
+def elapsed(func, *args, **kwds):
+    """Run ``func``, return elapsed seconds."""
+    start = timeit.default_timer()
+    func(*args, **kwds)
+    return timeit.default_timer() - start
+
+
+def peak_memory(func, *args, **kwds):
+    """Run ``func``, return the peak of memory allocated by Python.
+
+    This covers everything allocated while ``func`` runs, including the
+    fake instance's request handlers.  Tracing slows Python down a lot, so
+    runs are timed separately (see :py:func:`elapsed`).  Returns ``None``
+    when ``tracemalloc`` isn't available.
+    """
+    if tracemalloc is None:  # pragma: no cover
+        func(*args, **kwds)
+        return None
+    tracemalloc.start()
+    try:
+        func(*args, **kwds)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_benchmark_pull_push(size, tmpdir, benchmark):
+    """Pull a whole instance, then push it to empty ones."""
+
+    paths = [str(tmpdir.join('timed')), str(tmpdir.join('traced'))]
+    source = FakeGrafana(dashboards=size, datasources=5, panels=10)
+    with run_fake_grafana(source) as url:
+        seconds = elapsed(grafana_pull, url, 'admin', 'admin', paths[0],
+                          jobs=JOBS)
+        peak = peak_memory(grafana_pull, url, 'admin', 'admin', paths[1],
+                           jobs=JOBS)
+    benchmark('pull', size + 5, seconds, peak)
+
+    targets = [FakeGrafana(dashboards=0, datasources=0) for _ in paths]
+    with run_fake_grafana(targets[0]) as url:
+        seconds = elapsed(grafana_push, url, 'admin', 'admin', paths[0],
+                          jobs=JOBS)
+    with run_fake_grafana(targets[1]) as url:
+        peak = peak_memory(grafana_push, url, 'admin', 'admin', paths[1],
+                           jobs=JOBS)
+    benchmark('push', size + 5, seconds, peak)
+
+    for target in targets:
+        assert len(target.slugs()) == size
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import os
+import pytest
+import zipfile
+
+from dashex import grafana_pull
+from dashex._bundle import INDEX, BundleReader, BundleWriter
+from dashex.__main__ import main
+
+from test_grafana import make_grafana_routes, snapshot
+
+
+def test_bundle_round_trip(tmpdir):
+    """Documents are read back from the bundle one member at a time."""
+
+    path = str(tmpdir.join('grafana.zip'))
+    with BundleWriter(path) as writer:
+        writer.add_datasource('redis', b'{"name": "redis"}\n',
+                              {'name': 'redis', 'isDefault': True})
+        writer.add_dashboard('foo', b'{"meta": {"slug": "foo"}}\n',
+                             set(['redis', None]))
+        assert not os.path.exists(path)
+    assert os.listdir(str(tmpdir)) == ['grafana.zip']
+
+    with BundleReader(path) as reader:
+        assert list(reader.datasources()) == [
+            ('grafana/datasources/redis.json', 'redis', True),
+        ]
+        assert list(reader.dashboards()) == [
+            ('grafana/dashboards/foo.json', 'foo', [None, 'redis']),
+        ]
+        assert reader.load('grafana/dashboards/foo.json') == {
+            'meta': {'slug': 'foo'},
+        }
+
+
+def test_bundle_abort(tmpdir):
+    """Failures don't leave a partial bundle behind."""
+
+    path = str(tmpdir.join('grafana.zip'))
+    with pytest.raises(ValueError):
+        with BundleWriter(path) as writer:
+            writer.add_datasource('redis', b'{}\n', {})
+            raise ValueError()
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_pull_bundle(make_http_service, tmpdir):
+    """Bundles hold exactly the same files as the directory layout."""
+
+    routes = make_grafana_routes(5)
+    path = str(tmpdir.join('grafana.zip'))
+
+    with make_http_service(routes) as url:
+        main(['grafana-pull',
+              '-i', url,
+              '-u', 'admin',
+              '-p', 'admin',
+              '-o', str(tmpdir.join('folder'))])
+        main(['grafana-pull',
+              '-i', url,
+              '-u', 'admin',
+              '-p', 'admin',
+              '--bundle', path,
+              '--jobs', '4'])
+
+    folder = {
+        os.path.relpath(name, str(tmpdir.join('folder'))): data
+        for name, data in snapshot(str(tmpdir.join('folder'))).items()
+    }
+    with zipfile.ZipFile(path) as archive:
+        assert archive.testzip() is None
+        members = {
+            name: archive.read(name).decode('utf-8')
+            for name in archive.namelist() if name != INDEX
+        }
+        index = json.loads(archive.read(INDEX).decode('utf-8'))
+    assert members == folder
+    assert len(index) == 6
+
+
+def test_pull_bundle_not_incremental(tmpdir):
+    """Bundles are always written from scratch."""
+
+    with pytest.raises(ValueError):
+        grafana_pull('http://grafana.example.org', 'admin', 'admin', '.',
+                     incremental=True, bundle=str(tmpdir.join('grafana.zip')))
+
+
+def test_push_bundle(make_http_service, tmpdir):
+    """Push reads documents from the bundle, data sources first."""
+
+    events = []
+
+    routes = make_grafana_routes(3)
+    routes['GET']['/api/admin/stats'] = lambda: {}
+    routes['POST'] = {
+        '/api/datasources': lambda document: {'id': 1},
+        '/api/dashboards/db': lambda document: events.append(
+            document['dashboard']['title']
+        ) or {},
+    }
+    routes['PUT'] = {
+        '/api/datasources/1': lambda document: events.append(
+            document['name']
+        ) or {},
+    }
+    path = str(tmpdir.join('grafana.zip'))
+
+    with make_http_service(routes) as url:
+        main(['grafana-pull',
+              '-i', url,
+              '-u', 'admin',
+              '-p', 'admin',
+              '--bundle', path])
+        main(['grafana-push',
+              '-i', url,
+              '-u', 'admin',
+              '-p', 'admin',
+              '-o', str(tmpdir.join('missing')),
+              '--bundle', path])
+
+    assert events == ['redis'] + ['Dashboard %d' % (i,) for i in range(3)]
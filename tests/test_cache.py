@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+
+import mock
+import os
+import pytest
+import requests.exceptions
+
+from dashex import default_cache_path, grafana_pull, grafana_push
+from dashex._cache import HTTPCache
+from dashex._http import Client
+from dashex._metrics import Metrics
+from dashex.__main__ import main
+
+from fakegrafana import FakeGrafana, run_fake_grafana
+
+
+GET_DASHBOARD = ('GET', r'^/api/dashboards/db/([^/]+)$')
+GET_SEARCH = ('GET', r'^/api/search$')
+
+
+def test_default_cache_path():
+    """The cache lives in the user's cache folder."""
+
+    with mock.patch.dict('os.environ', {'XDG_CACHE_HOME': '/tmp/cache'}):
+        assert default_cache_path() == '/tmp/cache/dashex/http'
+
+
+def test_cache_entries(tmpdir):
+    """Entries are kept per instance and endpoint, fresh for a while."""
+
+    clock = mock.MagicMock(return_value=100.0)
+    cache = HTTPCache(str(tmpdir), ttl=10.0, clock=clock)
+    assert cache.get('a', 'api/search') is None
+    cache.store('a', 'api/search', b'[1]', etag='"x"')
+    cache.store('b', 'api/search', b'[2]',
+                last_modified='Mon, 01 Jan 2018 00:00:00 GMT')
+
+    entry = cache.get('a', 'api/search')
+    assert entry.content == b'[1]'
+    assert entry.validators() == {'If-None-Match': '"x"'}
+    assert cache.get('b', 'api/search').validators() == {
+        'If-Modified-Since': 'Mon, 01 Jan 2018 00:00:00 GMT',
+    }
+    assert cache.get('a', 'api/datasources') is None
+    assert cache.fresh(entry)
+    clock.return_value = 110.0
+    assert not cache.fresh(entry)
+    assert cache.fresh(cache.refresh('a', 'api/search', entry))
+
+    cache.invalidate('a')
+    assert cache.get('a', 'api/search') is None
+    assert cache.get('b', 'api/search').content == b'[2]'
+
+    # Damaged entries are ignored.
+    for folder, _, names in os.walk(str(tmpdir)):
+        for name in names:
+            with open(os.path.join(folder, name), 'wb') as stream:
+                stream.write(b'{')
+    assert cache.get('b', 'api/search') is None
+
+
+def test_cache_eviction(tmpdir):
+    """The least recently used entries are evicted beyond the size limit."""
+
+    def path(i):
+        return 'api/dashboards/db/%d' % (i,)
+
+    content = b'x' * 200
+    probe = HTTPCache(str(tmpdir.join('probe')), clock=lambda: 0.0)
+    probe.store('a', path(0), content)
+    size = probe.size()
+
+    cache = HTTPCache(str(tmpdir.join('cache')), max_size=int(3.5 * size),
+                      clock=lambda: 0.0)
+    for i in range(3):
+        cache.store('a', path(i), content)
+        os.utime(cache._file('a', path(i)), (i, i))
+    assert cache.size() == 3 * size
+
+    # Reading an entry protects it from eviction.
+    assert cache.get('a', path(0)) is not None
+    cache.store('a', path(3), content)
+    assert cache.size() == 3 * size
+    assert cache.get('a', path(1)) is None
+    for i in (0, 2, 3):
+        assert cache.get('a', path(i)) is not None
+
+    # The size is recovered from disk by new instances.
+    assert HTTPCache(cache.path).size() == 3 * size
+
+
+def test_client_cache(tmpdir):
+    """Fresh responses are reused, stale ones are revalidated."""
+
+    clock = mock.MagicMock(return_value=0.0)
+    grafana = FakeGrafana(dashboards=2, etags=True)
+    metrics = Metrics()
+    cache = HTTPCache(str(tmpdir), ttl=30.0, clock=clock)
+    with run_fake_grafana(grafana) as url:
+        with Client(url, credentials=('admin', 'admin'), metrics=metrics,
+                    cache=cache) as client:
+            path = 'api/dashboards/db/dashboard-0'
+            document = client.get_json(path)
+            assert client.get_json(path) == document
+            assert grafana.requests[GET_DASHBOARD] == 1
+
+            clock.return_value = 60.0
+            assert client.get_json(path) == document
+            assert grafana.requests[GET_DASHBOARD] == 2
+            assert client.get_json(path) == document
+            assert grafana.requests[GET_DASHBOARD] == 2
+
+            # Errors aren't cached.
+            with pytest.raises(requests.exceptions.HTTPError):
+                client.get_json('api/dashboards/db/nope')
+            with pytest.raises(requests.exceptions.HTTPError):
+                client.get_json('api/dashboards/db/nope')
+
+            # Changing the instance drops its cached responses.
+            client.post_json('api/dashboards/db', data={
+                'dashboard': dict(document['dashboard'], title='Dashboard 0',
+                                  panels=[]),
+            })
+            assert client.get_json(path)['dashboard']['panels'] == []
+
+        # Other users have their own cache.
+        with Client(url, credentials=('viewer', 'viewer'),
+                    cache=cache) as client:
+            client.get_json(path)
+            assert grafana.requests[GET_DASHBOARD] == 6
+
+    assert metrics.report()['counters'] == {
+        'bytes_received': mock.ANY,
+        'bytes_sent': mock.ANY,
+        'cache_hits': 2,
+        'cache_misses': 4,
+        'cache_revalidated': 1,
+    }
+
+
+def test_client_cache_without_validators(tmpdir):
+    """Stale responses without validators are downloaded again."""
+
+    clock = mock.MagicMock(return_value=0.0)
+    grafana = FakeGrafana(dashboards=1)
+    cache = HTTPCache(str(tmpdir), ttl=30.0, clock=clock)
+    with run_fake_grafana(grafana) as url:
+        with Client(url, cache=cache) as client:
+            with mock.patch.object(client.session, 'get',
+                                   wraps=client.session.get) as get:
+                client.get_json('api/search')
+                clock.return_value = 60.0
+                client.get_json('api/search')
+    assert grafana.requests[GET_SEARCH] == 2
+    assert get.call_args_list == [
+        mock.call(url + '/api/search', timeout=mock.ANY),
+        mock.call(url + '/api/search', timeout=mock.ANY, headers={}),
+    ]
+
+
+def test_pull_and_push_from_cache(tmpdir):
+    """Repeated runs mostly reuse cached listings and dashboards."""
+
+    grafana = FakeGrafana(dashboards=5, datasources=2)
+    output_path = str(tmpdir.join('output'))
+    cache_path = str(tmpdir.join('cache'))
+    with run_fake_grafana(grafana) as url:
+        for _ in range(2):
+            grafana_pull(url, 'admin', 'admin', output_path, cache=True,
+                         cache_path=cache_path)
+        assert grafana.requests[GET_DASHBOARD] == 5
+        assert grafana.requests[GET_SEARCH] == 1
+
+        for _ in range(2):
+            summary = grafana_push(url, 'admin', 'admin', output_path,
+                                   skip_unchanged=True, cache=True,
+                                   cache_path=cache_path)
+            assert summary['uploaded'] == 0
+        assert grafana.requests[GET_DASHBOARD] == 5
+        assert grafana.requests[GET_SEARCH] == 1
+
+        # Uploads invalidate the cache.
+        grafana_push(url, 'admin', 'admin', output_path, cache=True,
+                     cache_path=cache_path)
+        grafana_pull(url, 'admin', 'admin', output_path, cache=True,
+                     cache_path=cache_path)
+        assert grafana.requests[GET_DASHBOARD] == 10
+
+
+def test_cli_cache(tmpdir, cache_home):
+    """The CLI caches responses, unless told not to."""
+
+    grafana = FakeGrafana(dashboards=2)
+    with run_fake_grafana(grafana) as url:
+        for _ in range(2):
+            main(['grafana-pull', '-i', url, '-o', str(tmpdir)])
+        assert grafana.requests[GET_DASHBOARD] == 2
+        assert os.listdir(os.path.join(cache_home, 'dashex', 'http'))
+
+        main(['grafana-pull', '-i', url, '-o', str(tmpdir), '--no-cache'])
+        assert grafana.requests[GET_DASHBOARD] == 4
+
+        cache_path = str(tmpdir.join('cache'))
+        main(['grafana-pull', '-i', url, '-o', str(tmpdir),
+              '--cache-dir', cache_path, '--cache-ttl', '0'])
+        main(['grafana-pull', '-i', url, '-o', str(tmpdir),
+              '--cache-dir', cache_path, '--cache-ttl', '0'])
+        assert grafana.requests[GET_DASHBOARD] == 8
+        assert os.listdir(cache_path)
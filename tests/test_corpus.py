@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+
+from dashex import datasource_refs, grafana_pull, push_plan
+from dashex._corpus import Corpus, slugify
+from dashex.__main__ import main
+
+from fakegrafana import FakeGrafana, run_fake_grafana
+from test_grafana import loadjson, snapshot
+
+
+def test_slugify():
+    assert slugify(' Hello, World! ') == 'hello-world'
+    assert slugify('Dashboard 12') == 'dashboard-12'
+
+
+def test_corpus_is_deterministic():
+    """The same seed always generates the same objects, in any order."""
+
+    corpus = Corpus(dashboards=3, datasources=4, panels=10, variables=3,
+                    seed=7)
+    assert corpus.dashboard(2) == Corpus(seed=7, datasources=4, panels=10,
+                                         variables=3).dashboard(2)
+    assert corpus.dashboard(2) != Corpus(seed=8, datasources=4, panels=10,
+                                         variables=3).dashboard(2)
+    assert corpus.dashboard(1) != corpus.dashboard(2)
+
+    document = corpus.document(1)
+    assert document['meta']['slug'] == 'dashboard-1'
+    assert len(document['dashboard']['panels']) == 10
+    assert len(document['dashboard']['templating']['list']) == 3
+    names = set(corpus.datasource(i)['name'] for i in range(4))
+    assert datasource_refs(document) - names <= {None}
+
+    # Without data sources, dashboards use the default one.
+    assert datasource_refs(Corpus(datasources=0).document(0)) == {None}
+
+
+def test_corpus_matches_pull(tmpdir):
+    """Written corpora are identical to pulls of the same objects."""
+
+    corpus = Corpus(dashboards=5, datasources=3, panels=5, seed=3)
+    size = corpus.write(str(tmpdir.join('written')))
+    with run_fake_grafana(FakeGrafana(corpus=corpus)) as url:
+        grafana_pull(url, 'admin', 'admin', str(tmpdir.join('pulled')))
+
+    written = snapshot(str(tmpdir.join('written')))
+    pulled = snapshot(str(tmpdir.join('pulled')))
+    assert len(written) == 8
+    assert sorted(written.values()) == sorted(pulled.values())
+    assert size == sum(len(data.encode('utf-8')) for data in written.values())
+    assert len(push_plan(str(tmpdir.join('written')))) == 8
+
+
+def test_generate_corpus_cli(tmpdir):
+    """Corpora are generated from the command line, in parallel."""
+
+    def generate(name, jobs):
+        main(['dev-corpus', '-o', str(tmpdir.join(name)),
+              '--dashboards', '20', '--datasources', '2',
+              '--panels', '3', '--variables', '2', '--seed', '1',
+              '-j', str(jobs)])
+        return snapshot(str(tmpdir.join(name)))
+
+    serial = generate('serial', 1)
+    parallel = generate('parallel', 2)
+    assert len(serial) == 22
+    assert sorted(serial.values()) == sorted(parallel.values())
+    dashboard = loadjson(str(tmpdir.join(
+        'serial', 'grafana', 'dashboards', 'dashboard-19.json',
+    )))
+    assert 'id' not in dashboard['dashboard']
+    assert len(dashboard['dashboard']['panels']) == 3
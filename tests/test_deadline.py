@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+
+import mock
+import os
+import pytest
+import requests.exceptions
+import time
+
+from dashex import DeadlineExceeded, grafana_pull, grafana_push
+from dashex._deadline import Deadline, bounded_timeout
+from dashex._http import Client
+from dashex._throttle import RetryPolicy
+from dashex.__main__ import main
+
+from test_grafana import make_grafana_routes, savejson
+
+
+def test_deadline():
+    """Deadlines bound delays and timeouts."""
+
+    clock = mock.MagicMock(return_value=10.0)
+    deadline = Deadline(5.0, clock=clock)
+    clock.return_value = 12.0
+    assert deadline.remaining() == 3.0
+    assert not deadline.expired()
+    assert deadline.bound(1.0) == 1.0
+    assert deadline.bound(4.0) == 3.0
+    assert deadline.bound(None) == 3.0
+    assert bounded_timeout((1.0, 30.0), deadline) == (1.0, 3.0)
+    assert bounded_timeout(2.0, deadline) == (2.0, 2.0)
+    assert bounded_timeout(None, deadline) == 3.0
+    deadline.check()
+    clock.return_value = 15.0
+    assert deadline.remaining() == 0.0
+    assert deadline.expired()
+    with pytest.raises(DeadlineExceeded):
+        deadline.check()
+
+
+def test_no_deadline():
+    """Without a deadline, nothing is bounded."""
+
+    deadline = Deadline(None)
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    assert deadline.bound(4.0) == 4.0
+    assert bounded_timeout((1.0, 30.0), deadline) == (1.0, 30.0)
+    assert bounded_timeout(None, deadline) is None
+
+
+def test_client_timeouts():
+    """Every request gets a timeout, bounded by the deadline."""
+
+    clock = mock.MagicMock(return_value=0.0)
+    client = Client('http://grafana.example.org', timeout=(2.0, 10.0),
+                    deadline=Deadline(4.0, clock=clock))
+    with mock.patch('requests.Session.get') as get:
+        client.get('api/search')
+        clock.return_value = 3.0
+        client.get('api/search')
+        client.get('api/health', timeout=(0.5, 0.5))
+        clock.return_value = 4.0
+        with pytest.raises(DeadlineExceeded):
+            client.get('api/search')
+    assert get.call_args_list == [
+        mock.call('http://grafana.example.org/api/search',
+                  timeout=(2.0, 4.0)),
+        mock.call('http://grafana.example.org/api/search',
+                  timeout=(1.0, 1.0)),
+        mock.call('http://grafana.example.org/api/health',
+                  timeout=(0.5, 0.5)),
+    ]
+
+
+def test_client_retries_within_deadline():
+    """Retries that would overrun the deadline are abandoned."""
+
+    clock = mock.MagicMock(return_value=0.0)
+    sleep = mock.MagicMock()
+    client = Client('http://grafana.example.org',
+                    retry=RetryPolicy(retries=5, random=lambda: 1.0),
+                    deadline=Deadline(0.25, clock=clock), sleep=sleep)
+    with mock.patch('requests.Session.get') as get:
+        get.side_effect = requests.exceptions.ReadTimeout()
+        with pytest.raises(DeadlineExceeded):
+            client.get('api/search')
+    assert sleep.mock_calls == [mock.call(0.1), mock.call(0.2)]
+    assert get.call_count == 3
+
+
+def slow_routes(count, delay):
+    """Mock Grafana instance that takes ``delay`` seconds per dashboard."""
+
+    routes = make_grafana_routes(count)
+    for path, route in list(routes['GET'].items()):
+        if path.startswith('/api/dashboards/db/'):
+            def slow(route=route):
+                time.sleep(delay)
+                return route()
+            routes['GET'][path] = slow
+    return routes
+
+
+def test_pull_deadline(make_http_service, tmpdir):
+    """Pulls stop at the deadline and report what they completed."""
+
+    routes = slow_routes(20, 0.1)
+
+    with make_http_service(routes) as url:
+        with pytest.raises(DeadlineExceeded) as exc:
+            grafana_pull(url, 'admin', 'admin', str(tmpdir), deadline=0.35)
+        summary = exc.value.summary
+        assert 1 <= summary['written'] < 21
+        assert summary['deleted'] == 0
+        assert len(os.listdir(str(tmpdir.join('grafana', 'dashboards')))) \
+            == summary['written'] - 1
+
+        assert main(['grafana-pull',
+                     '-i', url,
+                     '-o', str(tmpdir),
+                     '--deadline', '0.35']) == 1
+
+
+def test_push_deadline(make_http_service, fs_sandbox):
+    """Pushes stop at the deadline and report what wasn't pushed."""
+
+    def create_dashboard(document):
+        time.sleep(0.1)
+        return {}
+
+    routes = {
+        'GET': {
+            '/api/health': lambda: {},
+            '/api/datasources': lambda: [],
+            '/api/search': lambda: [],
+        },
+        'POST': {
+            '/api/dashboards/db': create_dashboard,
+        },
+    }
+    os.makedirs('grafana/dashboards')
+    for i in range(10):
+        savejson('grafana/dashboards/dashboard-%d.json' % (i,), {
+            'dashboard': {'title': 'Dashboard %d' % (i,)},
+            'meta': {'slug': 'dashboard-%d' % (i,)},
+        })
+
+    with make_http_service(routes) as url:
+        with pytest.raises(DeadlineExceeded) as exc:
+            grafana_push(url, 'admin', 'admin', '.', jobs=2, deadline=0.35)
+
+    summary = exc.value.summary
+    assert 1 <= summary['uploaded'] < 10
+    assert summary['uploaded'] + summary['pending'] == 10
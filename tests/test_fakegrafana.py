@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+
+import requests
+import time
+
+from dashex import grafana_pull, grafana_push, iter_search
+from dashex._http import Client
+from dashex._throttle import RetryPolicy
+
+from fakegrafana import FakeGrafana, run_fake_grafana
+
+
+def test_fake_grafana_api():
+    """The fake instance implements the endpoints dashex uses."""
+
+    grafana = FakeGrafana(dashboards=3, datasources=2)
+    with run_fake_grafana(grafana) as url:
+        with Client(url) as client:
+            assert client.get_json('api/health')['database'] == 'ok'
+            assert client.get_json('api/admin/stats')['dashboards'] == 3
+            assert [hit['uri'] for hit in iter_search(client, limit=2)] == [
+                'db/dashboard-0', 'db/dashboard-1', 'db/dashboard-2',
+            ]
+            document = client.get_json('api/dashboards/db/dashboard-1')
+            assert document['dashboard']['title'] == 'Dashboard 1'
+            assert document['meta']['slug'] == 'dashboard-1'
+            assert client.get('api/dashboards/db/nope').status_code == 404
+            assert client.get('api/nope').status_code == 404
+
+            # Creating, updating and conflicting dashboards.
+            rep = client.post_json('api/dashboards/db', data={
+                'dashboard': {'id': None, 'title': 'New One'},
+            })
+            assert rep == {'id': 4, 'slug': 'new-one', 'status': 'success',
+                           'version': 1}
+            rep = client.post_json('api/dashboards/db', data={
+                'dashboard': dict(document['dashboard'], panels=[]),
+            })
+            assert rep['version'] == 2
+            for dashboard in (
+                dict(document['dashboard'], id=None),
+                document['dashboard'],
+            ):
+                rep = client.request('POST', 'api/dashboards/db',
+                                     json={'dashboard': dashboard})
+                assert rep.status_code == 412
+            rep = client.post_json('api/dashboards/db', data={
+                'dashboard': document['dashboard'],
+                'overwrite': True,
+            })
+            assert rep['version'] == 3
+
+            # Creating and updating data sources.
+            assert [source['name'] for source in
+                    client.get_json('api/datasources')] == \
+                ['datasource-0', 'datasource-1']
+            rep = client.post_json('api/datasources', data={'name': 'x'})
+            assert rep['id'] == 3
+            assert client.request('POST', 'api/datasources',
+                                  json={'name': 'x'}).status_code == 409
+            client.put_json('api/datasources/3', data={'name': 'y'})
+            assert client.request('PUT', 'api/datasources/9',
+                                  json={'name': 'z'}).status_code == 404
+            assert client.get_json('api/admin/stats') == {
+                'dashboards': 4,
+                'datasources': 3,
+                'users': 1,
+                'orgs': 1,
+            }
+
+    assert grafana.requests['GET', r'^/api/search$'] == 2
+
+
+def test_fake_grafana_latency_and_errors():
+    """Latency and errors are injected, reproducibly."""
+
+    grafana = FakeGrafana(dashboards=1, latency=0.05, error_rate=0.5)
+    with run_fake_grafana(grafana) as url:
+        statuses = []
+        start = time.time()
+        for _ in range(10):
+            statuses.append(requests.get(url + '/api/health').status_code)
+        assert time.time() - start >= 0.5
+
+        # Retries get through.
+        with Client(url, retry=RetryPolicy(retries=10)) as client:
+            assert client.get_json('api/health')['database'] == 'ok'
+
+    assert 200 in statuses and 503 in statuses
+    grafana = FakeGrafana(dashboards=1, error_rate=0.5)
+    with run_fake_grafana(grafana) as url:
+        assert statuses == [
+            requests.get(url + '/api/health').status_code
+            for _ in range(10)
+        ]
+
+
+def test_fake_grafana_round_trip(tmpdir):
+    """What dashex pulls from one instance can be pushed to another."""
+
+    source = FakeGrafana(dashboards=5, datasources=2)
+    target = FakeGrafana(dashboards=0, datasources=0)
+    with run_fake_grafana(source) as url:
+        grafana_pull(url, 'admin', 'admin', str(tmpdir), jobs=2)
+    with run_fake_grafana(target) as url:
+        assert grafana_push(url, 'admin', 'admin', str(tmpdir), jobs=2) == {
+            'uploaded': 7,
+            'skipped': 0,
+            'conflicts': 0,
+        }
+    assert sorted(target.slugs()) == sorted(source.slugs())
+    assert target.dashboard('dashboard-3')['panels'] == \
+        source.dashboard('dashboard-3')['panels']
@@ -6,8 +6,18 @@ import mock
 import os.path
 import pytest
 import requests.exceptions
-
-from dashex import grafana_wait
+import threading
+import time
+
+from conftest import HTTPResponseError
+from dashex import (
+    datasource_refs,
+    grafana_pull,
+    grafana_push,
+    grafana_wait,
+    iter_search,
+    push_plan,
+)
 from dashex.__main__ import main
 
 
@@ -98,7 +108,7 @@ def test_grafana_pull(influxdb, grafana, fs_sandbox):
         assert field in document['meta']
 
 
-def test_pull_search_non_dashboard_result(make_http_service):
+def test_pull_search_non_dashboard_result(make_http_service, fs_sandbox):
     """Dashboard enum skips non-dashboard things in search results."""
 
     def list_datasources():
@@ -288,7 +298,7 @@ def test_grafana_push_failure(influxdb, grafana, fs_sandbox):
             'slug': 'mysql-command-activity',
         },
     })
-    with mock.patch('requests.post') as post:
+    with mock.patch('requests.Session.post') as post:
         post.side_effect = mock_post
         with pytest.raises(requests.exceptions.HTTPError) as exc:
             main(['grafana-push',
@@ -298,45 +308,84 @@ def test_grafana_push_failure(influxdb, grafana, fs_sandbox):
         assert exc.value is e
 
 
+class MockResponse(object):
+    """Stand-in for ``requests.Response``."""
+
+    def __init__(self, status_code=200, error=None):
+        self.status_code = status_code
+        self.error = error
+        self.content = b'{}'
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.error is not None:
+            raise self.error
+
+
 def test_grafana_wait():
     """We can wait until the service binds to its socket."""
 
-    class MockRequest(object):
-        def raise_for_status(self):
-            return
-
     with mock.patch('time.sleep') as sleep:
-        with mock.patch('requests.get') as get:
+        with mock.patch('requests.Session.get') as get:
             get.side_effect = [
                 requests.exceptions.ConnectionError(),
-                requests.exceptions.ConnectionError(),
-                MockRequest(),
+                requests.exceptions.ReadTimeout(),
+                MockResponse(502),
+                MockResponse(200),
             ]
             grafana_wait(
                 'http://grafana.example.org',
                 username='admin', password='admin',
             )
 
+    # Probes are spaced by short, growing delays.
     assert sleep.mock_calls == [
-        mock.call(1.0),
-        mock.call(1.0),
+        mock.call(0.025),
+        mock.call(0.05),
+        mock.call(0.1),
+    ]
+    assert get.mock_calls == [
+        mock.call('http://grafana.example.org/api/health',
+                  timeout=(1.0, 5.0)),
+    ] * 4
+
+
+def test_grafana_wait_legacy_endpoint():
+    """Instances without a health endpoint are probed via their stats."""
+
+    with mock.patch('time.sleep') as sleep:
+        with mock.patch('requests.Session.get') as get:
+            get.side_effect = [
+                MockResponse(404),
+                MockResponse(503),
+                MockResponse(200),
+            ]
+            grafana_wait(
+                'http://grafana.example.org',
+                username='admin', password='admin',
+                probe_timeout=(0.5, 0.5),
+            )
+
+    assert sleep.mock_calls == [mock.call(0.025)]
+    assert get.mock_calls == [
+        mock.call('http://grafana.example.org/api/health',
+                  timeout=(0.5, 0.5)),
+        mock.call('http://grafana.example.org/api/admin/stats',
+                  timeout=(0.5, 0.5)),
+        mock.call('http://grafana.example.org/api/admin/stats',
+                  timeout=(0.5, 0.5)),
     ]
-    assert get.call_count == 3
 
 
 def test_grafana_wait_unexpected_exception():
     """Unexpected exceptions are forwarded."""
 
-    e = ValueError()
-
-    class MockRequest(object):
-        def raise_for_status(self):
-            raise e
+    e = requests.exceptions.HTTPError()
 
-    with pytest.raises(ValueError) as exc:
-        with mock.patch('requests.get') as get:
+    with pytest.raises(requests.exceptions.HTTPError) as exc:
+        with mock.patch('requests.Session.get') as get:
             get.side_effect = [
-                MockRequest(),
+                MockResponse(401, e),
             ]
             grafana_wait(
                 'http://grafana.example.org',
@@ -353,29 +402,442 @@ def test_grafana_wait_timeout():
     mock_clock.side_effect = [
         0.0,  # reference time.
         0.0,  # on 1st iteration (intial condition).
-        1.0,  # on 2nd iteration.
-        2.0,  # on 3rd iteration.
-        3.0,  # on 4th iteration (denied due to timeout).
+        0.0,  # probe timeout.
+        0.0,  # probe timeout.
+        0.0,  # delay.
+        2.0,  # on 2nd iteration.
+        2.0,  # probe timeout.
+        2.0,  # probe timeout.
+        2.4,  # delay (shortened by the deadline).
+        2.5,  # on 3rd iteration (denied due to timeout).
     ]
 
     with mock.patch('time.sleep') as sleep:
-        with mock.patch('requests.get') as get:
+        with mock.patch('requests.Session.get') as get:
             get.side_effect = [
                 requests.exceptions.ConnectionError(),
                 requests.exceptions.ConnectionError(),
-                requests.exceptions.ConnectionError(),
             ]
             with pytest.raises(Exception) as exc:
                 grafana_wait(
                     'http://grafana.example.org',
                     username='admin', password='admin',
                     timeout=2.5, clock=mock_clock,
+                    backoff=[1.0, 1.0],
                 )
             assert str(exc.value) == 'Grafana is unresponsive at this time.'
 
     assert sleep.mock_calls == [
         mock.call(1.0),
-        mock.call(1.0),
-        mock.call(1.0),
+        mock.call(pytest.approx(0.1)),
+    ]
+    assert get.mock_calls == [
+        mock.call('http://grafana.example.org/api/health',
+                  timeout=(1.0, 2.5)),
+        mock.call('http://grafana.example.org/api/health',
+                  timeout=(0.5, 0.5)),
+    ]
+
+
+def test_push_without_wait(make_http_service, fs_sandbox):
+    """Probing can be skipped when Grafana is known to be up."""
+
+    routes = {
+        'GET': {
+            '/api/datasources': lambda: [],
+            '/api/search': lambda: [],
+        },
+    }
+    os.makedirs('grafana/datasources')
+
+    with make_http_service(routes) as url:
+        with pytest.raises(requests.exceptions.HTTPError):
+            grafana_push(url, 'admin', 'admin', '.', wait_timeout=1.0)
+        assert grafana_push(url, 'admin', 'admin', '.', wait=False) == {
+            'uploaded': 0,
+            'skipped': 0,
+            'conflicts': 0,
+        }
+
+
+def make_grafana_routes(count):
+    """Build routes for a mock Grafana instance with ``count`` dashboards."""
+
+    def list_datasources():
+        return [
+            {
+                'id': 1,
+                'orgId': 1,
+                'typeLogoUrl': 'public/img/influxdb.svg',
+                'name': 'redis',
+                'type': 'influxdb',
+            },
+        ]
+
+    def search():
+        return [
+            {
+                'id': i,
+                'type': 'dash-db',
+                'uri': 'db/dashboard-%d' % (i,),
+            }
+            for i in range(count)
+        ]
+
+    def make_dashboard(i):
+        def get_dashboard():
+            return {
+                'dashboard': {
+                    'id': i,
+                    'title': 'Dashboard %d' % (i,),
+                    'version': 1,
+                },
+                'meta': {
+                    'slug': 'dashboard-%d' % (i,),
+                },
+            }
+        return get_dashboard
+
+    routes = {
+        'GET': {
+            '/api/datasources': list_datasources,
+            '/api/search': search,
+        },
+    }
+    for i in range(count):
+        routes['GET']['/api/dashboards/db/dashboard-%d' % (i,)] = \
+            make_dashboard(i)
+    return routes
+
+
+def snapshot(path):
+    """Collect the contents of all files in a folder."""
+    files = {}
+    for root, _, names in os.walk(path):
+        for name in names:
+            path = os.path.join(root, name)
+            files[path] = loadfile(path)
+    return files
+
+
+def test_pull_concurrent(make_http_service, tmpdir):
+    """Concurrent pulls produce exactly the same files as sequential pulls."""
+
+    routes = make_grafana_routes(20)
+
+    with make_http_service(routes) as url:
+        main(['grafana-pull',
+              '-i', url,
+              '-u', 'admin',
+              '-p', 'admin',
+              '-o', str(tmpdir.join('sequential'))])
+        main(['grafana-pull',
+              '-i', url,
+              '-u', 'admin',
+              '-p', 'admin',
+              '-o', str(tmpdir.join('concurrent')),
+              '--jobs', '8'])
+
+    sequential = snapshot(str(tmpdir.join('sequential')))
+    concurrent = snapshot(str(tmpdir.join('concurrent')))
+    assert len(sequential) == 21
+    assert {
+        os.path.relpath(path, str(tmpdir.join('sequential'))): data
+        for path, data in sequential.items()
+    } == {
+        os.path.relpath(path, str(tmpdir.join('concurrent'))): data
+        for path, data in concurrent.items()
+    }
+
+
+def test_pull_skips_identical_files(make_http_service, tmpdir):
+    """Files that didn't change are left untouched."""
+
+    routes = make_grafana_routes(3)
+    path = str(tmpdir.join('grafana', 'dashboards', 'dashboard-1.json'))
+
+    with make_http_service(routes) as url:
+        summary = grafana_pull(url, 'admin', 'admin', str(tmpdir))
+        assert summary == {'written': 4, 'unchanged': 0, 'deleted': 0}
+        os.utime(path, (0, 0))
+        summary = grafana_pull(url, 'admin', 'admin', str(tmpdir))
+        assert summary == {'written': 0, 'unchanged': 4, 'deleted': 0}
+        assert os.stat(path).st_mtime == 0
+        savefile(path, '{}')
+        summary = grafana_pull(url, 'admin', 'admin', str(tmpdir))
+        assert summary == {'written': 1, 'unchanged': 3, 'deleted': 0}
+    assert loadjson(path)['meta']['slug'] == 'dashboard-1'
+
+
+def test_push_concurrent(make_http_service, fs_sandbox):
+    """Dashboards are only uploaded after the data sources they use."""
+
+    events = []
+    lock = threading.Lock()
+
+    def record(event, result):
+        with lock:
+            events.append(event)
+        return result
+
+    def create_datasource(document):
+        time.sleep(0.02)
+        return record(('datasource', document['name']), {'id': 7})
+
+    def update_datasource(document):
+        return record(('datasource', document['name']), {})
+
+    def create_dashboard(document):
+        title = document['dashboard']['title']
+        if title == 'Stale':
+            raise HTTPResponseError(412, {'message': 'version-mismatch'})
+        return record(('dashboard', title), {})
+
+    routes = {
+        'GET': {
+            '/api/admin/stats': lambda: {},
+            '/api/datasources': lambda: [{'id': 3, 'name': 'mysql'}],
+            '/api/search': lambda: [],
+        },
+        'POST': {
+            '/api/datasources': create_datasource,
+            '/api/dashboards/db': create_dashboard,
+        },
+        'PUT': {
+            '/api/datasources/3': update_datasource,
+        },
+    }
+
+    # Given a Grafana configuration on disk.
+    os.mkdir('grafana')
+    os.mkdir('grafana/datasources')
+    for name in ('redis', 'mysql'):
+        savejson('grafana/datasources/%s.json' % (name,), {
+            'name': name,
+            'type': 'influxdb',
+        })
+    os.mkdir('grafana/dashboards')
+    for title, datasource in (('Redis', 'redis'), ('MySQL', 'mysql'),
+                              ('Stale', None), ('Plain', None)):
+        savejson('grafana/dashboards/%s.json' % (title.lower(),), {
+            'dashboard': {
+                'title': title,
+                'rows': [
+                    {
+                        'panels': [
+                            {
+                                'datasource': datasource,
+                            },
+                        ],
+                    },
+                ],
+            },
+            'meta': {
+                'slug': title.lower(),
+            },
+        })
+
+    # When we upload the configuration concurrently.
+    with make_http_service(routes) as url:
+        main(['grafana-push',
+              '-i', url,
+              '-u', 'admin',
+              '-p', 'admin',
+              '--jobs', '4'])
+
+    # Then everything (except the stale dashboard) should be uploaded.
+    assert sorted(events) == [
+        ('dashboard', 'MySQL'),
+        ('dashboard', 'Plain'),
+        ('dashboard', 'Redis'),
+        ('datasource', 'mysql'),
+        ('datasource', 'redis'),
+    ]
+
+    # And data sources should be created before dashboards that use them.
+    assert events.index(('datasource', 'redis')) < \
+        events.index(('dashboard', 'Redis'))
+    assert events.index(('datasource', 'mysql')) < \
+        events.index(('dashboard', 'MySQL'))
+
+
+def test_datasource_refs():
+    """Data source references are collected from the whole document."""
+
+    assert datasource_refs({
+        'dashboard': {
+            'rows': [
+                {'panels': [{'datasource': 'a'}, {'datasource': None}]},
+            ],
+            'templating': {
+                'list': [{'datasource': 'b'}],
+            },
+        },
+    }) == {'a', 'b', None}
+
+
+def test_push_plan(fs_sandbox, caplog):
+    """Duplicates are reported and default data sources come first."""
+
+    os.makedirs('grafana/datasources')
+    os.makedirs('grafana/dashboards')
+    savejson('grafana/datasources/a.json', {'name': 'a', 'isDefault': True})
+    savejson('grafana/datasources/b.json', {'name': 'b'})
+    savejson('grafana/dashboards/x.json', {
+        'dashboard': {'panels': [{'datasource': None}]},
+        'meta': {'slug': 'x'},
+    })
+    savejson('grafana/dashboards/y.json', {
+        'dashboard': {'panels': [{'datasource': 'b'}]},
+        'meta': {'slug': 'x'},
+    })
+
+    plan = push_plan('.')
+
+    assert list(plan) == [
+        ('datasource', 'a'),
+        ('datasource', 'b'),
+        ('dashboard', 'x'),
+    ]
+    path, after = plan[('dashboard', 'x')]
+    assert path == os.path.join('.', 'grafana', 'dashboards', 'y.json')
+    assert after == [('datasource', 'b')]
+    assert 'x.json' in caplog.text and 'overrides' in caplog.text
+
+    # The latest file for a slug still gets the default data source.
+    savejson('grafana/dashboards/y.json', {
+        'dashboard': {'panels': [{'datasource': None}]},
+        'meta': {'slug': 'x'},
+    })
+    assert push_plan('.')[('dashboard', 'x')][1] == [('datasource', 'a')]
+
+
+def test_push_skip_unchanged(make_http_service, fs_sandbox):
+    """Documents identical to the remote state are not uploaded."""
+
+    search = [{'id': 9, 'uri': 'db/foo'}]
+    downloads = []
+    uploads = []
+
+    def get_foo():
+        downloads.append('foo')
+        return {
+            'dashboard': {'id': 9, 'title': 'Foo', 'version': 4},
+            'meta': {'slug': 'foo'},
+        }
+
+    def upload(document):
+        uploads.append(document['dashboard']['title'])
+        search.append({'id': 10, 'uri': 'db/bar'})
+        return {'id': 10, 'status': 'success'}
+
+    routes = {
+        'GET': {
+            '/api/admin/stats': lambda: {},
+            '/api/datasources': lambda: [{
+                'id': 3,
+                'orgId': 1,
+                'name': 'mysql',
+                'type': 'influxdb',
+            }],
+            '/api/search': lambda: search,
+            '/api/dashboards/db/foo': get_foo,
+        },
+        'POST': {
+            '/api/dashboards/db': upload,
+        },
+    }
+
+    # Given a configuration where only one dashboard is new.
+    os.makedirs('grafana/datasources')
+    os.makedirs('grafana/dashboards')
+    savejson('grafana/datasources/mysql.json', {
+        'name': 'mysql',
+        'type': 'influxdb',
+    })
+    savejson('grafana/dashboards/foo.json', {
+        'dashboard': {'title': 'Foo', 'version': 1},
+        'meta': {'slug': 'foo'},
+    })
+    savejson('grafana/dashboards/bar.json', {
+        'dashboard': {'title': 'Bar', 'version': 1},
+        'meta': {'slug': 'bar'},
+    })
+
+    with make_http_service(routes) as url:
+        # When we push, only the new dashboard is uploaded.
+        summary = grafana_push(url, 'admin', 'admin', '.',
+                               skip_unchanged=True, state_path='state.json')
+        assert summary == {'uploaded': 1, 'skipped': 2, 'conflicts': 0}
+        assert uploads == ['Bar']
+        assert downloads == ['foo']
+
+        # When we push again, remote dashboards aren't downloaded again.
+        summary = grafana_push(url, 'admin', 'admin', '.',
+                               skip_unchanged=True, state_path='state.json')
+        assert summary == {'uploaded': 0, 'skipped': 3, 'conflicts': 0}
+        assert downloads == ['foo']
+
+        # When a dashboard is edited, it is uploaded.
+        savejson('grafana/dashboards/bar.json', {
+            'dashboard': {'title': 'Bar', 'version': 1, 'tags': ['x']},
+            'meta': {'slug': 'bar'},
+        })
+        main(['grafana-push', '-i', url, '-u', 'admin', '-p', 'admin',
+              '--skip-unchanged', '--state-file', 'state.json'])
+        assert uploads == ['Bar', 'Bar']
+
+    # The state is recorded per instance.
+    state = loadjson('state.json')
+    assert list(state) == [url]
+    assert sorted(state[url]) == ['bar', 'foo']
+
+
+def test_iter_search_pages():
+    """Search results are fetched page by page, lazily."""
+
+    pages = {
+        1: [{'id': 1}, {'id': 2}],
+        2: [{'id': 3}, {'id': 4}],
+        3: [{'id': 5}],
+    }
+    client = mock.MagicMock()
+    client.get_json.side_effect = lambda path: pages[int(path[-1])]
+
+    results = iter_search(client, limit=2)
+    assert next(results) == {'id': 1}
+    assert client.get_json.call_count == 1
+    assert list(results) == [{'id': i} for i in range(2, 6)]
+    assert client.get_json.mock_calls == [
+        mock.call('api/search?type=dash-db&limit=2&page=%d' % (page,))
+        for page in (1, 2, 3)
+    ]
+
+
+def test_iter_search_without_paging():
+    """Instances that ignore the page number don't loop forever."""
+
+    client = mock.MagicMock()
+    client.get_json.return_value = [{'id': 1}, {'id': 2}]
+    assert list(iter_search(client, limit=2)) == [{'id': 1}, {'id': 2}]
+    assert client.get_json.call_count == 2
+
+
+def test_pull_paginated_search(make_http_service, fs_sandbox):
+    """Pull enumerates dashboards beyond the first page of results."""
+
+    routes = make_grafana_routes(5)
+    search = routes['GET'].pop('/api/search')()
+    for page in range(1, 4):
+        path = '/api/search?type=dash-db&limit=2&page=%d' % (page,)
+        routes['GET'][path] = \
+            (lambda page: lambda: search[2 * page - 2:2 * page])(page)
+
+    with mock.patch('dashex.SEARCH_PAGE_SIZE', 2):
+        with make_http_service(routes) as url:
+            main(['grafana-pull', '-i', url, '-u', 'admin', '-p', 'admin',
+                  '--jobs', '2'])
+
+    assert sorted(os.listdir('grafana/dashboards')) == [
+        'dashboard-%d.json' % (i,) for i in range(5)
     ]
-    assert get.call_count == 3
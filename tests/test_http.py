@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+
+import filecmp
+import json
+import mock
+import os
+import pytest
+import requests.exceptions
+import tracemalloc
+import urllib3.connectionpool
+
+from dashex import _json, grafana_pull, grafana_push
+from dashex._http import Client
+from dashex._metrics import Metrics
+
+from fakegrafana import FakeGrafana, GrafanaError, run_fake_grafana
+
+
+def test_client_session_defaults():
+    """Client configures a pooled session with default auth and headers."""
+
+    client = Client(
+        'http://grafana.example.org',
+        credentials=('admin', 'admin'),
+        headers={'X-Test': 'yes'},
+        pool_size=4,
+    )
+    with client:
+        assert client.base_url == 'http://grafana.example.org'
+        assert client.pool_size == 4
+        assert client.session.auth == ('admin', 'admin')
+        assert client.session.headers['X-Test'] == 'yes'
+        assert 'Connection' not in client.session.headers or \
+            client.session.headers['Connection'] != 'close'
+        adapter = client.session.get_adapter('https://grafana.example.org')
+        assert adapter._pool_maxsize == 4
+        assert client.url('api/search') == \
+            'http://grafana.example.org/api/search'
+
+
+def test_client_without_keep_alive():
+    """Keep-alive can be disabled."""
+
+    with Client('http://grafana.example.org', keep_alive=False) as client:
+        assert client.session.headers['Connection'] == 'close'
+
+
+def test_client_get_json(make_http_service):
+    """Client reuses its session for successive requests."""
+
+    def search():
+        return [{'type': 'dash-db', 'uri': 'db/foo'}]
+
+    routes = {
+        'GET': {
+            '/api/search': search,
+        },
+    }
+
+    new_conn = urllib3.connectionpool.HTTPConnectionPool._new_conn
+    with make_http_service(routes) as url:
+        with mock.patch.object(urllib3.connectionpool.HTTPConnectionPool,
+                               '_new_conn', autospec=True,
+                               side_effect=new_conn) as connect:
+            with Client(url) as client:
+                for _ in range(3):
+                    assert client.get_json('api/search') == search()
+    assert connect.call_count == 1
+
+
+def test_client_compressed_responses():
+    """Compressed responses are decoded and their sizes recorded."""
+
+    grafana = FakeGrafana(dashboards=1, panels=50, gzip=True)
+    metrics = Metrics()
+    with run_fake_grafana(grafana) as url:
+        with Client(url, metrics=metrics) as client:
+            document = client.get_json('api/dashboards/db/dashboard-0')
+    assert len(document['dashboard']['panels']) == 50
+    counters = metrics.report()['counters']
+    assert counters['response_bytes_uncompressed'] == \
+        counters['bytes_received']
+    assert 0 < counters['response_bytes_compressed'] < \
+        counters['response_bytes_uncompressed']
+    assert metrics.report()['compression']['response'] > 2.0
+
+
+def test_client_compressed_requests():
+    """Large uploads are compressed when the server accepts it."""
+
+    grafana = FakeGrafana(gzip_requests=True)
+    metrics = Metrics()
+    dashboard = {'title': 'Large', 'panels': [{'id': i} for i in range(500)]}
+    with run_fake_grafana(grafana) as url:
+        with Client(url, metrics=metrics, compress_min_size=1024) as client:
+            client.post_json('api/dashboards/db', data={'dashboard': {
+                'title': 'Small',
+            }})
+            client.post_json('api/dashboards/db', data={
+                'dashboard': dashboard,
+            })
+            assert client.compress_min_size == 1024
+        assert grafana.dashboard('large')['panels'] == dashboard['panels']
+    assert grafana.encodings == {'identity': 1, 'gzip': 1}
+    assert metrics.report()['compression']['request'] > 2.0
+
+
+def test_client_compression_detection():
+    """Compression is turned off when the server rejects it."""
+
+    grafana = FakeGrafana()
+    metrics = Metrics()
+    with run_fake_grafana(grafana) as url:
+        with Client(url, metrics=metrics, compress_min_size=0) as client:
+            for title in ('One', 'Two'):
+                client.post_json('api/dashboards/db', data={'dashboard': {
+                    'title': title,
+                }})
+            assert client.compress_min_size is None
+        assert grafana.slugs() == ['one', 'two']
+    assert grafana.encodings == {'gzip': 1, 'identity': 2}
+    assert metrics.endpoints()['POST', 'api/dashboards/db'].statuses == {
+        '400': 1, '200': 2,
+    }
+
+
+def test_client_compression_with_bad_requests():
+    """Requests rejected for other reasons don't turn compression off."""
+
+    class StrictGrafana(FakeGrafana):
+        def save_dashboard(self, document):
+            raise GrafanaError(400, 'Dashboard title cannot be empty')
+
+    grafana = StrictGrafana(gzip_requests=True)
+    with run_fake_grafana(grafana) as url:
+        with Client(url, compress_min_size=0) as client:
+            with pytest.raises(requests.exceptions.HTTPError):
+                client.post_json('api/dashboards/db', data={'dashboard': {
+                    'title': '',
+                }})
+            assert client.compress_min_size == 0
+    assert grafana.encodings == {'gzip': 1, 'identity': 1}
+
+
+def test_pull_and_push_compressed(tmpdir):
+    """Pulls decode compressed responses, pushes fall back when needed."""
+
+    for gzip in (False, True):
+        grafana = FakeGrafana(dashboards=3, gzip=gzip)
+        with run_fake_grafana(grafana) as url:
+            grafana_pull(url, 'admin', 'admin', str(tmpdir.join(str(gzip))),
+                         metrics_path=str(tmpdir.join('%s.json' % (gzip,))))
+    for folder in ('datasources', 'dashboards'):
+        left = str(tmpdir.join('False', 'grafana', folder))
+        right = str(tmpdir.join('True', 'grafana', folder))
+        names = os.listdir(left)
+        assert filecmp.cmpfiles(left, right, names, shallow=False) == \
+            (names, [], [])
+    with open(str(tmpdir.join('True.json'))) as stream:
+        assert json.load(stream)['compression']['response'] > 2.0
+
+    grafana = FakeGrafana()
+    with run_fake_grafana(grafana) as url:
+        summary = grafana_push(url, 'admin', 'admin', str(tmpdir.join('True')),
+                               compress=True, compress_min_size=0)
+    assert summary['uploaded'] == 4
+    assert grafana.encodings == {'gzip': 1, 'identity': 4}
+
+
+def large_dashboard(title, panels=2000):
+    return {'title': title, 'panels': [
+        {'id': i, 'title': 'Panel %d' % (i,), 'type': 'graph'}
+        for i in range(panels)
+    ]}
+
+
+def test_client_streamed_uploads():
+    """Large uploads are streamed, compressed or not."""
+
+    dashboard = large_dashboard('Large')
+    grafana = FakeGrafana(gzip_requests=True)
+    metrics = [Metrics(), Metrics()]
+    with run_fake_grafana(grafana) as url:
+        with Client(url, metrics=metrics[0]) as client:
+            client.post_json('api/dashboards/db',
+                             data={'dashboard': dashboard})
+        assert grafana.dashboard('large')['panels'] == dashboard['panels']
+        with Client(url, compress_min_size=0, metrics=metrics[1]) as client:
+            client.post_json('api/dashboards/db',
+                             data={'dashboard': dashboard, 'overwrite': True})
+        assert grafana.dashboard('large')['version'] == 2
+    assert grafana.encodings == {'chunked': 2, 'identity': 1, 'gzip': 1}
+    counters = [m.report()['counters'] for m in metrics]
+    assert counters[0]['bytes_sent'] == \
+        len(_json.dumps({'dashboard': dashboard}))
+    assert counters[1]['bytes_sent'] == \
+        counters[1]['request_bytes_compressed']
+    assert metrics[1].report()['compression']['request'] > 2.0
+
+
+def test_client_streamed_compression_detection():
+    """Streamed uploads are sent again uncompressed when rejected."""
+
+    grafana = FakeGrafana()
+    with run_fake_grafana(grafana) as url:
+        with Client(url, compress_min_size=0) as client:
+            client.post_json('api/dashboards/db',
+                             data={'dashboard': large_dashboard('Large')})
+            assert client.compress_min_size is None
+        assert len(grafana.dashboard('large')['panels']) == 2000
+    assert grafana.encodings == {'chunked': 2, 'gzip': 1, 'identity': 1}
+
+
+def test_client_streamed_upload_memory():
+    """Streamed uploads are never held in memory whole."""
+
+    dashboard = large_dashboard('Large', panels=20000)
+    size = len(json.dumps(dashboard))
+    sizes = []
+
+    def post(url, data, **kwds):
+        sizes.append(sum(len(chunk) for chunk in data))
+        response = mock.MagicMock(status_code=200, content=b'{}',
+                                  headers={})
+        return response
+
+    with Client('http://grafana.example.org') as client:
+        with mock.patch.object(client.session, 'post', side_effect=post):
+            tracemalloc.start()
+            try:
+                client.post_json('api/dashboards/db',
+                                 data={'dashboard': dashboard})
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    assert sizes == [mock.ANY]
+    assert sizes[0] > size / 2
+    assert peak < size / 4
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+
+import mock
+import requests.exceptions
+import threading
+
+from dashex import grafana_pull
+from dashex._influx import InfluxSink, format_line, report_points
+from dashex._metrics import Metrics
+
+from test_grafana import make_grafana_routes
+
+
+def test_format_line():
+    """Points are rendered in line protocol, with special characters
+    escaped."""
+
+    assert format_line('cpu', {'value': 0.5}) == 'cpu value=0.5'
+    assert format_line('my cpu,1', {
+        'count': 3,
+        'ok': True,
+        'text': 'say "hi"',
+        'missing': None,
+    }, tags={
+        'host': 'a b=c',
+        'empty': '',
+    }, timestamp=1.5) == \
+        'my\\ cpu\\,1,host=a\\ b\\=c count=3i,ok=true,text="say \\"hi\\"" ' \
+        '1500000000'
+    assert format_line('cpu', {'value': None}) is None
+
+
+def test_sink_batches():
+    """Points are sent in batches, in the background."""
+
+    session = mock.MagicMock()
+    sink = InfluxSink('http://influxdb.example.org:8086', database='test',
+                      batch_size=2, session=session, clock=lambda: 2.0)
+    for i in range(5):
+        sink.write('point', {'i': i})
+    sink.close()
+
+    bodies = [call[1]['data'] for call in session.post.call_args_list]
+    assert b''.join(bodies) == b''.join(
+        b'point i=%di 2000000000\n' % (i,) for i in range(5)
+    )
+    assert all(body.count(b'\n') <= 2 for body in bodies)
+    url, = session.post.call_args[0]
+    assert url == 'http://influxdb.example.org:8086/write'
+    assert session.post.call_args[1]['params'] == {
+        'db': 'test',
+        'precision': 'ns',
+    }
+
+
+def test_sink_doesnt_block():
+    """Writes never wait for InfluxDB, failures are counted."""
+
+    release = threading.Event()
+
+    def post(*args, **kwds):
+        release.wait()
+        raise requests.exceptions.ConnectionError()
+
+    session = mock.MagicMock()
+    session.post.side_effect = post
+    sink = InfluxSink('http://influxdb.example.org:8086', batch_size=1,
+                      max_pending=2, session=session)
+    for i in range(10):
+        sink.write('point', {'i': i})
+    assert sink.dropped >= 7
+    release.set()
+    sink.close()
+    assert sink.dropped + sink.failed == 10
+
+
+def test_report_points():
+    """Runs are summarized by phase, endpoint and counters."""
+
+    sink = mock.MagicMock()
+    metrics = Metrics()
+    metrics.request('GET', 'api/search', 200, 0.02, 100)
+    metrics.request('GET', 'api/search', 200, 0.3, 100)
+    metrics.count('objects_pulled', 3)
+    metrics.add_time('write', 0.25)
+    report_points(sink, metrics, {'command': 'pull'}, timestamp=1.0)
+
+    assert sink.write.mock_calls == [
+        mock.call('dashex_phase', {'seconds': 0.25, 'count': 1},
+                  {'command': 'pull', 'phase': 'write'}, 1.0),
+        mock.call('dashex_http', {
+            'requests': 2,
+            'errors': 0,
+            'retries': 0,
+            'bytes': 200,
+            'p50': 0.025,
+            'p90': 0.5,
+            'p99': 0.5,
+        }, {'command': 'pull', 'method': 'GET', 'endpoint': 'api/search'},
+            1.0),
+        mock.call('dashex_run', {'bytes_received': 200, 'objects_pulled': 3},
+                  {'command': 'pull'}, 1.0),
+    ]
+
+
+def test_pull_to_influxdb(make_http_service, tmpdir):
+    """Pulls write requests and a summary of the run to InfluxDB."""
+
+    lines = []
+    routes = make_grafana_routes(3)
+    routes.setdefault('POST', {})['/write'] = \
+        lambda text: lines.extend(text.splitlines())
+
+    with make_http_service(routes) as url:
+        grafana_pull(url, 'admin', 'admin', str(tmpdir), influxdb_url=url)
+
+    measurements = [line.split(',', 1)[0] for line in lines]
+    assert measurements.count('dashex_request') == 5
+    assert measurements.count('dashex_phase') >= 3
+    [run] = [line for line in lines if line.startswith('dashex_run,')]
+    assert 'command=pull' in run
+    assert 'objects_pulled=4i' in run
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import pytest
+
+from dashex import _json, json_pp
+
+
+DOCUMENTS = [
+    {},
+    [],
+    {'b': [], 'a': {}, 'c': [1, {'x': None, 'y': True, 'z': False}]},
+    {'floats': [1.5, 0.1, -0.0, 100.0, 1e16, 1e-07, -2.5e+300]},
+    {'text': u'caf\xe9   \U0001f600 </script> \x7f \x1f "\\/'},
+    {u'cl\xe9': 1, 'key": 1e5': '1e5', 'z': '\n1e5'},
+    {'big': 2 ** 70, 'small': -2 ** 63},
+]
+
+
+@pytest.fixture(params=sorted(_json.BACKENDS))
+def backend(request):
+    previous = _json.backend
+    _json.use_backend(request.param)
+    yield _json.backend
+    _json.backend = previous
+
+
+@pytest.mark.parametrize('document', DOCUMENTS)
+def test_json_pp_is_canonical(backend, document):
+    """All backends render byte-identical normalized output."""
+
+    assert json_pp(document) == json.dumps(
+        document, indent=2, sort_keys=True, separators=(',', ': '),
+    )
+
+
+@pytest.mark.parametrize('document', DOCUMENTS)
+def test_json_round_trip(backend, document):
+    """Compact and normalized output parses back to the same document."""
+
+    assert _json.loads(_json.dumps(document)) == document
+    assert _json.loads(_json.pretty(document)) == document
+
+
+@pytest.mark.parametrize('depth', [0, 1, 2, 5])
+@pytest.mark.parametrize('document', DOCUMENTS + [[[1, [2, []]], {}]])
+def test_json_streaming(backend, document, depth):
+    """Streamed output is identical, whatever the depth of streaming."""
+
+    assert b''.join(_json.iter_pretty(document, depth)) == \
+        _json.pretty(document)
+    assert _json.loads(b''.join(_json.iter_dumps(document, depth))) == \
+        document
+
+
+def test_json_loads_lenient(backend):
+    """Non-standard input accepted by the standard library still parses."""
+
+    assert _json.loads(b'[NaN]')[0] != _json.loads(b'[NaN]')[0]
+    with pytest.raises(ValueError):
+        _json.loads(b'')
+
+
+def test_json_unknown_backend():
+    """Backends are selected by name."""
+
+    with pytest.raises(KeyError):
+        _json.use_backend('unknown')
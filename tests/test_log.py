@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+
+import io
+import json
+import logging
+import mock
+import pytest
+
+from dashex._log import Progress, configure_logging, log
+from dashex.__main__ import main
+
+from test_grafana import make_grafana_routes
+
+
+@pytest.fixture
+def restore_logging():
+    """Undo :py:func:`configure_logging` after the test."""
+
+    level, handlers = log.level, list(log.handlers)
+    yield
+    log.setLevel(level)
+    log.handlers[:] = handlers
+
+
+def test_configure_logging(restore_logging):
+    """Records are rendered as text or JSON lines, above a level."""
+
+    stream = io.StringIO()
+    configure_logging(logging.WARNING, stream=stream)
+    log.info('Hidden.')
+    log.warning('Shown %d.', 1)
+    assert stream.getvalue() == 'Shown 1.\n'
+
+    stream = io.StringIO()
+    configure_logging(logging.INFO, 'json', stream=stream)
+    log.info('Wrote %d files.', 2, extra={'data': {'written': 2}})
+    record = json.loads(stream.getvalue())
+    assert record['level'] == 'info'
+    assert record['logger'] == 'dashex'
+    assert record['message'] == 'Wrote 2 files.'
+    assert record['written'] == 2
+    assert len(log.handlers) == 1
+
+    with pytest.raises(ValueError):
+        configure_logging(format='xml')
+
+
+def test_progress(caplog):
+    """Progress is logged at most once per interval, with throughput."""
+
+    clock = mock.MagicMock(return_value=0.0)
+    progress = Progress('Pulled', interval=10.0, clock=clock)
+    with caplog.at_level(logging.INFO, logger='dashex'):
+        for now in (1.0, 5.0, 10.0, 12.0, 20.0):
+            clock.return_value = now
+            progress.advance(10)
+    assert progress.count == 50
+    assert [record.getMessage() for record in caplog.records] == [
+        'Pulled 30 objects (3.0/s).',
+        'Pulled 50 objects (2.5/s).',
+    ]
+
+    caplog.clear()
+    progress = Progress('Pulled', interval=None, clock=clock)
+    progress.advance(100)
+    assert not caplog.records
+
+
+def logged(errors):
+    """Drop the mock server's access log from captured output."""
+    return [
+        line for line in errors.splitlines()
+        if not line.startswith('127.0.0.1 - ')
+    ]
+
+
+def test_cli_log_levels(make_http_service, tmpdir, capsys, restore_logging):
+    """Quiet runs are silent, verbose ones report every file."""
+
+    with make_http_service(make_grafana_routes(3)) as url:
+        main(['-q', 'grafana-pull', '-i', url, '-o', str(tmpdir)])
+        output, errors = capsys.readouterr()
+        assert output == ''
+        assert logged(errors) == []
+
+        main(['grafana-pull', '-i', url, '-o', str(tmpdir)])
+        output, errors = capsys.readouterr()
+        assert output == ''
+        assert logged(errors) == [
+            'Wrote 0 changed files, 4 unchanged, deleted 0.',
+            'Done.',
+        ]
+
+        main(['-v', '--log-format', 'json',
+              'grafana-pull', '-i', url, '-o', str(tmpdir)])
+        output, errors = capsys.readouterr()
+        records = [json.loads(line) for line in logged(errors)]
+        assert any('dashboard-0.json' in record['message']
+                   for record in records)
+        [summary] = [record for record in records if 'unchanged' in record]
+        assert summary['unchanged'] == 4
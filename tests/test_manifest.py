@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import mock
+import os
+import pytest
+
+from dashex.__main__ import main
+from dashex._manifest import (
+    Manifest,
+    PushState,
+    default_state_path,
+    file_sha256,
+    sha256,
+)
+
+
+def test_manifest_missing(tmpdir):
+    """A missing manifest loads as empty."""
+    manifest = Manifest.load(str(tmpdir.join('manifest.json')))
+    assert manifest.dashboards == {}
+    assert manifest.get('foo') is None
+    assert not manifest.matches_file('foo', str(tmpdir.join('foo.json')))
+
+
+def test_manifest_roundtrip(tmpdir):
+    """Entries survive a save/load cycle."""
+    path = str(tmpdir.join('foo.json'))
+    with open(path, 'wb') as stream:
+        stream.write(b'{}\n')
+    manifest = Manifest(str(tmpdir.join('manifest.json')))
+    manifest.update('foo', path, sha256(b'{}\n'), id=1, version=2,
+                    updated='now')
+    manifest.save()
+    manifest = Manifest.load(str(tmpdir.join('manifest.json')))
+    assert manifest.get('foo')['version'] == 2
+    assert manifest.get('foo')['sha256'] == sha256(b'{}\n')
+    assert manifest.matches_file('foo', path)
+    assert sorted(os.listdir(str(tmpdir))) == ['foo.json', 'manifest.json']
+
+
+def test_manifest_detects_local_changes(tmpdir):
+    """Files edited since they were recorded don't match."""
+    path = str(tmpdir.join('foo.json'))
+    with open(path, 'wb') as stream:
+        stream.write(b'{}\n')
+    manifest = Manifest(str(tmpdir.join('manifest.json')))
+    manifest.update('foo', path, sha256(b'{}\n'), id=1, version=2,
+                    updated='now')
+
+    # Same size, different contents and modification time.
+    with open(path, 'wb') as stream:
+        stream.write(b'[]\n')
+    os.utime(path, (0, 0))
+    assert not manifest.matches_file('foo', path)
+
+    # Restored contents, but a different modification time.
+    with open(path, 'wb') as stream:
+        stream.write(b'{}\n')
+    os.utime(path, (0, 0))
+    assert manifest.matches_file('foo', path)
+
+    os.unlink(path)
+    assert not manifest.matches_file('foo', path)
+    assert file_sha256(path) is None
+
+
+class FakeGrafana(object):
+    """Mock Grafana routes that count dashboard downloads."""
+
+    def __init__(self, versions, listing_versions=False, probe=True):
+        self.versions = versions
+        self.listing_versions = listing_versions
+        self.probe = probe
+        self.downloads = []
+        self.probes = []
+
+    def search(self):
+        hits = []
+        for i, slug in enumerate(sorted(self.versions)):
+            hit = {'id': i, 'type': 'dash-db', 'uri': 'db/%s' % (slug,)}
+            if self.listing_versions:
+                hit['version'] = self.versions[slug]
+            hits.append(hit)
+        return hits
+
+    def routes(self):
+        routes = {
+            'GET': {
+                '/api/datasources': lambda: [],
+                '/api/search': self.search,
+            },
+        }
+        for i, slug in enumerate(sorted(self.versions)):
+            routes['GET']['/api/dashboards/db/%s' % (slug,)] = \
+                self.make_download(i, slug)
+            if self.probe:
+                path = '/api/dashboards/id/%d/versions?limit=1' % (i,)
+                routes['GET'][path] = self.make_probe(slug)
+        return routes
+
+    def make_download(self, i, slug):
+        def download():
+            self.downloads.append(slug)
+            return {
+                'dashboard': {'id': i, 'version': self.versions[slug]},
+                'meta': {'slug': slug, 'updated': 'v%d' % (
+                    self.versions[slug],
+                )},
+            }
+        return download
+
+    def make_probe(self, slug):
+        def probe():
+            self.probes.append(slug)
+            if self.probe == 'fail':
+                raise Exception('boom')
+            return [{'version': self.versions[slug]}]
+        return probe
+
+
+def pull(make_http_service, grafana):
+    with make_http_service(grafana.routes()) as url:
+        main(['grafana-pull', '-i', url, '-u', 'admin', '-p', 'admin',
+              '--incremental'])
+
+
+def test_incremental_pull(make_http_service, fs_sandbox):
+    """Only changed dashboards are downloaded again."""
+
+    grafana = FakeGrafana({'a': 1, 'b': 1, 'c': 1})
+
+    # Without a manifest, everything is downloaded.
+    pull(make_http_service, grafana)
+    assert sorted(grafana.downloads) == ['a', 'b', 'c']
+    with open('grafana/manifest.json', 'rb') as stream:
+        manifest = json.loads(stream.read().decode('utf-8'))
+    assert sorted(manifest['dashboards']) == ['a', 'b', 'c']
+
+    # When nothing changed, nothing is downloaded.
+    del grafana.downloads[:]
+    pull(make_http_service, grafana)
+    assert grafana.downloads == []
+
+    # When a version changes, only that dashboard is downloaded.
+    grafana.versions['b'] = 2
+    pull(make_http_service, grafana)
+    assert grafana.downloads == ['b']
+    with open('grafana/dashboards/b.json', 'rb') as stream:
+        document = json.loads(stream.read().decode('utf-8'))
+    assert document['dashboard']['version'] == 2
+
+    # When a local file is edited, it is restored.
+    del grafana.downloads[:]
+    with open('grafana/dashboards/c.json', 'wb') as stream:
+        stream.write(b'{}\n')
+    pull(make_http_service, grafana)
+    assert grafana.downloads == ['c']
+
+    # When a dashboard is deleted remotely, the local file is removed.
+    del grafana.downloads[:]
+    del grafana.versions['a']
+    pull(make_http_service, grafana)
+    assert not os.path.exists('grafana/dashboards/a.json')
+    with open('grafana/manifest.json', 'rb') as stream:
+        manifest = json.loads(stream.read().decode('utf-8'))
+    assert sorted(manifest['dashboards']) == ['b', 'c']
+
+
+def test_incremental_pull_listing_versions(make_http_service, fs_sandbox):
+    """Versions in the listing avoid one request per dashboard."""
+
+    grafana = FakeGrafana({'a': 1, 'b': 1}, listing_versions=True)
+    pull(make_http_service, grafana)
+    del grafana.downloads[:]
+    grafana.versions['a'] = 2
+    pull(make_http_service, grafana)
+    assert grafana.downloads == ['a']
+    assert grafana.probes == []
+
+
+def test_incremental_pull_without_versions(make_http_service, fs_sandbox):
+    """Instances without dashboard versions get full downloads."""
+
+    grafana = FakeGrafana({'a': 1}, probe=False)
+    pull(make_http_service, grafana)
+    pull(make_http_service, grafana)
+    assert grafana.downloads == ['a', 'a']
+
+
+def test_incremental_pull_probe_failure(make_http_service, fs_sandbox):
+    """Unexpected errors while probing versions are not hidden."""
+
+    grafana = FakeGrafana({'a': 1})
+    pull(make_http_service, grafana)
+    grafana.probe = 'fail'
+    with pytest.raises(Exception) as exc:
+        pull(make_http_service, grafana)
+    assert exc.value.response.status_code == 500
+
+
+def test_pull_without_manifest(make_http_service, fs_sandbox):
+    """Regular pulls don't write a manifest."""
+
+    grafana = FakeGrafana({'a': 1})
+    with make_http_service(grafana.routes()) as url:
+        main(['grafana-pull', '-i', url, '-u', 'admin', '-p', 'admin'])
+    assert os.path.exists('grafana/dashboards/a.json')
+    assert not os.path.exists('grafana/manifest.json')
+
+
+def test_push_state_keeps_other_instances(tmpdir):
+    """Saving the state of one instance preserves the others."""
+
+    path = str(tmpdir.join('cache', 'state.json'))
+    state = PushState.load(path, 'http://a')
+    state.update('foo', 1, 'aaa')
+    state.save()
+    state = PushState.load(path, 'http://b')
+    assert state.get('foo') is None
+    state.update('foo', 2, 'bbb')
+    state.save()
+    assert PushState.load(path, 'http://a').get('foo') == {
+        'id': 1,
+        'sha256': 'aaa',
+    }
+
+
+def test_default_state_path():
+    """The push state lives in the user's cache folder."""
+
+    with mock.patch.dict('os.environ', {'XDG_CACHE_HOME': '/tmp/cache'}):
+        assert default_state_path() == '/tmp/cache/dashex/push-state.json'
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import mock
+
+from conftest import HTTPResponseError
+from dashex._http import Client
+from dashex._metrics import Histogram, Metrics, endpoint
+from dashex._throttle import RetryPolicy
+from dashex.__main__ import main
+
+from test_grafana import make_grafana_routes
+
+
+def test_endpoint():
+    """Paths that identify single objects are aggregated."""
+
+    assert endpoint('api/search?type=dash-db') == 'api/search'
+    assert endpoint('/api/dashboards/db/my-dashboard') == \
+        'api/dashboards/db/:slug'
+    assert endpoint('api/datasources/12') == 'api/datasources/:id'
+    assert endpoint('api/datasources/12/proxy') == \
+        'api/datasources/:id/proxy'
+
+
+def test_histogram():
+    """Values are counted in the first bucket that holds them."""
+
+    histogram = Histogram([1, 10])
+    assert histogram.quantile(0.5) is None
+    for value in (0.5, 1, 5, 50):
+        histogram.observe(value)
+    assert histogram.count == 4
+    assert histogram.sum == 56.5
+    assert histogram.cumulative() == [(1, 2), (10, 3), ('+Inf', 4)]
+    assert histogram.quantile(0.5) == 1
+    assert histogram.quantile(0.75) == 10
+    assert histogram.quantile(1.0) == 10
+
+
+def test_metrics_report():
+    """Reports are rendered as JSON or in Prometheus format."""
+
+    clock = mock.MagicMock(side_effect=[1.0, 1.5])
+    metrics = Metrics(clock=clock)
+    metrics.request('get', 'api/dashboards/db/a', 200, 0.02, 300)
+    metrics.request('get', 'api/dashboards/db/b', None, 0.3)
+    metrics.retry('get', 'api/dashboards/db/b')
+    with metrics.phase('write'):
+        pass
+
+    report = json.loads(metrics.render('json'))
+    assert report['phases'] == {'write': {'count': 1, 'seconds': 0.5}}
+    [stats] = report['endpoints']
+    assert stats['method'] == 'GET'
+    assert stats['endpoint'] == 'api/dashboards/db/:slug'
+    assert stats['requests'] == 2
+    assert stats['statuses'] == {'200': 1, 'error': 1}
+    assert stats['retries'] == 1
+    assert stats['latency']['count'] == 2
+    assert stats['size']['sum'] == 300
+
+    text = metrics.render('prometheus')
+    labels = 'endpoint="api/dashboards/db/:slug",method="GET"'
+    assert 'dashex_http_requests_total{%s,status="200"} 1' % labels in text
+    assert 'dashex_http_retries_total{%s} 1' % labels in text
+    assert 'dashex_http_request_duration_seconds_bucket{%s} 1' % (
+        'endpoint="api/dashboards/db/:slug",le="0.025",method="GET"',
+    ) in text
+    assert 'dashex_http_response_size_bytes_sum{%s} 300' % labels in text
+    assert 'dashex_phase_seconds_total{phase="write"} 0.5' in text
+
+
+def test_client_metrics(make_http_service):
+    """Clients record every attempt, including retries."""
+
+    failures = [HTTPResponseError(502, {})]
+
+    def search():
+        if failures:
+            raise failures.pop(0)
+        return []
+
+    routes = {
+        'GET': {
+            '/api/search': search,
+        },
+    }
+
+    metrics = Metrics()
+    with make_http_service(routes) as url:
+        with Client(url, retry=RetryPolicy(retries=1),
+                    sleep=mock.MagicMock(), metrics=metrics) as client:
+            assert client.get_json('api/search') == []
+
+    stats = metrics.endpoints()[('GET', 'api/search')]
+    assert stats.statuses == {'502': 1, '200': 1}
+    assert stats.retries == 1
+    assert stats.size.count == 2
+    assert metrics.report()['phases']['parse']['count'] == 1
+
+
+def test_pull_metrics(make_http_service, tmpdir):
+    """The CLI saves a report of the run."""
+
+    with make_http_service(make_grafana_routes(3)) as url:
+        main(['grafana-pull',
+              '-i', url,
+              '-o', str(tmpdir),
+              '--metrics', str(tmpdir.join('metrics.json'))])
+        main(['grafana-pull',
+              '-i', url,
+              '-o', str(tmpdir),
+              '--metrics', str(tmpdir.join('metrics.prom')),
+              '--metrics-format', 'prometheus'])
+
+    report = json.loads(tmpdir.join('metrics.json').read())
+    endpoints = {
+        (stats['method'], stats['endpoint']): stats
+        for stats in report['endpoints']
+    }
+    assert endpoints['GET', 'api/dashboards/db/:slug']['requests'] == 3
+    assert endpoints['GET', 'api/search']['requests'] >= 1
+    assert report['phases']['serialize']['count'] >= 3
+    assert report['phases']['write']['count'] >= 3
+    assert 'dashex_http_requests_total' in tmpdir.join('metrics.prom').read()
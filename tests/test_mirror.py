@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+
+import filecmp
+import mock
+import os
+import pytest
+import requests.exceptions
+import subprocess
+
+from dashex import grafana_pull
+from dashex._mirror import Mirror, grafana_mirror
+from dashex.__main__ import main
+
+from fakegrafana import FakeGrafana, run_fake_grafana
+
+
+GET_DASHBOARD = ('GET', r'^/api/dashboards/db/([^/]+)$')
+GET_DATASOURCES = ('GET', r'^/api/datasources$')
+GET_SEARCH = ('GET', r'^/api/search$')
+GET_VERSIONS = ('GET', r'^/api/dashboards/id/(\d+)/versions$')
+
+
+def edit(grafana, slug):
+    """Change a dashboard on the instance, like a user would."""
+    grafana.save_dashboard({'dashboard': dict(grafana.dashboard(slug),
+                                              panels=[])})
+
+
+def same_files(left, right):
+    comparison = filecmp.dircmp(left, right)
+    return not (comparison.left_only or comparison.right_only or
+                comparison.diff_files)
+
+
+@pytest.mark.parametrize('listing_versions', [True, False])
+def test_grafana_mirror(tmpdir, listing_versions):
+    """Only changes are pulled, each cycle mostly costs a listing."""
+
+    grafana = FakeGrafana(dashboards=3, datasources=2,
+                          listing_versions=listing_versions)
+    output_path = str(tmpdir.join('mirror'))
+    manifest = os.path.join(output_path, 'grafana', 'manifest.json')
+    mtimes = []
+
+    def sleep(delay):
+        assert 0.0 <= delay <= 30.0
+        mtimes.append(os.stat(manifest).st_mtime)
+        if len(mtimes) == 2:
+            edit(grafana, 'dashboard-1')
+
+    with run_fake_grafana(grafana) as url:
+        summary = grafana_mirror(url, 'admin', 'admin', output_path,
+                                 rounds=3, sleep=sleep)
+        assert summary == {'written': 6, 'unchanged': 9, 'deleted': 0}
+        assert grafana.requests[GET_DATASOURCES] == 3
+        assert grafana.requests[GET_SEARCH] == 3
+        assert grafana.requests[GET_DASHBOARD] == 4
+        assert grafana.requests[GET_VERSIONS] == \
+            (0 if listing_versions else 6)
+
+        # Nothing is written when nothing changed.
+        assert mtimes[0] == mtimes[1]
+
+        # Files are the same as pulled from scratch.
+        pulled = str(tmpdir.join('pulled'))
+        grafana_pull(url, 'admin', 'admin', pulled)
+        assert same_files(os.path.join(output_path, 'grafana', 'dashboards'),
+                          os.path.join(pulled, 'grafana', 'dashboards'))
+        assert same_files(os.path.join(output_path, 'grafana', 'datasources'),
+                          os.path.join(pulled, 'grafana', 'datasources'))
+
+
+def test_grafana_mirror_git(tmpdir, monkeypatch):
+    """Changes are committed to Git, one commit per cycle."""
+
+    for name in ('AUTHOR', 'COMMITTER'):
+        monkeypatch.setenv('GIT_%s_NAME' % (name,), 'dashex')
+        monkeypatch.setenv('GIT_%s_EMAIL' % (name,), 'dashex@example.org')
+    grafana = FakeGrafana(dashboards=2, listing_versions=True)
+    output_path = str(tmpdir)
+    tmpdir.join('notes.txt').write('Not mirrored.')
+
+    def git_log():
+        output = subprocess.check_output(
+            ['git', 'log', '--format=%s', '--name-status'], cwd=output_path,
+        ).decode('utf-8')
+        return [line for line in output.splitlines() if line]
+
+    with run_fake_grafana(grafana) as url:
+        grafana_mirror(url, 'admin', 'admin', output_path, rounds=3,
+                       git=True, sleep=lambda delay: edit(grafana,
+                                                          'dashboard-0'))
+    assert git_log() == [
+        'Mirror %s' % (url,),
+        'M\tgrafana/dashboards/dashboard-0.json',
+        'Mirror %s' % (url,),
+        'M\tgrafana/dashboards/dashboard-0.json',
+        'Mirror %s' % (url,),
+        'A\tgrafana/dashboards/dashboard-0.json',
+        'A\tgrafana/dashboards/dashboard-1.json',
+        'A\tgrafana/datasources/datasource-0.json',
+    ]
+
+
+def test_grafana_mirror_failures(tmpdir):
+    """Failed cycles don't stop the mirror."""
+
+    sleep = mock.MagicMock()
+    with mock.patch.object(Mirror, 'cycle', side_effect=[
+        requests.exceptions.ConnectionError('boom'),
+        {'written': 1, 'unchanged': 2, 'deleted': 0},
+    ]) as cycle:
+        summary = grafana_mirror('http://localhost:3000', 'admin', 'admin',
+                                 str(tmpdir), interval=5.0, rounds=2,
+                                 wait=False, sleep=sleep,
+                                 clock=mock.MagicMock(return_value=0.0))
+    assert cycle.call_count == 2
+    assert sleep.call_args_list == [mock.call(5.0)]
+    assert summary == {'written': 1, 'unchanged': 2, 'deleted': 0}
+
+
+def test_cli_mirror(tmpdir):
+    """The mirror can be started from the command line."""
+
+    with mock.patch('dashex._mirror.grafana_mirror') as mirror:
+        main(['grafana-mirror', '-i', 'http://localhost:3000',
+              '-o', str(tmpdir), '--interval', '10', '--git'])
+    mirror.assert_called_once_with(
+        grafana_url='http://localhost:3000', username=None, password=None,
+        output_path=str(tmpdir), interval=10.0, git=True, jobs=1, wait=True,
+        wait_timeout=mock.ANY, pool_size=mock.ANY, retries=mock.ANY,
+        max_rate=None, max_concurrency=None, timeout=mock.ANY,
+    )
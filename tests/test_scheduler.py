@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+
+import pytest
+import threading
+import time
+
+from dashex._scheduler import Scheduler
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_scheduler_honors_dependencies(jobs):
+    """Tasks only start once their dependencies have completed."""
+
+    events = []
+    lock = threading.Lock()
+
+    def task(name, delay=0.0):
+        def run():
+            time.sleep(delay)
+            with lock:
+                events.append(name)
+            return name.upper()
+        return run
+
+    scheduler = Scheduler(jobs=jobs)
+    scheduler.add('a', task('a', 0.02))
+    scheduler.add('b', task('b'))
+    scheduler.add('c', task('c'), after=['a'])
+    scheduler.add('d', task('d'), after=['a', 'b', 'unknown'])
+    results = scheduler.run()
+
+    assert results == {'a': 'A', 'b': 'B', 'c': 'C', 'd': 'D'}
+    assert events.index('a') < events.index('c')
+    assert events.index('a') < events.index('d')
+    assert events.index('b') < events.index('d')
+
+
+def test_scheduler_bounds_concurrency():
+    """No more than ``jobs`` tasks are in flight at any given time."""
+
+    state = {'running': 0, 'peak': 0}
+    lock = threading.Lock()
+
+    def task():
+        with lock:
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+        time.sleep(0.005)
+        with lock:
+            state['running'] -= 1
+
+    scheduler = Scheduler(jobs=3)
+    for i in range(20):
+        scheduler.add(i, task)
+    scheduler.run()
+
+    assert 1 < state['peak'] <= 3
+
+
+def test_scheduler_forwards_errors():
+    """The first failure stops scheduling and is re-raised."""
+
+    e = ValueError()
+    started = []
+
+    def fail():
+        raise e
+
+    scheduler = Scheduler(jobs=2)
+    scheduler.add('a', fail)
+    scheduler.add('b', lambda: started.append('b'), after=['a'])
+    with pytest.raises(ValueError) as exc:
+        scheduler.run()
+    assert exc.value is e
+    assert started == []
+
+
+def test_scheduler_rejects_duplicates():
+    """Each task key may only be registered once."""
+
+    scheduler = Scheduler()
+    scheduler.add('a', lambda: None)
+    with pytest.raises(ValueError):
+        scheduler.add('a', lambda: None)
+
+
+def test_scheduler_detects_cycles():
+    """Tasks that depend on each other can never run."""
+
+    scheduler = Scheduler()
+    scheduler.add('a', lambda: None, after=['b'])
+    scheduler.add('b', lambda: None, after=['a'])
+    with pytest.raises(ValueError):
+        scheduler.run()
+
+
+def test_scheduler_forwards_base_exceptions():
+    """Interrupts in worker threads don't leave the scheduler waiting."""
+
+    def interrupt():
+        raise KeyboardInterrupt()
+
+    scheduler = Scheduler(jobs=2)
+    scheduler.add('a', interrupt)
+    scheduler.add('b', lambda: None)
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.run()
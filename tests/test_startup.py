@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import subprocess
+import sys
+import timeit
+
+from dashex import version
+
+
+HEAVY_MODULES = [
+    'email.utils',
+    'multiprocessing.pool',
+    'pkg_resources',
+    'requests',
+    'urllib3',
+    'zipfile',
+]
+"""Modules that only load once a sub-command needs them."""
+
+
+def test_startup_imports():
+    """The command-line interface starts without heavy dependencies."""
+
+    output = subprocess.check_output([sys.executable, '-c', '; '.join([
+        'import json, sys',
+        'before = set(sys.modules)',
+        'import dashex.__main__',
+        'print(json.dumps(sorted(set(sys.modules) - before)))',
+    ])])
+    loaded = set(json.loads(output.decode('utf-8')))
+    assert 'dashex' in loaded
+    assert loaded.isdisjoint(HEAVY_MODULES)
+
+
+def test_startup_time(benchmark):
+    """Time ``dashex --version``, the floor of every invocation."""
+
+    command = [sys.executable, '-m', 'dashex', '--version']
+    assert subprocess.check_output(command).decode('utf-8').strip() == \
+        version
+    runs = 5
+    seconds = timeit.timeit(
+        lambda: subprocess.check_call(command, stdout=subprocess.PIPE),
+        number=runs,
+    )
+    benchmark('startup', runs, seconds, None)
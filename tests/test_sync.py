@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+
+import mock
+import pytest
+
+from dashex import dashboard_sha256, grafana_sync, strip_datasource
+from dashex._corpus import dashboard_document
+from dashex.__main__ import main
+
+from fakegrafana import FakeGrafana, run_fake_grafana
+
+
+GET_DASHBOARD = ('GET', r'^/api/dashboards/db/([^/]+)$')
+POST_DASHBOARD = ('POST', r'^/api/dashboards/db$')
+POST_DATASOURCE = ('POST', r'^/api/datasources$')
+PUT_DATASOURCE = ('PUT', r'^/api/datasources/(\d+)$')
+
+
+def edit(grafana, slug, **fields):
+    """Change a dashboard on an instance, like a user would."""
+    grafana.save_dashboard({'dashboard': dict(grafana.dashboard(slug),
+                                              **fields)})
+
+
+def same_configuration(source, target):
+    """Check that two instances hold the same data sources and dashboards."""
+    datasources = [
+        sorted((strip_datasource(dict(document))
+                for document in grafana.list_datasources({})),
+               key=lambda document: document['name'])
+        for grafana in (source, target)
+    ]
+    dashboards = [
+        dict(
+            (slug, dashboard_sha256(dashboard_document(
+                grafana.dashboard(slug),
+            )))
+            for slug in grafana.slugs()
+        )
+        for grafana in (source, target)
+    ]
+    return datasources[0] == datasources[1] and \
+        dashboards[0] == dashboards[1]
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_grafana_sync(jobs):
+    """Only objects that differ are copied to the target."""
+
+    source = FakeGrafana(dashboards=6, datasources=2)
+    target = FakeGrafana(dashboards=0, datasources=0)
+    with run_fake_grafana(source) as source_url, \
+            run_fake_grafana(target) as target_url:
+
+        def sync():
+            source.requests.clear()
+            target.requests.clear()
+            return grafana_sync(source_url, target_url, 'admin', 'admin',
+                                'admin', 'admin', jobs=jobs)
+
+        assert sync() == {'uploaded': 8, 'unchanged': 0, 'conflicts': 0}
+        assert same_configuration(source, target)
+
+        # Nothing is uploaded when both sides match.
+        assert sync() == {'uploaded': 0, 'unchanged': 8, 'conflicts': 0}
+        assert source.requests[GET_DASHBOARD] == 6
+        assert target.requests[GET_DASHBOARD] == 6
+        assert target.requests[POST_DASHBOARD] == 0
+        assert target.requests[POST_DATASOURCE] == 0
+        assert target.requests[PUT_DATASOURCE] == 0
+
+        # Changes on either side are overwritten, whatever the versions.
+        edit(source, 'dashboard-1', panels=[])
+        edit(source, 'dashboard-1', refresh='1h')
+        edit(target, 'dashboard-2', panels=[])
+        source.update_datasource(dict(source.list_datasources({})[0],
+                                      url='http://elsewhere'), 1)
+        assert sync() == {'uploaded': 3, 'unchanged': 5, 'conflicts': 0}
+        assert target.requests[PUT_DATASOURCE] == 1
+        assert same_configuration(source, target)
+        assert target.dashboard('dashboard-1')['version'] == 2
+
+
+def test_grafana_sync_conflicts():
+    """Dashboards changed on the target during the sync aren't clobbered."""
+
+    source = FakeGrafana(dashboards=2)
+    target = FakeGrafana(dashboards=2)
+    edit(source, 'dashboard-0', panels=[])
+    with run_fake_grafana(source) as source_url, \
+            run_fake_grafana(target) as target_url:
+        original = target.get_dashboard
+
+        def get_dashboard(query, slug):
+            document = original(query, slug)
+            edit(target, slug, refresh='1h')
+            return document
+
+        target._routes = [
+            (method, pattern, get_dashboard if func == original else func)
+            for method, pattern, func in target._routes
+        ]
+        summary = grafana_sync(source_url, target_url)
+    assert summary == {'uploaded': 0, 'unchanged': 2, 'conflicts': 1}
+
+
+def test_cli_sync():
+    """Both instances are given on the command line."""
+
+    with mock.patch('dashex.grafana_sync') as sync:
+        main(['grafana-sync', '--from', 'http://staging:3000',
+              '--to', 'http://production:3000', '--to-username', 'admin',
+              '--to-password', 'secret', '-j', '4'])
+    sync.assert_called_once_with(
+        source_url='http://staging:3000', source_username=None,
+        source_password=None, target_url='http://production:3000',
+        target_username='admin', target_password='secret', jobs=4,
+        wait=True, wait_timeout=mock.ANY, pool_size=mock.ANY,
+        retries=mock.ANY, max_rate=None, max_concurrency=None,
+        timeout=mock.ANY, deadline=None, progress_interval=mock.ANY,
+        compress=False, compress_min_size=mock.ANY,
+    )
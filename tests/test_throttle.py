@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+
+import mock
+import pytest
+import requests.exceptions
+import threading
+import time
+
+from conftest import HTTPResponseError
+from dashex._http import Client
+from dashex._throttle import RateLimiter, RetryPolicy, parse_retry_after
+
+
+def test_parse_retry_after():
+    """Delays are given either in seconds or as a date."""
+
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('') is None
+    assert parse_retry_after('garbage') is None
+    assert parse_retry_after(' 3 ') == 3.0
+    assert parse_retry_after('Thu, 01 Jan 1970 00:00:10 GMT', now=4.0) == 6.0
+    assert parse_retry_after('Thu, 01 Jan 1970 00:00:10 GMT', now=20.0) == 0.0
+
+
+def test_retry_policy_decisions():
+    """Only transient failures are retried, and only a few times."""
+
+    policy = RetryPolicy(retries=2)
+    assert policy.should_retry(1, 'GET')
+    assert policy.should_retry(2, 'GET', 502)
+    assert not policy.should_retry(3, 'GET', 502)
+    assert not policy.should_retry(1, 'GET', 500)
+    assert not policy.should_retry(1, 'GET', 404)
+    assert policy.should_retry(1, 'PUT', 504)
+
+    # Uploads that may have been processed are not sent twice.
+    assert not policy.should_retry(1, 'POST')
+    assert not policy.should_retry(1, 'POST', 502)
+    assert policy.should_retry(1, 'POST', 429)
+    assert policy.should_retry(1, 'POST', 503)
+
+
+def test_retry_policy_delays():
+    """Delays grow exponentially, with jitter, up to a limit."""
+
+    policy = RetryPolicy(backoff=0.1, max_delay=1.0, random=lambda: 0.5)
+    assert [policy.delay(attempt) for attempt in range(1, 6)] == \
+        [0.05, 0.1, 0.2, 0.4, 0.5]
+    assert policy.delay(1, retry_after=0.7) == 0.7
+    assert policy.delay(1, retry_after=60.0) == 1.0
+
+
+def test_rate_limiter_spacing():
+    """Once the burst is spent, requests are spaced ``1 / rate`` apart."""
+
+    clock = mock.MagicMock(return_value=0.0)
+    limiter = RateLimiter(rate=10.0, burst=2, clock=clock)
+    assert [limiter.reserve() for _ in range(4)] == \
+        pytest.approx([0.0, 0.0, 0.1, 0.2])
+    clock.return_value = 1.0
+    assert limiter.reserve() == 0.0
+    assert RateLimiter().reserve() == 0.0
+
+
+def test_rate_limiter_sleeps():
+    """The limiter waits for its turn when used as a context manager."""
+
+    sleep = mock.MagicMock()
+    limiter = RateLimiter(rate=4.0, clock=lambda: 0.0, sleep=sleep)
+    for _ in range(3):
+        with limiter:
+            pass
+    assert sleep.mock_calls == [mock.call(0.25), mock.call(0.5)]
+
+
+def test_rate_limiter_concurrency():
+    """No more than ``concurrency`` requests are in flight."""
+
+    limiter = RateLimiter(concurrency=2)
+    state = {'running': 0, 'peak': 0}
+    lock = threading.Lock()
+
+    def request():
+        with limiter:
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+
+    threads = [threading.Thread(target=request) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert state['peak'] == 2
+
+
+def test_client_retries(make_http_service):
+    """Transient failures are retried, honoring ``Retry-After``."""
+
+    failures = [
+        HTTPResponseError(503, {}, headers={'Retry-After': '2'}),
+        HTTPResponseError(502, {}),
+    ]
+
+    def search():
+        if failures:
+            raise failures.pop(0)
+        return []
+
+    routes = {
+        'GET': {
+            '/api/search': search,
+        },
+    }
+
+    sleep = mock.MagicMock()
+    policy = RetryPolicy(retries=2, backoff=0.1, random=lambda: 1.0)
+    with make_http_service(routes) as url:
+        with Client(url, retry=policy, sleep=sleep) as client:
+            assert client.get_json('api/search') == []
+    assert sleep.mock_calls == [mock.call(2.0), mock.call(0.2)]
+
+
+def test_client_gives_up(make_http_service):
+    """The last failure is reported once retries are exhausted."""
+
+    def search():
+        raise HTTPResponseError(502, {})
+
+    def create(document):
+        raise HTTPResponseError(502, {})
+
+    routes = {
+        'GET': {
+            '/api/search': search,
+        },
+        'POST': {
+            '/api/datasources': create,
+        },
+    }
+
+    sleep = mock.MagicMock()
+    with make_http_service(routes) as url:
+        with Client(url, retry=RetryPolicy(retries=2), sleep=sleep) as client:
+            with pytest.raises(requests.exceptions.HTTPError):
+                client.get_json('api/search')
+            assert sleep.call_count == 2
+            with pytest.raises(requests.exceptions.HTTPError):
+                client.post_json('api/datasources', data={})
+            assert sleep.call_count == 2
+
+
+def test_client_retries_connection_errors():
+    """Connection failures are retried for idempotent requests."""
+
+    sleep = mock.MagicMock()
+    client = Client('http://127.0.0.1:1', retry=RetryPolicy(retries=2),
+                    sleep=sleep)
+    with client:
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client.get('api/search')
+    assert sleep.call_count == 2
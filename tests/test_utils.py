@@ -5,9 +5,15 @@ import errno
 import mock
 import os.path
 import pytest
+import time
 
 from dashex._utils import (
+    atomic_write,
     ensure_dir,
+    parallel_map,
+    rechunk,
+    update_file,
+    update_file_chunks,
 )
 
 
@@ -41,3 +47,101 @@ def test_ensure_dir_unexpected_error():
         with pytest.raises(OSError) as exc:
             ensure_dir('foo')
         assert exc.value is e
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_parallel_map_preserves_order(jobs):
+    """Results come back in input order, whatever the completion order."""
+
+    def slow_square(x):
+        time.sleep(0.001 * (10 - x))
+        return x * x
+
+    results = list(parallel_map(slow_square, range(10), jobs=jobs))
+    assert results == [x * x for x in range(10)]
+
+
+def test_parallel_map_forwards_errors():
+    """Errors raised by a worker are re-raised in the caller."""
+
+    e = ValueError()
+
+    def fail(x):
+        if x == 3:
+            raise e
+        return x
+
+    with pytest.raises(ValueError) as exc:
+        list(parallel_map(fail, range(10), jobs=4))
+    assert exc.value is e
+
+
+def test_atomic_write(tmpdir):
+    """Files are replaced in one step, without leftover temporary files."""
+
+    path = str(tmpdir.join('foo.json'))
+    atomic_write(path, b'old')
+    atomic_write(path, b'new')
+    with open(path, 'rb') as stream:
+        assert stream.read() == b'new'
+    assert os.listdir(str(tmpdir)) == ['foo.json']
+
+
+def test_atomic_write_failure(tmpdir):
+    """The original file is kept when the write fails."""
+
+    path = str(tmpdir.join('foo.json'))
+    atomic_write(path, b'old')
+    with pytest.raises(TypeError):
+        atomic_write(path, None)
+    with open(path, 'rb') as stream:
+        assert stream.read() == b'old'
+    assert os.listdir(str(tmpdir)) == ['foo.json']
+
+
+def test_update_file(tmpdir):
+    """Files are only rewritten when their contents change."""
+
+    path = str(tmpdir.join('foo.json'))
+    assert update_file(path, b'old')
+    os.utime(path, (0, 0))
+    assert not update_file(path, b'old')
+    assert os.stat(path).st_mtime == 0
+    assert update_file(path, b'new')
+    assert update_file(path, b'newer')
+    with open(path, 'rb') as stream:
+        assert stream.read() == b'newer'
+    assert os.listdir(str(tmpdir)) == ['foo.json']
+
+
+def test_rechunk():
+    """Small chunks are grouped into blocks."""
+
+    assert list(rechunk([b'ab', b'c', b'', b'de', b'f'], 3)) == \
+        [b'abc', b'def']
+    assert list(rechunk([b'abcd', b'e'], 3)) == [b'abcd', b'e']
+    assert list(rechunk([], 3)) == []
+
+
+@pytest.mark.parametrize('old,new', [
+    (None, [b'abc', b'def']),
+    (b'abcdef', [b'ab', b'cd', b'ef']),
+    (b'abcdef', [b'ab', b'cx', b'ef']),
+    (b'abcdef', [b'ab', b'cd']),
+    (b'abcd', [b'ab', b'cd', b'ef']),
+    (b'abcdef', []),
+])
+def test_update_file_chunks(tmpdir, old, new):
+    """Streams are compared with the file as they come."""
+
+    path = str(tmpdir.join('foo.json'))
+    if old is not None:
+        with open(path, 'wb') as stream:
+            stream.write(old)
+        os.utime(path, (0, 0))
+    changed = b''.join(new) != old
+    assert update_file_chunks(path, iter(new)) == changed
+    with open(path, 'rb') as stream:
+        assert stream.read() == b''.join(new)
+    assert (os.stat(path).st_mtime == 0) != changed
+    assert os.listdir(str(tmpdir)) == ['foo.json']
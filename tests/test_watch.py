@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import mock
+import os
+import pytest
+import threading
+
+from dashex import grafana_pull, grafana_watch, watch_folders
+from dashex._watch import (
+    InotifyWatcher,
+    PollingWatcher,
+    wait_for_changes,
+)
+
+from fakegrafana import FakeGrafana, run_fake_grafana
+
+
+GET_SEARCH = ('GET', r'^/api/search$')
+GET_DATASOURCES = ('GET', r'^/api/datasources$')
+POST_DASHBOARD = ('POST', r'^/api/dashboards/db$')
+PUT_DATASOURCE = ('PUT', r'^/api/datasources/(\d+)$')
+
+
+def write(path, data):
+    with open(path, 'w') as stream:
+        stream.write(data)
+
+
+@pytest.fixture(params=['inotify', 'polling'])
+def watcher(request, tmpdir):
+    if request.param == 'inotify':
+        try:
+            watcher = InotifyWatcher([str(tmpdir)])
+        except (AttributeError, OSError):
+            pytest.skip('inotify is unavailable')
+    else:
+        watcher = PollingWatcher([str(tmpdir)], interval=0.01)
+    with watcher:
+        yield watcher
+
+
+def test_watcher(watcher, tmpdir):
+    """Watchers report changed documents, not other files."""
+
+    assert watcher.changes(0.05) == set()
+
+    path = str(tmpdir.join('a.json'))
+    write(path, '{}')
+    write(str(tmpdir.join('.a.json')), '{}')
+    write(str(tmpdir.join('a.txt')), '')
+    assert wait_for_changes(watcher, 0.1) == {path}
+
+    os.unlink(path)
+    assert wait_for_changes(watcher, 0.1) == {path}
+
+
+def test_watcher_debounce(watcher, tmpdir):
+    """Bursts of changes are reported together."""
+
+    paths = [str(tmpdir.join('%d.json' % (i,))) for i in range(3)]
+
+    def edit():
+        for path in paths:
+            write(path, '{}')
+            threading.Event().wait(0.02)
+
+    thread = threading.Thread(target=edit)
+    thread.start()
+    try:
+        changed = wait_for_changes(watcher, 0.2)
+    finally:
+        thread.join()
+    assert changed == set(paths)
+
+
+def test_watch_folders_fallback(tmpdir):
+    """Folders are polled when inotify isn't available."""
+
+    with watch_folders([str(tmpdir)], polling=True) as watcher:
+        assert isinstance(watcher, PollingWatcher)
+    with mock.patch('dashex._watch.InotifyWatcher',
+                    side_effect=OSError(38, 'Function not implemented')):
+        with watch_folders([str(tmpdir)]) as watcher:
+            assert isinstance(watcher, PollingWatcher)
+
+
+@pytest.mark.parametrize('polling', [False, True])
+def test_grafana_watch(tmpdir, polling):
+    """Changed files are pushed, listing the instance only once."""
+
+    grafana = FakeGrafana(dashboards=3, datasources=2)
+    output_path = str(tmpdir)
+    dashboards = os.path.join(output_path, 'grafana', 'dashboards')
+    datasources = os.path.join(output_path, 'grafana', 'datasources')
+    watching = threading.Event()
+    result = {}
+
+    def start(*args):
+        watcher = watch_folders(*args)
+        watching.set()
+        return watcher
+
+    def edit_dashboard(title):
+        path = os.path.join(dashboards, 'dashboard-1.json')
+        with open(path) as stream:
+            document = json.load(stream)
+        document['dashboard']['panels'][0]['title'] = title
+        write(path, json.dumps(document))
+
+    with run_fake_grafana(grafana) as url:
+        grafana_pull(url, 'admin', 'admin', output_path)
+        search = grafana.requests[GET_SEARCH]
+
+        def run():
+            result['summary'] = grafana_watch(
+                url, 'admin', 'admin', output_path, debounce=0.1,
+                polling=polling, poll_interval=0.01, rounds=3,
+            )
+
+        with mock.patch('dashex.watch_folders', side_effect=start):
+            thread = threading.Thread(target=run)
+            thread.start()
+            try:
+                assert watching.wait(5.0)
+                edit_dashboard('Edited')
+                threading.Event().wait(0.5)
+
+                # Editing a pushed dashboard again isn't a version conflict.
+                edit_dashboard('Edited again')
+                threading.Event().wait(0.5)
+
+                # Invalid documents and deletions are ignored.
+                write(os.path.join(dashboards, 'broken.json'), '{')
+                os.unlink(os.path.join(datasources, 'datasource-1.json'))
+            finally:
+                thread.join(10.0)
+
+        assert result['summary'] == {
+            'uploaded': 2,
+            'skipped': 0,
+            'conflicts': 0,
+        }
+        assert grafana.requests[GET_SEARCH] == search + 1
+        assert grafana.requests[GET_DATASOURCES] == 2
+        assert grafana.requests[POST_DASHBOARD] == 2
+        assert grafana.requests[PUT_DATASOURCE] == 0
+        dashboard = grafana.dashboard('dashboard-1')
+        assert dashboard['panels'][0]['title'] == 'Edited again'
+        assert dashboard['version'] == 3